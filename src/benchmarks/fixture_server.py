@@ -0,0 +1,428 @@
+"""Local stand-in for the web endpoints the data sources fetch from
+
+Serves synthetic versions of:
+
+    /tripdata/<yyyymm>-citibike-tripdata.csv.zip   S3 trip data bucket
+    /mta/turnstile.html, /mta/data/nyct/turnstile/  MTA developer site
+    /soda/resource/<id>.geojson                     NYC Open Data SODA API
+    /gbfs/station_information.json                  GBFS feeds
+    /sas/project-feedback-map/..., /sas/views/ajax  Suggest-A-Station pages
+
+with configurable latency, bandwidth and failure injection, so that
+download concurrency, retries and caching are benchmarked without the
+network. point_sources_at() redirects the source classes to a server.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import click
+import synthetic
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+
+# extent of the synthetic open data and comment points
+LON_RANGE = synthetic.LON_RANGE
+LAT_RANGE = synthetic.LAT_RANGE
+
+
+@dataclass
+class FixtureConfig:
+    """Behaviour of the fixture server.
+
+    Attributes:
+    latency: seconds added before every response
+    bandwidth: bytes per second responses are throttled to; None for no limit
+    failure_rate: fraction of requests answered with a 503
+    seed: seed of the synthetic data and of the failure injection
+    trips_per_month: rows of each trip zip
+    typo_months: (year, month) pairs only served under the "citbike" name
+    turnstile_weeks: weeks listed in the MTA catalog
+    turnstile_units: turnstiles per week file
+    soda_rows: features of every SODA resource
+    soda_where: accept $where; if False the query is rejected with a 400
+    gbfs_stations: stations of the GBFS feeds
+    sas_comments: approved Suggest-A-Station comments, newest first
+    sas_page_size: comments per Drupal AJAX page
+    """
+
+    latency: float = 0.0
+    bandwidth: float = None
+    failure_rate: float = 0.0
+    seed: int = 0
+    trips_per_month: int = 10_000
+    typo_months: set = field(default_factory=lambda: {(2017, 7)})
+    turnstile_weeks: int = 4
+    turnstile_units: int = 500
+    soda_rows: int = 10_000
+    soda_where: bool = True
+    gbfs_stations: int = 1_500
+    sas_comments: int = 1_000
+    sas_page_size: int = 50
+
+
+def _comment_html(comment):
+    return (
+        f'<article class="approved-comment" id="comment-{comment["id"]}" '
+        f'data-comment-category-id="{comment["category_id"]}" '
+        f'data-comment-lng="{comment["lon"]}" data-comment-lat="{comment["lat"]}" '
+        f'data-comment-user-id="{comment["user"]}" '
+        f'data-comment-locsumm="{comment["location"]}">'
+        f'<p>{comment["description"]}</p></article>'
+    )
+
+
+class FixtureData:
+    """Synthetic response bodies, generated on first request and kept on disk."""
+
+    trip_re = re.compile(r"^(\d{4})(\d{2})-(citi|cit)bike-tripdata\.csv\.zip$")
+    turnstile_re = re.compile(r"^turnstile_(\d{6})\.txt$")
+
+    def __init__(self, data_dir, config):
+        self.data_dir = Path(data_dir)
+        self.config = config
+        self._lock = threading.Lock()
+        rng = random.Random(config.seed)
+        self.comments = [
+            {
+                "id": 100_000 + i,
+                "category_id": rng.choice([1, 2, 3]),
+                "lon": round(rng.uniform(*LON_RANGE), 6),
+                "lat": round(rng.uniform(*LAT_RANGE), 6),
+                "user": rng.randrange(1, 5000),
+                "location": f"Synthetic St & {i} Ave",
+                "description": f"Please add a station here ({i})",
+            }
+            for i in range(config.sas_comments)
+        ]
+
+    def add_comments(self, n):
+        """Post n new comments, as between two scraper runs."""
+        with self._lock:
+            start = self.comments[-1]["id"] + 1 if self.comments else 100_000
+            for i in range(n):
+                comment = dict(self.comments[i % len(self.comments)])
+                comment["id"] = start + i
+                self.comments.append(comment)
+
+    def _newest_first(self):
+        return self.comments[::-1]
+
+    def trip_zip(self, name):
+        match = self.trip_re.match(name)
+        if match is None:
+            return None
+        year, month = int(match.group(1)), int(match.group(2))
+        typo = (year, month) in self.config.typo_months
+        if typo != (match.group(3) == "cit"):
+            return None
+        with self._lock:
+            path = self.data_dir.joinpath(
+                "tripdata", f"{year}{month:02d}-citibike-tripdata.csv.zip"
+            )
+            if not path.exists():
+                synthetic.write_trip_zip(
+                    path.parent,
+                    year,
+                    month,
+                    self.config.trips_per_month,
+                    seed=self.config.seed,
+                )
+        return path.read_bytes()
+
+    def _turnstile_dir(self):
+        out_dir = self.data_dir.joinpath("turnstile")
+        with self._lock:
+            if not out_dir.exists():
+                synthetic.write_turnstile_weeks(
+                    out_dir,
+                    PROJECT_DIR.joinpath("data", "raw", "mta", "remote_complex_lookup.csv"),
+                    self.config.turnstile_weeks,
+                    self.config.turnstile_units,
+                    seed=self.config.seed,
+                )
+        return out_dir
+
+    def turnstile_catalog(self):
+        links = "".join(
+            f'<a href="data/nyct/turnstile/{f.name}">{f.stem}</a><br/>'
+            for f in sorted(self._turnstile_dir().glob("turnstile_*.txt"), reverse=True)
+        )
+        return f'<html><body><div class="last">{links}</div></body></html>'.encode()
+
+    def turnstile_file(self, name):
+        if self.turnstile_re.match(name) is None:
+            return None
+        path = self._turnstile_dir().joinpath(name)
+        return path.read_bytes() if path.exists() else None
+
+    def soda_page(self, params):
+        """FeatureCollection for the $offset/$limit window of a resource."""
+        offset = int(params.get("$offset", 0))
+        limit = int(params.get("$limit", 1000))
+        select = params.get("$select")
+        columns = None if select is None else {c.strip() for c in select.split(",")}
+
+        features = []
+        for i in range(offset, min(offset + limit, self.config.soda_rows)):
+            rng = random.Random(self.config.seed * 1_000_003 + i)
+            properties = {"objectid": i, "name": f"feature {i}", "value": i % 7}
+            if columns is not None:
+                properties = {k: v for k, v in properties.items() if k in columns}
+            features.append(
+                {
+                    "type": "Feature",
+                    "geometry": {
+                        "type": "Point",
+                        "coordinates": [
+                            round(rng.uniform(*LON_RANGE), 6),
+                            round(rng.uniform(*LAT_RANGE), 6),
+                        ],
+                    },
+                    "properties": properties,
+                }
+            )
+        return json.dumps({"type": "FeatureCollection", "features": features}).encode()
+
+    def gbfs_station_information(self):
+        path = self.data_dir.joinpath("gbfs", "station_information.json.gz")
+        with self._lock:
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                synthetic.write_station_information(
+                    path, self.config.gbfs_stations, self.config.seed
+                )
+        with gzip.open(path, "rb") as f:
+            return f.read()
+
+    def gbfs_station_status(self):
+        # a fresh capture per request, as the live feed changes every minute
+        now = datetime.now().replace(microsecond=0)
+        out_dir = self.data_dir.joinpath("gbfs", "status")
+        with self._lock:
+            (path,) = synthetic.write_status_snapshots(
+                out_dir,
+                1,
+                self.config.gbfs_stations,
+                start=now - timedelta(seconds=now.second),
+                seed=self.config.seed,
+            )
+        with gzip.open(path, "rb") as f:
+            return f.read()
+
+    def sas_base_page(self):
+        comments = self._newest_first()
+        first = "".join(_comment_html(c) for c in comments[: self.config.sas_page_size])
+        return (
+            "<html><body>"
+            f'<span class="comments-count">{len(comments)}</span>'
+            f"<div>{first}</div>"
+            "</body></html>"
+        ).encode()
+
+    def sas_ajax_page(self, page):
+        size = self.config.sas_page_size
+        comments = self._newest_first()[page * size : (page + 1) * size]
+        html = "".join(_comment_html(c) for c in comments)
+        return json.dumps(
+            [
+                {"command": "settings", "settings": {}, "merge": True},
+                {
+                    "command": "insert",
+                    "method": "infiniteScrollInsertView",
+                    "selector": ".js-view-dom-id",
+                    "data": f"<div>{html}</div>",
+                },
+            ]
+        ).encode()
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+    def _send(self, status, body=b"", content_type="application/octet-stream"):
+        server = self.server
+        config = server.config
+        if config.latency > 0:
+            time.sleep(config.latency)
+
+        if status == 200 and server.inject_failure():
+            status, body = 503, b"injected failure"
+
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status == 200:
+            self.send_header("ETag", etag)
+        self.end_headers()
+
+        chunk = 1 << 16
+        for start in range(0, len(body), chunk):
+            self.wfile.write(body[start : start + chunk])
+            if config.bandwidth:
+                time.sleep(min(chunk, len(body) - start) / config.bandwidth)
+        server.count(status, len(body))
+
+    def _route(self, method, body=None):
+        parts = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        segments = parts.path.strip("/").split("/")
+        data = self.server.data
+        service, name = segments[0], segments[-1]
+
+        content, content_type = None, "application/json"
+        if method == "GET" and service == "tripdata":
+            content, content_type = data.trip_zip(name), "application/zip"
+        elif method == "GET" and service == "mta" and name == "turnstile.html":
+            content, content_type = data.turnstile_catalog(), "text/html"
+        elif method == "GET" and service == "mta":
+            content, content_type = data.turnstile_file(name), "text/plain"
+        elif method == "GET" and service == "soda" and name.endswith(".geojson"):
+            if "$where" in params and not self.server.config.soda_where:
+                return self._send(400, b"query rejected", "text/plain")
+            content = data.soda_page(params)
+        elif method == "GET" and service == "gbfs":
+            if name == "station_information.json":
+                content = data.gbfs_station_information()
+            elif name == "station_status.json":
+                content = data.gbfs_station_status()
+        elif method == "GET" and service == "sas" and name == "suggest-station-infill":
+            content, content_type = data.sas_base_page(), "text/html"
+        elif method == "POST" and service == "sas" and name == "ajax":
+            form = {k: v[-1] for k, v in parse_qs(body.decode()).items()}
+            content = data.sas_ajax_page(int(form.get("page", 0)))
+
+        if content is None:
+            return self._send(404, b"not found", "text/plain")
+        return self._send(200, content, content_type)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self._route("POST", self.rfile.read(length))
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """Threaded fixture server; use as a context manager to run it in the background.
+
+    Attributes:
+    url: root url of the server
+    config: FixtureConfig, may be changed while running
+    data: FixtureData serving the response bodies
+    stats: counters of requests, failures, not found and bytes sent
+    """
+
+    def __init__(self, data_dir, config=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), FixtureHandler)
+        self.config = config or FixtureConfig()
+        self.data = FixtureData(data_dir, self.config)
+        self.stats = {"requests": 0, "failures": 0, "not_found": 0, "bytes_sent": 0}
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def inject_failure(self):
+        with self._lock:
+            return self._rng.random() < self.config.failure_rate
+
+    def count(self, status, n_bytes):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_sent"] += n_bytes
+            if status == 503:
+                self.stats["failures"] += 1
+            elif status == 404:
+                self.stats["not_found"] += 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self._thread.join()
+        self.server_close()
+
+
+def source_urls(url):
+    """Base urls of each source on a fixture server at url."""
+    return {
+        "tripdata": f"{url}/tripdata/",
+        "mta": f"{url}/mta/",
+        "soda": f"{url}/soda",
+        "gbfs": f"{url}/gbfs/",
+        "sas": f"{url}/sas",
+    }
+
+
+def point_sources_at(url):
+    """Redirect every source class to the fixture server at url."""
+    from citibike import TripData
+    from gbfs import Stations
+    from mta import MtaTurnstiles
+    from open_data import OpenDataSource
+    from sas import SuggestAStation
+
+    bases = source_urls(url)
+    TripData.base_url = bases["tripdata"]
+    MtaTurnstiles.base_url = bases["mta"]
+    MtaTurnstiles.catalog_url = bases["mta"] + "turnstile.html"
+    OpenDataSource.base_url = bases["soda"]
+    Stations.base_url = bases["gbfs"]
+    SuggestAStation.base_url = bases["sas"]
+
+
+@click.command()
+@click.option("--port", type=int, default=8765)
+@click.option("--latency", type=float, default=0.0, help="Seconds added per response")
+@click.option("--bandwidth", type=float, default=None, help="Bytes per second")
+@click.option("--failure-rate", type=float, default=0.0, help="Fraction of 503s")
+@click.option("--seed", type=int, default=0)
+@click.option(
+    "--data-dir",
+    type=click.Path(file_okay=False),
+    default=str(PROJECT_DIR.joinpath("data", "interim", "fixtures")),
+    help="Where generated response bodies are kept",
+)
+def main(port, latency, bandwidth, failure_rate, seed, data_dir):
+    config = FixtureConfig(
+        latency=latency, bandwidth=bandwidth, failure_rate=failure_rate, seed=seed
+    )
+    with FixtureServer(data_dir, config, port=port) as server:
+        for name, base in source_urls(server.url).items():
+            click.echo(f"{name:>8}: {base}")
+        try:
+            server._thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+    main()
@@ -0,0 +1,192 @@
+"""Offline benchmarks of the ingest paths on seeded synthetic data
+
+Each benchmark generates its raw inputs (Citi Bike trip zips in both
+schemas, GBFS status captures, MTA turnstile weeks) untimed, then runs
+the real ingest code under instrument spans. The fetch benchmark
+downloads from a local fixture server with simulated latency, first with
+an empty HTTP cache and then revalidating it. Results are written to
+reports/benchmarks/<timestamp>.json and compared with the previous run
+at the same scale, so regressions show up without any network access.
+"""
+import logging
+import os
+import sys
+import tempfile
+from datetime import date
+from pathlib import Path
+
+import click
+
+# the data modules use flat imports, as when run from src/data
+sys.path.insert(0, str(Path(__file__).resolve().parents[1].joinpath("data")))
+
+import instrument  # noqa: E402
+import synthetic  # noqa: E402
+from fixture_server import FixtureConfig, FixtureServer, point_sources_at  # noqa: E402
+
+PROJECT_DIR = Path(__file__).resolve().parents[2]
+REPORT_DIR = PROJECT_DIR.joinpath("reports", "benchmarks")
+
+# sizes at --scale 1
+TRIPS_PER_MONTH = 200_000
+# one month in the legacy schema, one in the current one
+TRIP_MONTHS = ((2020, 12), (2021, 3))
+GBFS_STATIONS = 1_500
+GBFS_SNAPSHOTS = 96
+MTA_UNITS = 4_000
+MTA_WEEKS = 2
+SODA_ROWS = 50_000
+SODA_PAGE_SIZE = 5_000
+FETCH_LATENCY = 0.05
+
+
+def bench_citibike(work_dir, scale, seed):
+    from citibike import TripData
+
+    raw_dir = work_dir.joinpath("citibike")
+    n_trips = int(TRIPS_PER_MONTH * scale)
+    for year, month in TRIP_MONTHS:
+        synthetic.write_trip_zip(raw_dir, year, month, n_trips, GBFS_STATIONS, seed)
+
+    trips = TripData(raw_dir, work_dir.joinpath("citibike.gpkg"), 2020, 12, 2021, 3)
+    with instrument.span("citibike", rows=n_trips * len(TRIP_MONTHS)):
+        trips.to_gpkg(replace=True)
+
+
+def bench_gbfs(work_dir, scale, seed):
+    from gbfs import Stations, StationStatus
+
+    raw_dir = work_dir.joinpath("gbfs")
+    n_snapshots = max(int(GBFS_SNAPSHOTS * scale), 1)
+    synthetic.write_status_snapshots(raw_dir, n_snapshots, GBFS_STATIONS, seed=seed)
+    info_file = synthetic.write_station_information(
+        work_dir.joinpath("station_information.json.gz"), GBFS_STATIONS, seed
+    )
+
+    gpkg = work_dir.joinpath("gbfs.gpkg")
+    Stations(local_file=info_file).process(output_file=gpkg, replace=True)
+
+    status = StationStatus(gpkg, raw_dir)
+    with instrument.span("gbfs", rows=n_snapshots * GBFS_STATIONS):
+        status.process()
+        status.create_summaries()
+
+
+def bench_mta(work_dir, scale, seed):
+    from mta import MtaTurnstiles
+
+    mta_dir = PROJECT_DIR.joinpath("data", "raw", "mta")
+    lookup_csv = mta_dir.joinpath("remote_complex_lookup.csv")
+    raw_dir = work_dir.joinpath("mta")
+    n_units = max(int(MTA_UNITS * scale), 1)
+    synthetic.write_turnstile_weeks(raw_dir, lookup_csv, MTA_WEEKS, n_units, seed)
+
+    turnstiles = MtaTurnstiles(
+        raw_dir,
+        work_dir.joinpath("mta.gpkg"),
+        date(2019, 1, 1),
+        date(2019, 12, 31),
+        offline=True,
+    )
+    turnstiles.setup_gpkg(lookup_csv, mta_dir.joinpath("stations.csv"), replace=True)
+    # 42 four-hourly observations per unit and week
+    with instrument.span("mta", rows=n_units * 42 * MTA_WEEKS):
+        turnstiles.raw_to_gpkg()
+
+
+def bench_fetch(work_dir, scale, seed):
+    import http_cache
+    import util
+    from citibike import TripData
+
+    config = FixtureConfig(
+        latency=FETCH_LATENCY,
+        seed=seed,
+        soda_rows=max(int(SODA_ROWS * scale), 1),
+        trips_per_month=max(int(TRIPS_PER_MONTH * scale / 10), 1),
+    )
+    # July 2017 is only published under the "citbike" typo name
+    months = [(2017, 6), (2017, 7)]
+    with FixtureServer(work_dir.joinpath("fixtures"), config) as server:
+        point_sources_at(server.url)
+        for year, month in months:
+            server.data.trip_zip(f"{year}{month:02d}-citibike-tripdata.csv.zip")
+            server.data.trip_zip(f"{year}{month:02d}-citbike-tripdata.csv.zip")
+
+        http_cache.configure(cache_dir=work_dir.joinpath("http_cache"))
+        raw_dir = work_dir.joinpath("tripdata")
+        raw_dir.mkdir(exist_ok=True)
+        trips = TripData(raw_dir, work_dir.joinpath("citibike.gpkg"), 2017, 6, 2017, 7)
+        soda_url = f"{server.url}/soda/resource/fixture.geojson"
+
+        # recorded as fetch/cold and fetch/warm, reported under fetch
+        with instrument.span("fetch"):
+            for run in ("cold", "warm"):
+                with instrument.span(run, rows=config.soda_rows):
+                    util.gdf_from_url(
+                        soda_url, limit=config.soda_rows, page_size=SODA_PAGE_SIZE
+                    )
+                    trips.download_raw(redownload=True)
+        logging.getLogger(__name__).info(
+            f"fixture server: {server.stats}, cache: {http_cache.get_cache().stats}"
+        )
+
+
+BENCHMARKS = {
+    "citibike": bench_citibike,
+    "gbfs": bench_gbfs,
+    "mta": bench_mta,
+    "fetch": bench_fetch,
+}
+
+
+@click.command()
+@click.option(
+    "--only",
+    help=f"Comma separated benchmarks to run, of {','.join(BENCHMARKS)}",
+)
+@click.option("--scale", type=float, default=1.0, help="Multiplier of input sizes")
+@click.option("--seed", type=int, default=0, help="Seed of the synthetic data")
+@click.option(
+    "--work-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Keep generated inputs and outputs here instead of a temporary directory",
+)
+@click.option(
+    "--threshold",
+    type=float,
+    default=1.25,
+    help="Slowdown versus the previous run reported as a regression",
+)
+def main(only, scale, seed, work_dir, threshold):
+    logger = logging.getLogger(__name__)
+    names = list(BENCHMARKS) if only is None else only.split(",")
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise click.BadParameter(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(work_dir or tmp)
+        for name in names:
+            bench_dir = root.joinpath(name)
+            bench_dir.mkdir(parents=True, exist_ok=True)
+            logger.info(f"running {name} benchmark at scale {scale}")
+            BENCHMARKS[name](bench_dir, scale, seed)
+
+    summary = instrument.get_recorder().summary()
+    for name in names:
+        for span_name, t in summary.items():
+            if span_name == name or span_name.startswith(f"{name}/"):
+                rate = "" if t["rows_per_s"] is None else f", {t['rows_per_s']:,.0f} rows/s"
+                logger.info(f"{span_name}: {t['seconds']:.2f}s{rate}")
+
+    instrument.finish_run(REPORT_DIR, command=f"benchmark scale={scale}", threshold=threshold)
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO").upper(), format=log_fmt
+    )
+    main()
@@ -0,0 +1,252 @@
+"""Seeded synthetic inputs shaped like the raw files of each ingest path"""
+
+import gzip
+import json
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# rough extent of the Citi Bike system
+LON_RANGE = (-74.03, -73.90)
+LAT_RANGE = (40.65, 40.82)
+
+
+def _stations(rng, n_stations):
+    ids = np.arange(1, n_stations + 1)
+    return pd.DataFrame(
+        {
+            "legacy_id": ids.astype(str),
+            "modern_id": [f"{5000 + i}.{i % 100:02d}" for i in ids],
+            "name": [f"Synthetic St & {i} Ave" for i in ids],
+            "lon": rng.uniform(*LON_RANGE, n_stations).round(6),
+            "lat": rng.uniform(*LAT_RANGE, n_stations).round(6),
+            "capacity": rng.integers(15, 60, n_stations),
+        }
+    )
+
+
+def _trip_times(rng, year, month, n_trips):
+    start = datetime(year, month, 1)
+    days = (datetime(year + month // 12, month % 12 + 1, 1) - start).days
+    started = pd.to_datetime(start) + pd.to_timedelta(
+        np.sort(rng.uniform(0, days * 86400 - 7200, n_trips)), unit="s"
+    )
+    duration = pd.to_timedelta(rng.gamma(2.0, 400.0, n_trips).round() + 60, unit="s")
+    return started, started + duration
+
+
+def write_trip_zip(out_dir, year, month, n_trips, n_stations=1500, seed=0):
+    """Write a monthly Citi Bike trip zip in the schema of its period.
+
+    Months before February 2021 use the legacy schema ("start station id",
+    "starttime" with fractional seconds, ...); later months use the
+    current one ("start_station_id", "started_at", "member_casual", ...).
+
+    Returns:
+    path of the zip file
+    """
+    rng = np.random.default_rng([seed, year, month])
+    stations = _stations(np.random.default_rng(seed), n_stations)
+    start_idx = rng.integers(0, n_stations, n_trips)
+    end_idx = rng.integers(0, n_stations, n_trips)
+    s = stations.iloc[start_idx].reset_index(drop=True)
+    e = stations.iloc[end_idx].reset_index(drop=True)
+    started, ended = _trip_times(rng, year, month, n_trips)
+
+    if (year, month) < (2021, 2):
+        df = pd.DataFrame(
+            {
+                "tripduration": (ended - started).total_seconds().astype(int),
+                "starttime": started.strftime("%Y-%m-%d %H:%M:%S.%f").str[:-2],
+                "stoptime": ended.strftime("%Y-%m-%d %H:%M:%S.%f").str[:-2],
+                "start station id": s.legacy_id,
+                "start station name": s["name"],
+                "start station latitude": s.lat,
+                "start station longitude": s.lon,
+                "end station id": e.legacy_id,
+                "end station name": e["name"],
+                "end station latitude": e.lat,
+                "end station longitude": e.lon,
+                "bikeid": rng.integers(14000, 50000, n_trips),
+                "usertype": rng.choice(["Subscriber", "Customer"], n_trips, p=[0.8, 0.2]),
+                "birth year": rng.integers(1950, 2005, n_trips),
+                "gender": rng.integers(0, 3, n_trips),
+            }
+        )
+    else:
+        df = pd.DataFrame(
+            {
+                "ride_id": [f"{x:016X}" for x in rng.integers(0, 2**62, n_trips)],
+                "rideable_type": rng.choice(
+                    ["classic_bike", "electric_bike"], n_trips, p=[0.7, 0.3]
+                ),
+                "started_at": started.strftime("%Y-%m-%d %H:%M:%S"),
+                "ended_at": ended.strftime("%Y-%m-%d %H:%M:%S"),
+                "start_station_name": s["name"],
+                "start_station_id": s.modern_id,
+                "end_station_name": e["name"],
+                "end_station_id": e.modern_id,
+                "start_lat": s.lat,
+                "start_lng": s.lon,
+                "end_lat": e.lat,
+                "end_lng": e.lon,
+                "member_casual": rng.choice(["member", "casual"], n_trips, p=[0.8, 0.2]),
+            }
+        )
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    name = f"{year}{month:02d}-citibike-tripdata.csv"
+    path = out_dir.joinpath(f"{name}.zip")
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(name, df.to_csv(index=False))
+    return path
+
+
+def write_station_information(path, n_stations=1500, seed=0):
+    """Write a gzip GBFS station_information.json for n_stations."""
+    stations = _stations(np.random.default_rng(seed), n_stations)
+    records = [
+        {
+            "station_id": f"sid-{row.legacy_id}",
+            "legacy_id": row.legacy_id,
+            "external_id": f"ext-{row.legacy_id}",
+            "lon": row.lon,
+            "lat": row.lat,
+            "name": row.name,
+            "short_name": row.modern_id,
+            "station_type": "classic",
+            "capacity": int(row.capacity),
+            "eightd_has_key_dispenser": False,
+            "rental_methods": ["KEY", "CREDITCARD"],
+            "has_kiosk": True,
+            "electric_bike_surcharge_waiver": False,
+            "region_id": "71",
+        }
+        for row in stations.itertuples()
+    ]
+    with gzip.open(path, "wt") as f:
+        json.dump({"data": {"stations": records}}, f)
+    return Path(path)
+
+
+def write_status_snapshots(
+    out_dir, n_snapshots, n_stations=1500, start=datetime(2023, 3, 6), seed=0
+):
+    """Write GBFS station_status captures every 15 minutes, as the scraper does.
+
+    Files are named <YYYY-MM-DD_HH:MM:SS>_station_status.json.gz. About a
+    third of the stations do not report between captures, so stale rows occur.
+
+    Returns:
+    list of paths
+    """
+    rng = np.random.default_rng(seed)
+    stations = _stations(np.random.default_rng(seed), n_stations)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    capacity = stations.capacity.to_numpy()
+    bikes = rng.integers(0, capacity + 1)
+    last_reported = np.full(n_stations, int(start.timestamp()) - 60)
+    paths = []
+    for i in range(n_snapshots):
+        captured = start + timedelta(minutes=15 * i)
+        reporting = rng.random(n_stations) > 0.3
+        bikes = np.clip(bikes + rng.integers(-3, 4, n_stations) * reporting, 0, capacity)
+        last_reported = np.where(
+            reporting, int(captured.timestamp()) - rng.integers(0, 300, n_stations), last_reported
+        )
+        disabled = rng.integers(0, 2, n_stations)
+        records = []
+        for j, row in enumerate(stations.itertuples()):
+            status = {
+                "station_id": f"sid-{row.legacy_id}",
+                "legacy_id": row.legacy_id,
+                "is_installed": 1,
+                "num_docks_disabled": int(disabled[j]),
+                "num_docks_available": int(capacity[j] - bikes[j] - disabled[j]),
+                "eightd_has_available_keys": False,
+                "station_status": "active",
+                "num_bikes_available": int(bikes[j]),
+                "num_bikes_disabled": 0,
+                "num_ebikes_available": int(bikes[j] // 5),
+                "num_scooters_available": 0,
+                "num_scooters_unavailable": 0,
+                "is_returning": 1,
+                "is_renting": 1,
+                "last_reported": int(last_reported[j]),
+            }
+            if j % 50 == 0:
+                status["valet"] = {
+                    "valet_revision": 1,
+                    "active": False,
+                    "off_dock_count": 0,
+                    "off_dock_capacity": 0,
+                    "dock_blocked_count": 0,
+                }
+            records.append(status)
+
+        path = out_dir.joinpath(f"{captured:%Y-%m-%d_%H:%M:%S}_station_status.json.gz")
+        with gzip.open(path, "wt") as f:
+            json.dump({"data": {"stations": records}}, f)
+        paths.append(path)
+    return paths
+
+
+def write_turnstile_weeks(out_dir, remote_lookup_csv, n_weeks, n_units=4000, seed=0):
+    """Write weekly MTA turnstile text files with 4-hourly cumulative counters.
+
+    Units are spread over the real remote/booth pairs of remote_lookup_csv so
+    that the complex lookups of MtaTurnstiles find them.
+
+    Returns:
+    list of paths
+    """
+    rng = np.random.default_rng(seed)
+    lookup = pd.read_csv(remote_lookup_csv).drop_duplicates(["remote", "booth"])
+    units = lookup.iloc[rng.integers(0, len(lookup), n_units)].reset_index(drop=True)
+    # unique per unit, as remote/booth pairs repeat
+    units["scp"] = [
+        f"{i // 10000:02d}-{i // 100 % 100:02d}-{i % 100:02d}" for i in range(n_units)
+    ]
+
+    entries = rng.integers(0, 10**7, n_units)
+    exits = rng.integers(0, 10**7, n_units)
+    # turnstile week files end on a Friday and are published on Saturday
+    week_start = datetime(2019, 1, 5)
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for week in range(n_weeks):
+        start = week_start + timedelta(days=7 * week)
+        frames = []
+        for step in range(42):
+            observed = start + timedelta(hours=4 * step)
+            entries = entries + rng.poisson(150, n_units)
+            exits = exits + rng.poisson(120, n_units)
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "C/A": units.booth,
+                        "UNIT": units.remote,
+                        "SCP": units.scp,
+                        "STATION": units.station,
+                        "LINENAME": units.line_name,
+                        "DIVISION": units.division,
+                        "DATE": observed.strftime("%m/%d/%Y"),
+                        "TIME": observed.strftime("%H:%M:%S"),
+                        "DESC": "REGULAR",
+                        "ENTRIES": entries,
+                        "EXITS                                                               ": exits,
+                    }
+                )
+            )
+        path = out_dir.joinpath(f"turnstile_{start + timedelta(days=7):%y%m%d}.txt")
+        pd.concat(frames).to_csv(path, index=False)
+        paths.append(path)
+    return paths
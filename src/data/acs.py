@@ -1,36 +1,159 @@
-import cenpy
+import re
+import sqlite3
+from pathlib import Path
+
+import clip_mask
 import geopandas as gpd
+import http_cache
+import pandas as pd
 import util
 
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parents[2].joinpath(
+    "data", "raw", "acs_cache"
+)
+
+# Census data API dataset of each cenpy product, by vintage
+API_NAMES = {
+    "ACS": "ACSDT5Y{year}",
+    "Decennial2010": "DECENNIALSF1{year}",
+}
+
+
+def _geoid(df):
+    """GEOID of each row; built from the FIPS parts if cenpy did not return it"""
+    if "GEOID" in df.columns:
+        return df.GEOID.astype(str)
+    return (df.state + df.county + df.tract).astype(str)
+
 
 class CensusSource(util.Source):
-    """Holds information about a source from the 2019 American Community Survey.
+    """Holds information about a source from the American Community Survey.
+
+    Tract geometries and variable values are cached in one GeoPackage per
+    (product, year, place, level): a "tracts" layer with the geometries and
+    a "variables" table with a column per variable fetched so far. Variables
+    missing from the cache are fetched from the Census data API for the
+    counties of the cached tracts only, without geometries, and merged in.
 
     Attributes:
     place: Representation of place (e.g. "New York, NY") to pass to cenpy query
     variables: List of census variable names to pass to cenpy query
+    product: name of the cenpy product, e.g. "ACS"
+    year: vintage of the product
+    level: geographic level of the query
+    cache_dir: directory of the cached GeoPackages
     """
 
     def __init__(
-        self, name: str, description: str, epsg: int, place: str, variables: list
+        self,
+        name: str,
+        description: str,
+        epsg: int,
+        place: str,
+        variables: list,
+        product="ACS",
+        year=2019,
+        level="tract",
+        cache_dir=DEFAULT_CACHE_DIR,
     ):
         self.place = place
         self.variables = variables
+        self.product = product
+        self.year = year
+        self.level = level
+        self.cache_dir = Path(cache_dir)
         super().__init__(name=name, description=description, epsg=epsg)
 
-    def get(self):
+    @property
+    def cache_file(self):
+        place = re.sub(r"[^a-z0-9]+", "_", self.place.lower()).strip("_")
+        return self.cache_dir.joinpath(
+            f"{self.product.lower()}_{self.year}_{self.level}_{place}.gpkg"
+        )
+
+    def _fetch(self, variables):
         """Use cenpy to request American Community Census data."""
-        # Set source to ACS 2019 5-year estimates
-        acs = cenpy.products.ACS(2019)
+        import cenpy
+
+        product = getattr(cenpy.products, self.product)(self.year)
         # Download data for place name (clipping likely necessary)
-        gdf = acs.from_place(
+        return product.from_place(
             place=self.place,
-            level="tract",
-            variables=self.variables,
+            level=self.level,
+            variables=variables,
             strict_within=False,
         )
-        gdf.set_crs(self.epsg, inplace=True)
-        return gdf
+
+    def _fetch_values(self, variables, geoids):
+        """Request variables from the Census data API for the counties of geoids.
+
+        Unlike _fetch this neither geocodes the place nor queries the tract
+        geometries.
+
+        Returns:
+        DataFrame of GEOID and variables
+        """
+        from cenpy.remote import APIConnection
+
+        api = APIConnection(API_NAMES[self.product].format(year=self.year))
+        counties = sorted({(g[:2], g[2:5]) for g in geoids})
+        frames = [
+            api.query(
+                variables,
+                geo_unit=f"{self.level}:*",
+                geo_filter={"state": state, "county": county},
+            )
+            for state, county in counties
+        ]
+        values = pd.concat(frames, ignore_index=True)
+        values["GEOID"] = _geoid(values)
+        values[variables] = values[variables].apply(pd.to_numeric, errors="coerce")
+        return values[["GEOID"] + variables]
+
+    def _read_cache(self):
+        if not self.cache_file.exists():
+            return None, None
+        tracts = gpd.read_file(self.cache_file, layer="tracts")
+        with sqlite3.connect(self.cache_file) as con:
+            values = pd.read_sql("SELECT * FROM variables", con)
+        return tracts, values
+
+    def _write_values(self, values):
+        with sqlite3.connect(self.cache_file) as con:
+            values.to_sql("variables", con, if_exists="replace", index=False)
+
+    def get(self):
+        """Return tract geometries with the requested variables.
+
+        Raises:
+        http_cache.CacheMiss in offline mode if anything is not cached
+        """
+        offline = http_cache.get_cache().offline
+        tracts, values = self._read_cache()
+
+        if tracts is None:
+            if offline:
+                raise http_cache.CacheMiss(f"{self.cache_file.name} is not cached")
+            gdf = self._fetch(self.variables)
+            gdf["GEOID"] = _geoid(gdf)
+            gdf.set_crs(self.epsg, inplace=True, allow_override=True)
+            tracts = gdf.drop(columns=self.variables)
+            values = pd.DataFrame(gdf[["GEOID"] + self.variables])
+            util.write_gpkg({"tracts": tracts}, self.cache_file, replace=True)
+            self._write_values(values)
+
+        missing = [v for v in self.variables if v not in values.columns]
+        if len(missing) > 0:
+            if offline:
+                raise http_cache.CacheMiss(
+                    f"{', '.join(missing)} not cached in {self.cache_file.name}"
+                )
+            new = self._fetch_values(missing, values.GEOID)
+            values = values.merge(new, on="GEOID", how="left")
+            self._write_values(values)
+
+        values = values[["GEOID"] + self.variables]
+        return tracts.merge(values, on="GEOID", how="left")
 
 
 def get_census_acs_pop(crs=2263, mask=None):
@@ -47,11 +170,11 @@ def get_census_acs_pop(crs=2263, mask=None):
     census_acs_pop.rename(columns={"B01003_001E": "population"}, inplace=True)
 
     if mask is not None:
-        census_acs_pop = gpd.clip(census_acs_pop, mask)
+        census_acs_pop = clip_mask.clip(census_acs_pop, mask)
 
     census_acs_pop['area'] = census_acs_pop['geometry'].area
 
-    # Remove post-clip sliver polygons with area < .01 sq mi 
+    # Remove post-clip sliver polygons with area < .01 sq mi
     census_acs_pop = census_acs_pop[census_acs_pop.area > 278784]
-    
+
     return census_acs_pop
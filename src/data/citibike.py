@@ -7,6 +7,7 @@ from io import TextIOWrapper
 from pathlib import Path
 
 import geopandas as gpd
+import instrument
 import pandas as pd
 import util
 from requests import HTTPError
@@ -15,7 +16,18 @@ from requests import HTTPError
 class TripData(util.Source):
     base_url = "https://s3.amazonaws.com/tripdata/"
 
-    def __init__(self, raw_dir, gpkg, start_year, start_month, end_year, end_month):
+    def __init__(
+        self,
+        raw_dir,
+        gpkg,
+        start_year,
+        start_month,
+        end_year,
+        end_month,
+        base_url=None,
+    ):
+        if base_url is not None:
+            self.base_url = base_url
         self.raw_dir = Path(raw_dir)
         self.gpkg = Path(gpkg)
         self.start_year = start_year
@@ -222,7 +234,7 @@ class TripData(util.Source):
                 new_stations.to_file(self.gpkg, layer="stations", mode="a")
         else:
             # Create stations table with unique constraint
-            stations_df.to_file(self.gpkg, layer="stations")
+            util.write_gpkg({"stations": stations_df}, self.gpkg)
             with sqlite3.connect(self.gpkg) as con:
                 con.execute(
                     "CREATE UNIQUE INDEX station_id_unq_idx ON stations(station_id)"
@@ -235,13 +247,16 @@ class TripData(util.Source):
             self.gpkg.unlink()
 
         for csv_zip in sorted(self.raw_dir.glob("*.csv.zip")):
-            df = self._extract_df(csv_zip)
+            with instrument.span("parse") as s:
+                df = self._extract_df(csv_zip)
+                s.rows = len(df)
             stations, trips = self._divide_df(df)
 
             # update/create stations table
             self._setup_gpkg(stations, crs=crs)
             with sqlite3.connect(self.gpkg) as con:
-                trips.to_sql("trips", con, if_exists="append", index=False)
+                with instrument.span("to_sql", rows=len(trips)):
+                    trips.to_sql("trips", con, if_exists="append", index=False)
 
             del df
             del stations
@@ -0,0 +1,106 @@
+"""Prepared clip mask shared by the data preparation stages"""
+
+import hashlib
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+
+class ClipMask:
+    """Union of mask polygons prepared for repeated clipping.
+
+    The union is built once, optionally simplified, and prepared so that
+    point-in-polygon tests are vectorized. An STRtree over its polygon parts
+    narrows down the features that need an exact test.
+
+    Attributes:
+    geometry: the prepared (Multi)Polygon union of the mask
+    crs: CRS of the mask
+    tree: STRtree of the polygon parts of geometry
+    """
+
+    def __init__(self, geometry, crs):
+        self.geometry = geometry
+        self.crs = crs
+        shapely.prepare(self.geometry)
+        self.tree = shapely.STRtree(shapely.get_parts(self.geometry))
+
+    @classmethod
+    def from_gdf(cls, gdf, simplify=None, cache_dir=None):
+        """Build a mask from a GeoDataFrame of polygons.
+
+        Arguments:
+        gdf - GeoDataFrame of mask polygons, e.g. the boroughs layer
+        simplify - optional simplification tolerance, in CRS units
+        cache_dir - if given, the union is cached there keyed by a hash of
+            the mask geometries, CRS and tolerance
+        """
+        geoms = gdf.geometry.to_numpy()
+        key = hashlib.sha256()
+        key.update(str(gdf.crs).encode("utf-8"))
+        key.update(str(simplify).encode("utf-8"))
+        for wkb in shapely.to_wkb(geoms):
+            key.update(wkb)
+
+        cache_file = None
+        if cache_dir is not None:
+            cache_file = Path(cache_dir).joinpath(f"clip_mask_{key.hexdigest()[:16]}.wkb")
+            if cache_file.exists():
+                return cls(shapely.from_wkb(cache_file.read_bytes()), gdf.crs)
+
+        union = shapely.union_all(shapely.make_valid(geoms))
+        if simplify is not None:
+            union = shapely.simplify(union, simplify, preserve_topology=True)
+
+        if cache_file is not None:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            cache_file.write_bytes(shapely.to_wkb(union))
+
+        return cls(union, gdf.crs)
+
+    @classmethod
+    def from_gpkg(cls, path, layer="boroughs", simplify=None, cache_dir=None):
+        """Build a mask from a GeoPackage layer."""
+        return cls.from_gdf(
+            gpd.read_file(path, layer=layer), simplify=simplify, cache_dir=cache_dir
+        )
+
+    def contains_xy(self, x, y):
+        """Boolean array of the points (x, y) inside or on the mask boundary."""
+        return shapely.intersects_xy(self.geometry, x, y)
+
+    def clip(self, gdf):
+        """Clip a GeoDataFrame to the mask, as geopandas.clip.
+
+        Points are filtered with a vectorized point-in-polygon test.
+        Other geometries entirely inside the mask are kept unchanged and
+        only those crossing its boundary are intersected.
+        """
+        if gdf.crs is not None and self.crs is not None and gdf.crs != self.crs:
+            raise ValueError(f"mask CRS {self.crs} does not match {gdf.crs}")
+
+        geoms = gdf.geometry.to_numpy()
+        if len(geoms) == 0:
+            return gdf
+
+        # point layers, possibly with missing geometries (type id -1)
+        if np.isin(shapely.get_type_id(geoms), (-1, 0)).all():
+            return gdf[self.contains_xy(shapely.get_x(geoms), shapely.get_y(geoms))]
+
+        candidates = np.unique(self.tree.query(geoms, predicate="intersects")[0])
+        inside = shapely.contains_properly(self.geometry, geoms[candidates])
+        clipped = geoms[candidates].copy()
+        clipped[~inside] = shapely.intersection(geoms[candidates][~inside], self.geometry)
+
+        gdf = gdf.iloc[candidates].copy()
+        gdf[gdf.geometry.name] = gpd.GeoSeries(clipped, index=gdf.index, crs=gdf.crs)
+        return gdf[~gdf.geometry.is_empty]
+
+
+def clip(gdf, mask):
+    """Clip gdf by a ClipMask, or by a GeoDataFrame mask with geopandas.clip."""
+    if isinstance(mask, ClipMask):
+        return mask.clip(gdf)
+    return gpd.clip(gdf, mask)
@@ -6,27 +6,34 @@ from datetime import datetime
 from pathlib import Path
 
 import click
-import geopandas as gpd
+import instrument
 import pandas as pd
-import util
+
+# geopandas, util and clip_mask are only needed by Stations and are imported
+# there, so processing station status does not pay for the geospatial stack
 
 
 class Stations:
-    def __init__(
-        self,
-        url="https://gbfs.citibikenyc.com/gbfs/en/station_information.json",
-        local_file=None,
-    ):
-        self.url = url
+    base_url = "https://gbfs.citibikenyc.com/gbfs/en/"
+
+    def __init__(self, url=None, local_file=None, base_url=None):
+        if base_url is not None:
+            self.base_url = base_url
+        self.url = url or self.base_url + "station_information.json"
         self.raw_file = local_file
 
     def _download_raw(self, output_file=None):
         """download gzip compressed json to output_file"""
+        import util
+
         self.raw_file = util.download_file(self.url, output_file, compress=True)
         return self.raw_file
 
     def process(self, output_file, mode="w", mask=None, replace=False):
         """process into geodataframe/geopackage"""
+        import clip_mask
+        import geopandas as gpd
+        import util
 
         used_tempfile = False
 
@@ -77,10 +84,13 @@ class Stations:
         gdf.to_crs("EPSG:2263", inplace=True)
 
         if mask is not None:
-            gdf = gpd.clip(gdf, mask)
+            gdf = clip_mask.clip(gdf, mask)
 
         # save to file
-        gdf.to_file(output_file, layer="station", mode=mode, crs="EPSG:2263")
+        if mode == "a":
+            gdf.to_file(output_file, layer="station", mode=mode, crs="EPSG:2263")
+        else:
+            util.write_gpkg({"station": gdf}, output_file)
         self.processed_file = output_file
 
         # clean up raw json file if used
@@ -236,6 +246,7 @@ class StationStatus:
     def _filter_obs(self, after):
         self.observations = list(filter(lambda obs: obs[0] > after, self.observations))
 
+    @instrument.timed("_set_stale")
     def _set_stale(self, con):
         """Set stale boolean (non-updates) attribute using rolling window"""
 
@@ -275,16 +286,19 @@ class StationStatus:
                 self._filter_obs(last_cap)
 
             for obs in self.observations:
-                status = self._read_statusfile(obs)
-                df = pd.DataFrame.from_records(status)
-
-                df["capture_datetime"] = pd.to_datetime(
-                    df.capture_datetime, format="%Y-%m-%d_%H:%M:%S"
-                )
-                df["reported_datetime"] = pd.to_datetime(
-                    df.reported_datetime, format="%Y-%m-%d_%H:%M:%S"
-                )
-                df.to_sql("status", con, if_exists="append", index=False)
+                with instrument.span("parse") as s:
+                    status = self._read_statusfile(obs)
+                    df = pd.DataFrame.from_records(status)
+
+                    df["capture_datetime"] = pd.to_datetime(
+                        df.capture_datetime, format="%Y-%m-%d_%H:%M:%S"
+                    )
+                    df["reported_datetime"] = pd.to_datetime(
+                        df.reported_datetime, format="%Y-%m-%d_%H:%M:%S"
+                    )
+                    s.rows = len(df)
+                with instrument.span("to_sql", rows=len(df)):
+                    df.to_sql("status", con, if_exists="append", index=False)
                 count += 1
             self._set_stale(con)
             return count
@@ -403,6 +417,7 @@ class StationStatus:
         con.execute(sql)
         con.commit()
 
+    @instrument.timed("summaries")
     def create_summaries(self):
         with sqlite3.connect(self.output_file) as con:
             self._peak_summary(con, period="all")
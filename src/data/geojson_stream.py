@@ -0,0 +1,173 @@
+"""Incremental GeoJSON FeatureCollection decoder"""
+
+import codecs
+import json
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# nesting depth of each geometry type above its coordinates
+GEOMETRY_LEVELS = {
+    "Point": 0,
+    "MultiPoint": 1,
+    "LineString": 1,
+    "Polygon": 2,
+    "MultiLineString": 2,
+    "MultiPolygon": 3,
+}
+
+# constructors applied from the coordinates upwards, one per nesting level
+GEOMETRY_CONSTRUCTORS = {
+    "Point": [],
+    "MultiPoint": [shapely.multipoints],
+    "LineString": [shapely.linestrings],
+    "Polygon": [shapely.linearrings, shapely.polygons],
+    "MultiLineString": [shapely.linestrings, shapely.multilinestrings],
+    "MultiPolygon": [shapely.linearrings, shapely.polygons, shapely.multipolygons],
+}
+
+
+def iter_features(stream, chunk_size=1 << 16):
+    """Yield the features of a FeatureCollection one at a time.
+
+    Only the features array is walked, and only one feature is decoded at a
+    time, so the full JSON tree is never held in memory.
+
+    Arguments:
+    stream - binary file-like object with a GeoJSON FeatureCollection
+    chunk_size - number of bytes read from stream at a time
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    eof = False
+
+    def read_more():
+        nonlocal buf, eof
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+            buf += utf8.decode(b"", final=True)
+        else:
+            buf += utf8.decode(chunk)
+
+    # advance to the opening bracket of the features array
+    while True:
+        key = buf.find('"features"')
+        if key != -1:
+            start = buf.find("[", key)
+            if start != -1:
+                buf = buf[start + 1 :]
+                break
+        if eof:
+            return
+        read_more()
+
+    pos = 0
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError("unterminated features array")
+            buf = ""
+            pos = 0
+            read_more()
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            feature, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buf = buf[pos:]
+            pos = 0
+            read_more()
+            continue
+        yield feature
+        buf = buf[end:]
+        pos = 0
+
+
+class _GeometryStore:
+    """Flat coordinate and part-index arrays for one geometry type"""
+
+    def __init__(self, levels):
+        self.levels = levels
+        self.coords = []
+        self.indices = [[] for _ in range(levels)]
+        self.counts = [0] * (levels + 1)
+        self.positions = []
+
+    def add(self, coordinates, position):
+        self._walk(coordinates, self.levels)
+        self.positions.append(position)
+
+    def _walk(self, obj, level):
+        if level == 0:
+            self.coords.append(obj[:2])
+            return
+        parent = self.counts[level]
+        for child in obj:
+            self._walk(child, level - 1)
+            self.indices[level - 1].append(parent)
+        self.counts[level] += 1
+
+    def build(self, geom_type):
+        parts = np.asarray(self.coords, dtype=float).reshape(-1, 2)
+        if geom_type in ("Point", "MultiPoint"):
+            parts = shapely.points(parts)
+        for constructor, index in zip(GEOMETRY_CONSTRUCTORS[geom_type], self.indices):
+            parts = constructor(parts, indices=np.asarray(index, dtype=np.intp))
+        return parts
+
+
+def features_to_gdf(features):
+    """Build a GeoDataFrame from an iterable of GeoJSON features.
+
+    Geometries are assembled with the vectorized shapely constructors from
+    flat coordinate arrays rather than one shape() call per feature, and
+    properties are appended straight into per-column lists.
+
+    Arguments:
+    features - iterable of GeoJSON feature dicts
+
+    Returns:
+    gdf - a GeoDataFrame without a CRS, as GeoDataFrame.from_features
+    """
+    stores = {}
+    columns = {}
+    n = 0
+    for feature in features:
+        geom = feature.get("geometry")
+        if geom is not None and len(geom.get("coordinates") or []) > 0:
+            geom_type = geom["type"]
+            if geom_type not in stores:
+                stores[geom_type] = _GeometryStore(GEOMETRY_LEVELS[geom_type])
+            stores[geom_type].add(geom["coordinates"], n)
+
+        for name, value in (feature.get("properties") or {}).items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = [None] * n
+            column.append(value)
+        n += 1
+        # properties missing from this feature
+        for column in columns.values():
+            if len(column) < n:
+                column.append(None)
+
+    geometry = np.full(n, None, dtype=object)
+    for geom_type, store in stores.items():
+        geometry[store.positions] = store.build(geom_type)
+
+    df = pd.DataFrame(columns, index=pd.RangeIndex(n))
+    return gpd.GeoDataFrame(df, geometry=gpd.GeoSeries(geometry), crs=None)
+
+
+def read_geojson(stream, chunk_size=1 << 16):
+    """Decode a GeoJSON FeatureCollection stream into a GeoDataFrame."""
+    return features_to_gdf(iter_features(stream, chunk_size))
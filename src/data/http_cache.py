@@ -0,0 +1,305 @@
+"""On-disk cache for HTTP responses shared by all source fetchers"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import requests
+
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parents[2].joinpath(
+    "data", "raw", "http_cache"
+)
+
+# (connect, read) seconds allowed for a request
+DEFAULT_TIMEOUT = (10, 60)
+
+# deadline of the requests made by each thread, see deadline()
+_local = threading.local()
+
+
+@contextmanager
+def deadline(seconds):
+    """Bound the requests made by this thread within the block to seconds.
+
+    Each request's connect and read timeouts are cut to the time left, and
+    a request made after the deadline raises requests.Timeout. None means
+    no deadline.
+    """
+    previous = getattr(_local, "deadline", None)
+    if seconds is not None:
+        _local.deadline = time.monotonic() + seconds
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode when a request has no cached response."""
+
+
+class CachedResponse:
+    """Minimal stand-in for requests.Response for a cached or fresh body.
+
+    Attributes:
+    url: the requested url
+    content: the response body as bytes, read from path on first access
+    path: the cached body on disk, if any
+    from_cache: True if the body was served without a full download
+    """
+
+    status_code = 200
+
+    def __init__(self, url, content=None, path=None, from_cache=False):
+        self.url = url
+        self._content = content
+        self.path = path
+        self.from_cache = from_cache
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.path.read_bytes()
+        return self._content
+
+    def stream(self):
+        """Binary file-like object over the body, read from disk if cached."""
+        if self._content is None and self.path is not None:
+            return open(self.path, "rb")
+        return io.BytesIO(self.content)
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        """Only successful responses are cached, so this never raises."""
+        pass
+
+
+class HttpCache:
+    """Content-addressed on-disk cache of HTTP responses.
+
+    Bodies are stored once under objects/ by their sha256. Each request
+    (method, url, params, body) has a metadata file pointing at its body and
+    holding the ETag/Last-Modified validators, which are sent back as a
+    conditional request so an unchanged resource costs a 304.
+
+    Attributes:
+    cache_dir: root directory of the cache
+    ttl: seconds a cached response is served without revalidating
+    offline: serve only from the cache, never touch the network
+    timeout: (connect, read) seconds allowed for a request
+    stats: counters of hits, revalidations (304s), misses and bytes downloaded
+    """
+
+    def __init__(
+        self, cache_dir=DEFAULT_CACHE_DIR, ttl=0, offline=False, timeout=DEFAULT_TIMEOUT
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.offline = offline
+        self.timeout = timeout
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "bytes_downloaded": 0}
+        self._lock = threading.Lock()
+
+    def _key(self, method, url, params=None, data=None):
+        request = json.dumps(
+            [method, url, sorted((params or {}).items()), data], default=str
+        )
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def _meta_path(self, key):
+        return self.cache_dir.joinpath("meta", key[:2], f"{key}.json")
+
+    def _object_path(self, sha):
+        return self.cache_dir.joinpath("objects", sha[:2], sha)
+
+    def _read_meta(self, key):
+        path = self._meta_path(key)
+        if not path.exists():
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _write_atomic(self, path, content):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(content)
+        tmp.replace(path)
+
+    def _write_meta(self, key, meta):
+        self._write_atomic(self._meta_path(key), json.dumps(meta).encode("utf-8"))
+
+    def _timeout(self):
+        """timeout= of the next request, cut to the thread's deadline"""
+        end = getattr(_local, "deadline", None)
+        if end is None:
+            return self.timeout
+        left = end - time.monotonic()
+        if left <= 0:
+            raise requests.Timeout("deadline exceeded before the request")
+        return tuple(min(t, left) for t in self.timeout)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def _is_fresh(self, meta, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() - meta["fetched_at"] < ttl
+
+    @staticmethod
+    def _validators(meta):
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    @staticmethod
+    def _new_meta(url, response):
+        return {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+        }
+
+    def request(self, method, url, params=None, data=None, headers=None, ttl=None):
+        """Make a request through the cache; returns a CachedResponse.
+
+        Arguments:
+        method - HTTP method, e.g. "GET" or "POST"
+        url - request url
+        params - query parameters
+        data - request body
+        headers - request headers
+        ttl - overrides the cache-wide ttl for this request
+        """
+        key = self._key(method, url, params, data)
+        meta = self._read_meta(key)
+        cached = meta is not None and self._object_path(meta["sha256"]).exists()
+
+        if cached and (self.offline or self._is_fresh(meta, ttl)):
+            self._count("hits")
+            path = self._object_path(meta["sha256"])
+            return CachedResponse(url, path=path, from_cache=True)
+
+        if self.offline:
+            raise CacheMiss(f"{method} {url} is not cached")
+
+        req_headers = dict(headers or {})
+        if cached:
+            req_headers.update(self._validators(meta))
+
+        with requests.request(
+            method,
+            url,
+            params=params,
+            data=data,
+            headers=req_headers,
+            timeout=self._timeout(),
+        ) as response:
+            if cached and response.status_code == 304:
+                self._count("revalidated")
+                meta["fetched_at"] = time.time()
+                self._write_meta(key, meta)
+                path = self._object_path(meta["sha256"])
+                return CachedResponse(url, path=path, from_cache=True)
+
+            response.raise_for_status()
+            content = response.content
+            new_meta = self._new_meta(url, response)
+
+        self._count("misses")
+        self._count("bytes_downloaded", len(content))
+
+        sha = hashlib.sha256(content).hexdigest()
+        if not self._object_path(sha).exists():
+            self._write_atomic(self._object_path(sha), content)
+        new_meta["sha256"] = sha
+        new_meta["size"] = len(content)
+        self._write_meta(key, new_meta)
+        return CachedResponse(url, content=content, path=self._object_path(sha))
+
+    def get(self, url, params=None, headers=None, ttl=None):
+        return self.request("GET", url, params=params, headers=headers, ttl=ttl)
+
+    def post(self, url, data=None, headers=None, ttl=None):
+        return self.request("POST", url, data=data, headers=headers, ttl=ttl)
+
+    def download(self, url, local_filename, write, ttl=None):
+        """Stream url to local_filename unless the local copy is still current.
+
+        Large files are not copied into the object store; the local file is
+        the cached body and only its validators are kept in the cache.
+
+        Arguments:
+        url - web url of file
+        local_filename - destination path
+        write - callable(response, path) that writes the streamed body
+        ttl - overrides the cache-wide ttl for this request
+
+        Returns:
+        True if the file was downloaded, False if the local copy was current.
+        """
+        local_filename = Path(local_filename)
+        key = self._key("DOWNLOAD", url, data=str(local_filename.resolve()))
+        meta = self._read_meta(key)
+        cached = meta is not None and local_filename.exists()
+
+        if cached and (self.offline or self._is_fresh(meta, ttl)):
+            self._count("hits")
+            return False
+
+        if self.offline:
+            raise CacheMiss(f"{url} is not cached")
+
+        headers = self._validators(meta) if cached else {}
+        with requests.get(url, stream=True, headers=headers, timeout=self._timeout()) as r:
+            if cached and r.status_code == 304:
+                self._count("revalidated")
+                meta["fetched_at"] = time.time()
+                self._write_meta(key, meta)
+                return False
+
+            r.raise_for_status()
+            new_meta = self._new_meta(url, r)
+            tmp = local_filename.with_name(local_filename.name + ".part")
+            write(r, tmp)
+            tmp.replace(local_filename)
+
+        self._count("misses")
+        self._count("bytes_downloaded", local_filename.stat().st_size)
+        self._write_meta(key, new_meta)
+        return True
+
+
+_default_cache = None
+
+
+def configure(cache_dir=DEFAULT_CACHE_DIR, ttl=0, offline=False, timeout=DEFAULT_TIMEOUT):
+    """Set up the cache used by every fetcher; returns the HttpCache."""
+    global _default_cache
+    _default_cache = HttpCache(
+        cache_dir=cache_dir, ttl=ttl, offline=offline, timeout=timeout
+    )
+    return _default_cache
+
+
+def get_cache():
+    """Return the configured HttpCache, creating a default one if needed."""
+    if _default_cache is None:
+        configure()
+    return _default_cache
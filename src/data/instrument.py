@@ -0,0 +1,225 @@
+"""Lightweight performance instrumentation for the data pipeline
+
+Code is instrumented with nested spans:
+
+    with instrument.span("to_sql") as s:
+        df.to_sql(...)
+        s.rows = len(df)
+
+Each span records wall time, rows processed, rows per second, bytes
+downloaded through http_cache and the peak RSS of the process. A run's
+spans are written as JSON and compared against the previous run.
+"""
+
+import functools
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _bytes_downloaded():
+    # only read when the cache is in use; never import it just for this
+    http_cache = sys.modules.get("http_cache")
+    if http_cache is None or http_cache._default_cache is None:
+        return 0
+    return http_cache._default_cache.stats["bytes_downloaded"]
+
+
+class Span:
+    """Measurements of a single instrumented block.
+
+    Attributes:
+    name: "/" separated path of the enclosing span names
+    rows: rows processed, set by the instrumented code
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self._start = time.perf_counter()
+        self._start_bytes = _bytes_downloaded()
+        self.record = None
+
+    def finish(self):
+        seconds = time.perf_counter() - self._start
+        self.record = {
+            "name": self.name,
+            "seconds": round(seconds, 4),
+            "rows": self.rows,
+            "rows_per_s": round(self.rows / seconds, 1)
+            if self.rows is not None and seconds > 0
+            else None,
+            # process wide; spans running concurrently share the counter
+            "bytes_downloaded": _bytes_downloaded() - self._start_bytes,
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+        }
+        return self.record
+
+
+class Recorder:
+    """Collects the spans of one run.
+
+    Attributes:
+    spans: finished span records, in completion order
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.started_at = datetime.now()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, rows=None):
+        stack = self._stack()
+        s = Span(f"{stack[-1].name}/{name}" if stack else name)
+        s.rows = rows
+        stack.append(s)
+        try:
+            yield s
+        finally:
+            stack.pop()
+            record = s.finish()
+            with self._lock:
+                self.spans.append(record)
+            logger.debug(f"{record['name']}: {record['seconds']:.2f}s")
+
+    def summary(self):
+        """Totals per span name; repeated spans (e.g. per file) are summed."""
+        totals = {}
+        for record in self.spans:
+            t = totals.setdefault(
+                record["name"],
+                {"count": 0, "seconds": 0.0, "rows": None, "bytes_downloaded": 0},
+            )
+            t["count"] += 1
+            t["seconds"] = round(t["seconds"] + record["seconds"], 4)
+            t["bytes_downloaded"] += record["bytes_downloaded"]
+            if record["rows"] is not None:
+                t["rows"] = (t["rows"] or 0) + record["rows"]
+            t["peak_rss_mb"] = max(t.get("peak_rss_mb", 0), record["peak_rss_mb"])
+        for t in totals.values():
+            t["rows_per_s"] = (
+                round(t["rows"] / t["seconds"], 1)
+                if t["rows"] is not None and t["seconds"] > 0
+                else None
+            )
+        return totals
+
+    def write(self, report_dir, command=None):
+        """Write this run as report_dir/<timestamp>.json; returns the path."""
+        report_dir = Path(report_dir)
+        report_dir.mkdir(parents=True, exist_ok=True)
+        path = report_dir.joinpath(f"{self.started_at:%Y%m%dT%H%M%S}.json")
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "command": command,
+                    "started_at": self.started_at.isoformat(),
+                    "peak_rss_mb": round(_peak_rss_mb(), 1),
+                    "summary": self.summary(),
+                    "spans": self.spans,
+                },
+                f,
+                indent=2,
+            )
+        return path
+
+
+def compare(current, previous, threshold=1.25, min_seconds=1.0):
+    """Compare two run summaries; returns the spans that regressed.
+
+    A span regressed when it is present in both runs, took at least
+    min_seconds, and its seconds per row (or seconds, without rows) grew by
+    more than threshold.
+
+    Returns:
+    list of (name, previous value, current value, ratio)
+    """
+    regressions = []
+    for name, cur in current.items():
+        prev = previous.get(name)
+        if prev is None or cur["seconds"] < min_seconds or prev["seconds"] <= 0:
+            continue
+        if cur["rows"] and prev["rows"]:
+            cur_cost = cur["seconds"] / cur["rows"]
+            prev_cost = prev["seconds"] / prev["rows"]
+        else:
+            cur_cost, prev_cost = cur["seconds"], prev["seconds"]
+        if prev_cost > 0 and cur_cost / prev_cost > threshold:
+            regressions.append((name, prev_cost, cur_cost, cur_cost / prev_cost))
+    return regressions
+
+
+def previous_report(report_dir, command=None, exclude=None):
+    """Load the latest report in report_dir for the same command, if any."""
+    for path in sorted(Path(report_dir).glob("*.json"), reverse=True):
+        if exclude is not None and path == Path(exclude):
+            continue
+        with open(path, "r") as f:
+            report = json.load(f)
+        if command is None or report.get("command") == command:
+            return report
+    return None
+
+
+def finish_run(report_dir, command=None, threshold=1.25):
+    """Write the current run and log regressions against the previous run."""
+    recorder = get_recorder()
+    if len(recorder.spans) == 0:
+        return None
+    path = recorder.write(report_dir, command)
+    previous = previous_report(report_dir, command, exclude=path)
+    if previous is not None:
+        for name, prev, cur, ratio in compare(
+            recorder.summary(), previous["summary"], threshold
+        ):
+            logger.warning(
+                f"performance regression in {name}: {prev:.4g} -> {cur:.4g} ({ratio:.2f}x)"
+            )
+    logger.info(f"performance report written to {path}")
+    return path
+
+
+_recorder = Recorder()
+
+
+def get_recorder():
+    return _recorder
+
+
+def span(name, rows=None):
+    """Instrument a block with the run's recorder; yields the Span."""
+    return _recorder.span(name, rows)
+
+
+def timed(name=None):
+    """Decorator instrumenting a function as a span."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,33 +1,62 @@
-"""Dataset download and clean driver script"""
+"""Dataset download and clean driver script
+
+Source modules and their heavy dependencies (geopandas, cenpy, bs4) are
+imported inside the stage that needs them, so --help and light subcommands
+like get-status start quickly. Run with LOG_LEVEL=DEBUG to see start-up
+and per-stage import times.
+"""
+import functools
 import logging
+import os
+import time
+from contextlib import contextmanager
 from datetime import date
 from pathlib import Path
 
-import acs
-import citibike
 import click
-import gbfs
-import geopandas as gpd
-import mta
-import open_data
-import sas
+import instrument
 from dotenv import find_dotenv, load_dotenv
 
+_STARTED = time.perf_counter()
+
 OPEN_DATA_GPKG = "data/prepared/open_data.gpkg"
 ACS_GPKG = "data/prepared/acs.gpkg"
 GBFS_GPKG = "data/prepared/gbfs.gpkg"
 SAS_GPKG = "data/prepared/sas.gpkg"
+MASK_CACHE_DIR = "data/interim"
+
+
+@contextmanager
+def _timed_imports(logger, stage):
+    """Log how long the lazy imports of a stage took"""
+    start = time.perf_counter()
+    yield
+    if logger is not None:
+        logger.debug(f"{stage} imports took {time.perf_counter() - start:.3f}s")
 
 
+@functools.cache
 def _get_boroughs_mask(project_dir):
-    """Return gdf of NYC boroughs for masking purposes"""
+    """Return the ClipMask of NYC boroughs, built once per run"""
+    import clip_mask
+    import geopandas as gpd
+    import open_data
+
     if project_dir.joinpath(OPEN_DATA_GPKG).exists():
-        return gpd.read_file(project_dir.joinpath(OPEN_DATA_GPKG), layer="boroughs")
+        boroughs = gpd.read_file(project_dir.joinpath(OPEN_DATA_GPKG), layer="boroughs")
     else:
-        return open_data.boroughs().get().set_crs(4326).to_crs(2263)
+        boroughs = open_data.boroughs().get().set_crs(4326).to_crs(2263)
+    return clip_mask.ClipMask.from_gdf(
+        boroughs, cache_dir=project_dir.joinpath(MASK_CACHE_DIR)
+    )
 
 
+@instrument.timed()
 def make_open_data(project_dir, logger=None):
+    with _timed_imports(logger, "open_data"):
+        import clip_mask
+        import open_data
+
     if logger is not None:
         logger.info("downloading NYC Open Data")
 
@@ -40,23 +69,35 @@ def make_open_data(project_dir, logger=None):
     # Project, filter, and clean data
     open_data_dict.set_crs()
     open_data_dict.to_crs(2263)
-    open_data.clean_open_data(open_data_dict)
+    mask = clip_mask.ClipMask.from_gdf(
+        open_data_dict["boroughs"], cache_dir=project_dir.joinpath(MASK_CACHE_DIR)
+    )
+    open_data.clean_open_data(open_data_dict, mask=mask)
 
     # Write open_data to GeoPackage
     open_data_dict.to_file(project_dir.joinpath(OPEN_DATA_GPKG))
 
 
+@instrument.timed()
 def make_census_pop(project_dir, logger=None):
+    with _timed_imports(logger, "census_pop"):
+        import acs
+        import util
+
     if logger is not None:
         logger.info("downloading ACS Census population")
 
     mask = _get_boroughs_mask(project_dir)
     gdf = acs.get_census_acs_pop(crs=2263, mask=mask)
 
-    gdf.to_file(project_dir.joinpath(ACS_GPKG))
+    util.write_gpkg({"acs": gdf}, project_dir.joinpath(ACS_GPKG), replace=True)
 
 
+@instrument.timed()
 def make_gbfs_stations(project_dir, logger=None):
+    with _timed_imports(logger, "gbfs_stations"):
+        import gbfs
+
     if logger is not None:
         logger.info("downloading Citi Bike GBFS Station Information")
 
@@ -70,7 +111,11 @@ def make_gbfs_stations(project_dir, logger=None):
     )
 
 
+@instrument.timed()
 def make_gbfs_status(project_dir, logger):
+    with _timed_imports(logger, "gbfs_status"):
+        import gbfs
+
     logger.info("processing Citi Bike GBFS Station Status")
 
     output_file = project_dir.joinpath(GBFS_GPKG)
@@ -85,20 +130,36 @@ def make_gbfs_status(project_dir, logger):
     status.create_summaries()
 
 
+@instrument.timed()
 def make_sas_infill(project_dir, logger):
+    with _timed_imports(logger, "sas_infill"):
+        import sas
+
     logger.info("downloading Citi Bike Infill Suggest A Station")
     output_file = project_dir.joinpath(SAS_GPKG)
     infill = sas.SuggestAStation()
     infill.process(output_file)
 
 
-def make_mta_turnstile(project_dir, logger):
+@instrument.timed()
+def make_mta_turnstile(project_dir, logger, offline=False):
+    with _timed_imports(logger, "mta_turnstile"):
+        import mta
+
     # manually prepared lookup tables
     remote_lookup_csv = project_dir.joinpath("data/raw/mta/remote_complex_lookup.csv")
     stations_csv = project_dir.joinpath("data/raw/mta/stations.csv")
 
+    # one cached catalog of turnstile files shared by every year
+    catalog = mta.TurnstileCatalog(
+        project_dir.joinpath("data/raw/mta/turnstile/turnstile_catalog.json"),
+        mta.MtaTurnstiles.catalog_url,
+        mta.MtaTurnstiles.base_url,
+        offline=offline,
+    )
+
     # TODO: Parameterize year range
-    for year in range(2019, 2024):
+    for year in MTA_YEARS:
         raw_dir = project_dir.joinpath("data", "raw", "mta", "turnstile", str(year))
         raw_dir.mkdir(parents=True, exist_ok=True)
 
@@ -108,6 +169,7 @@ def make_mta_turnstile(project_dir, logger):
             raw_gpkg,
             start_date=date(year, 1, 1),
             end_date=date(year + 1, 1, 1),
+            catalog=catalog,
         )
 
         logger.info(f"downloading MTA Turnstile Data {year}")
@@ -126,8 +188,25 @@ def make_mta_turnstile(project_dir, logger):
 
         raw_gpkg.rename(prepared_gpkg)
 
+    make_mta_allyears(project_dir, logger)
 
+
+@instrument.timed()
+def make_mta_allyears(project_dir, logger):
+    with _timed_imports(logger, "mta_allyears"):
+        import mta
+
+    prepared_dir = project_dir.joinpath("data", "prepared")
+    year_gpkgs = mta.find_year_gpkgs(prepared_dir)
+    logger.info(f"aggregating MTA turnstile years {', '.join(map(str, year_gpkgs))}")
+    mta.aggregate_years(year_gpkgs, prepared_dir.joinpath("mta_allyears.gpkg"))
+
+
+@instrument.timed()
 def make_citibike_trips(project_dir, logger):
+    with _timed_imports(logger, "citibike_trips"):
+        import citibike
+
     today = date.today()
     prepared_dir = project_dir.joinpath("data", "prepared")
     if not prepared_dir.exists():
@@ -148,24 +227,142 @@ def make_citibike_trips(project_dir, logger):
         td.to_gpkg(replace=True, crs=2263)
 
 
-def make_all(project_dir, logger):
-    make_open_data(project_dir, logger)
-    make_census_pop(project_dir, logger)
-    make_gbfs_stations(project_dir, logger)
-    make_gbfs_status(project_dir, logger)
-    make_sas_infill(project_dir, logger)
-    make_mta_turnstile(project_dir, logger)
-    make_citibike_trips(project_dir, logger)
+MTA_YEARS = range(2019, 2024)
+
+
+def pipeline_stages(project_dir, logger, offline=False):
+    """Return a pipeline.Pipeline with every make_* stage and its files.
+
+    Arguments:
+    offline - run the stages that take it from cached data only
+    """
+    import pipeline
+
+    prepared = project_dir.joinpath("data", "prepared")
+    boroughs = (project_dir.joinpath(OPEN_DATA_GPKG), "boroughs")
+    stations = (project_dir.joinpath(GBFS_GPKG), "station")
+    trip_years = range(2019, date.today().year + 1)
+
+    pipe = pipeline.Pipeline(
+        project_dir.joinpath("data", "interim", "pipeline_state.json"), logger
+    )
+    # census_pop and gbfs_stations download fresh data and only read the
+    # boroughs to clip it, so they run every time
+    pipe.add(
+        pipeline.Stage(
+            "open_data",
+            lambda: make_open_data(project_dir, logger),
+            outputs=[boroughs],
+        )
+    )
+    pipe.add(
+        pipeline.Stage(
+            "census_pop",
+            lambda: make_census_pop(project_dir, logger),
+            inputs=[boroughs],
+            outputs=[(project_dir.joinpath(ACS_GPKG), "acs")],
+            always=True,
+        )
+    )
+    pipe.add(
+        pipeline.Stage(
+            "gbfs_stations",
+            lambda: make_gbfs_stations(project_dir, logger),
+            inputs=[boroughs],
+            outputs=[stations],
+            always=True,
+        )
+    )
+    pipe.add(
+        pipeline.Stage(
+            "gbfs_status",
+            lambda: make_gbfs_status(project_dir, logger),
+            inputs=[stations, (project_dir.joinpath("data/raw/station_status"), None)],
+            outputs=[(project_dir.joinpath(GBFS_GPKG), "status_summary")],
+        )
+    )
+    pipe.add(
+        pipeline.Stage(
+            "sas_infill",
+            lambda: make_sas_infill(project_dir, logger),
+            outputs=[(project_dir.joinpath(SAS_GPKG), "sas")],
+        )
+    )
+    pipe.add(
+        pipeline.Stage(
+            "mta_turnstile",
+            lambda: make_mta_turnstile(project_dir, logger, offline=offline),
+            outputs=[(prepared.joinpath(f"mta_{y}.gpkg"), None) for y in MTA_YEARS]
+            + [(prepared.joinpath("mta_allyears.gpkg"), "annual_complex")],
+        )
+    )
+    pipe.add(
+        pipeline.Stage(
+            "citibike_trips",
+            lambda: make_citibike_trips(project_dir, logger),
+            outputs=[
+                (prepared.joinpath(f"citibike_trips_{y}.gpkg"), "trips")
+                for y in trip_years
+            ],
+        )
+    )
+    return pipe
+
+
+def make_all(project_dir, logger, only=None, force=False, jobs=None, offline=False):
+    """Run all stages, independent ones concurrently.
+
+    Arguments:
+    only - names of the stages to run (see pipeline_stages)
+    force - rerun stages even when their outputs are up to date
+    jobs - the number of stages run at once; defaults to all ready stages
+    offline - use cached data only, see pipeline_stages
+    """
+    status = pipeline_stages(project_dir, logger, offline).run(
+        only=only, force=force, max_workers=jobs
+    )
+    for name, result in status.items():
+        logger.info(f"{name}: {result}")
+    failed = [name for name, result in status.items() if result in ("failed", "blocked")]
+    if failed:
+        raise click.ClickException(f"stages did not complete: {', '.join(failed)}")
 
 
 @click.group()
+@click.option(
+    "--offline", is_flag=True, help="Serve every HTTP request from the local cache"
+)
+@click.option(
+    "--cache-ttl",
+    default=0,
+    show_default=True,
+    help="Seconds a cached response is used without revalidating",
+)
 @click.pass_context
-def cli(ctx):
+def cli(ctx, offline, cache_ttl):
     """Runs data processing scripts to turn raw data from (../raw) into
     cleaned data ready to be analyzed (saved in ../processed).
     """
+    import http_cache
+
     ctx.ensure_object(dict)
-    ctx.obj["logger"] = logging.getLogger(__name__)
+    logger = logging.getLogger(__name__)
+    ctx.obj["logger"] = logger
+    ctx.obj["offline"] = offline
+
+    cache = http_cache.configure(
+        cache_dir=ctx.obj["project_dir"].joinpath("data", "raw", "http_cache"),
+        ttl=cache_ttl,
+        offline=offline,
+    )
+    ctx.call_on_close(lambda: logger.info(f"HTTP cache: {cache.stats}"))
+    ctx.call_on_close(
+        lambda: instrument.finish_run(
+            ctx.obj["project_dir"].joinpath("reports", "perf"),
+            command=ctx.invoked_subcommand,
+        )
+    )
+    logger.debug(f"start-up took {time.perf_counter() - _STARTED:.3f}s")
 
 
 @cli.command(help="Get NYC OpenData")
@@ -199,9 +396,24 @@ def get_sas_infill(ctx):
 
 
 @cli.command(help="Get MTA Turnstile Records")
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Use only the cached catalog and already downloaded files",
+)
 @click.pass_context
-def get_mta_turnstile(ctx):
-    make_mta_turnstile(ctx.obj["project_dir"], logger=ctx.obj["logger"])
+def get_mta_turnstile(ctx, offline):
+    make_mta_turnstile(
+        ctx.obj["project_dir"],
+        logger=ctx.obj["logger"],
+        offline=offline or ctx.obj["offline"],
+    )
+
+
+@cli.command(help="Combine yearly MTA Turnstile geopackages")
+@click.pass_context
+def get_mta_allyears(ctx):
+    make_mta_allyears(ctx.obj["project_dir"], logger=ctx.obj["logger"])
 
 
 @cli.command(help="Get Citi Bike Trip Data")
@@ -211,14 +423,29 @@ def get_citibike_trips(ctx):
 
 
 @cli.command(help="Get all datasets")
+@click.option(
+    "--only",
+    help="Comma separated stages to run, e.g. census_pop,gbfs_status",
+)
+@click.option("--force", is_flag=True, help="Rerun stages that are up to date")
+@click.option("--jobs", type=int, default=None, help="Stages to run at once")
 @click.pass_context
-def get_all(ctx):
-    make_all(ctx.obj["project_dir"], logger=ctx.obj["logger"])
+def get_all(ctx, only, force, jobs):
+    make_all(
+        ctx.obj["project_dir"],
+        logger=ctx.obj["logger"],
+        only=None if only is None else only.split(","),
+        force=force,
+        jobs=jobs,
+        offline=ctx.obj["offline"],
+    )
 
 
 if __name__ == "__main__":
     log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO").upper(), format=log_fmt
+    )
 
     # not used in this stub but often useful for finding various files
     project_dir = Path(__file__).resolve().parents[2]
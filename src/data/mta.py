@@ -1,29 +1,171 @@
+import bisect
+import json
 import re
 import sqlite3
-from datetime import datetime
+import time
+import warnings
+from datetime import date, datetime, timedelta
 from pathlib import Path
 
 import geopandas as gpd
+import http_cache
+import instrument
 import pandas as pd
-import requests
 import util
 from bs4 import BeautifulSoup
 
 
+class TurnstileCatalog:
+    """Locally cached listing of the turnstile files on the MTA developer site.
+
+    Entries are (date, date_str, url) tuples kept sorted by date, so a date
+    range is selected with a binary search rather than a scan of the page.
+
+    Attributes:
+    cache_file: JSON file the parsed catalog is persisted to
+    max_age: age after which the cached catalog is refetched
+    offline: never touch the network, use the cache and raw_dir contents only
+    """
+
+    date_re = re.compile(r"\d{6}")
+
+    def __init__(
+        self,
+        cache_file,
+        catalog_url,
+        base_url,
+        max_age=timedelta(days=7),
+        offline=False,
+    ):
+        self.cache_file = Path(cache_file)
+        self.catalog_url = catalog_url
+        self.base_url = base_url
+        self.max_age = max_age
+        self.offline = offline
+        self._entries = None
+        self._dates = None
+
+    def _is_fresh(self):
+        if not self.cache_file.exists():
+            return False
+        age = time.time() - self.cache_file.stat().st_mtime
+        return age < self.max_age.total_seconds()
+
+    def _fetch(self):
+        """Download and parse turnstile.html into catalog entries"""
+        cat_resp = http_cache.get_cache().get(self.catalog_url)
+        cat_soup = BeautifulSoup(cat_resp.text, features="html.parser")
+
+        entries = []
+        for link in cat_soup.find("div", "last").find_all("a"):
+            data_url = self.base_url + link.attrs["href"]
+            date_str = self.date_re.search(data_url.split("/")[-1]).group()
+            dt = datetime.strptime(date_str, "%y%m%d").date()
+            entries.append((dt, date_str, data_url))
+        return entries
+
+    def _read_cache(self):
+        with open(self.cache_file, "r") as f:
+            cached = json.load(f)
+        return [
+            (date.fromisoformat(e["date"]), e["date_str"], e["url"]) for e in cached
+        ]
+
+    def _write_cache(self, entries):
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        records = [
+            {"date": dt.isoformat(), "date_str": date_str, "url": url}
+            for dt, date_str, url in entries
+        ]
+        # write then rename so an interrupted run never leaves a partial cache
+        tmp_file = self.cache_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(records, f)
+        tmp_file.replace(self.cache_file)
+
+    def _from_raw_dir(self, raw_dir):
+        """Catalog entries for turnstile files already downloaded to raw_dir"""
+        entries = []
+        for rawfile in Path(raw_dir).glob("turnstile_*.txt"):
+            date_str = self.date_re.search(rawfile.name).group()
+            dt = datetime.strptime(date_str, "%y%m%d").date()
+            entries.append((dt, date_str, None))
+        return entries
+
+    def load(self, raw_dir=None, refresh=False):
+        """Load the catalog, refetching only if the cache is missing or stale"""
+        if self._entries is not None and not refresh:
+            return self._entries
+
+        if self.offline:
+            entries = self._read_cache() if self.cache_file.exists() else []
+            if raw_dir is not None:
+                known = {e[1] for e in entries}
+                entries += [e for e in self._from_raw_dir(raw_dir) if e[1] not in known]
+        elif refresh or not self._is_fresh():
+            entries = self._fetch()
+            self._write_cache(entries)
+        else:
+            entries = self._read_cache()
+
+        self._entries = sorted(entries)
+        self._dates = [e[0] for e in self._entries]
+        return self._entries
+
+    def between(self, start_date=None, end_date=None, raw_dir=None):
+        """Return catalog entries with start_date <= date <= end_date"""
+        self.load(raw_dir=raw_dir)
+        lo = 0 if start_date is None else bisect.bisect_left(self._dates, start_date)
+        hi = (
+            len(self._dates)
+            if end_date is None
+            else bisect.bisect_right(self._dates, end_date)
+        )
+        return self._entries[lo:hi]
+
+
 class MtaTurnstiles(util.Source):
     base_url = "http://web.mta.info/developers/"
     catalog_url = base_url + "turnstile.html"
 
-    def __init__(self, raw_dir, gpkg, start_date, end_date):
+    def __init__(
+        self,
+        raw_dir,
+        gpkg,
+        start_date,
+        end_date,
+        catalog=None,
+        offline=False,
+        base_url=None,
+    ):
+        """
+        Arguments:
+        raw_dir - directory turnstile text files are downloaded to
+        gpkg - output geopackage
+        start_date, end_date - inclusive date range of turnstile files
+        catalog - TurnstileCatalog to share between instances; by default the
+            catalog is cached as turnstile_catalog.json next to raw_dir
+        offline - work only from the cached catalog and files in raw_dir
+        base_url - overrides the developer site, e.g. with a fixture server
+        """
         super().__init__("mta_turnstile", "MTA Turnstile Counts", epsg=4326)
 
         assert raw_dir.exists(), "directory does not exist"
         self.raw_dir = Path(raw_dir)
 
-        # parse list of turnstile text file urls
-        cat_resp = requests.get(self.catalog_url)
-        cat_resp.raise_for_status()
-        self.cat_soup = BeautifulSoup(cat_resp.text, features="html.parser")
+        if base_url is not None:
+            self.base_url = base_url
+            self.catalog_url = base_url + "turnstile.html"
+
+        # the catalog is loaded lazily, construction never hits the network
+        if catalog is None:
+            catalog = TurnstileCatalog(
+                self.raw_dir.parent.joinpath("turnstile_catalog.json"),
+                self.catalog_url,
+                self.base_url,
+                offline=offline,
+            )
+        self.catalog = catalog
 
         self.gpkg = Path(gpkg)
         self.start_date = start_date
@@ -31,23 +173,20 @@ class MtaTurnstiles(util.Source):
 
     def download_raw(self, redownload=False):
         """Download raw text files from mta developer site"""
-        date_re = re.compile(r"\d{6}")
-        for link in self.cat_soup.find("div", "last").find_all("a"):
-            data_url = self.base_url + link.attrs["href"]
-            date_str = date_re.search(data_url.split("/")[-1]).group()
-            dt = datetime.strptime(date_str, "%y%m%d").date()
+        entries = self.catalog.between(
+            self.start_date, self.end_date, raw_dir=self.raw_dir
+        )
+        for dt, date_str, data_url in entries:
+            out_file = self.raw_dir.joinpath(f"turnstile_{date_str}.txt")
 
-            # filter by date
-            if (self.start_date is not None) and dt < self.start_date:
+            if out_file.exists() and redownload is False:
                 continue
 
-            if (self.end_date is not None) and dt > self.end_date:
+            if data_url is None or self.catalog.offline:
+                warnings.warn(f"{out_file.name} not available offline, skipping")
                 continue
 
-            out_file = self.raw_dir.joinpath(f"turnstile_{date_str}.txt")
-
-            if not out_file.exists() or redownload is True:
-                util.download_file(data_url, out_file)
+            util.download_file(data_url, out_file)
 
     def setup_gpkg(
         self, remote_complex_lookup_csv, stations_csv, replace=False, crs=2263
@@ -72,7 +211,7 @@ class MtaTurnstiles(util.Source):
             crs=4326,
         )
         stations.to_crs(crs, inplace=True)
-        stations.to_file(self.gpkg, layer="stations", mode="w")
+        util.write_gpkg({"stations": stations}, self.gpkg)
 
         # Remote -> Complex lookup table
         remote_lookup = pd.read_csv(
@@ -108,6 +247,7 @@ class MtaTurnstiles(util.Source):
 
             con.execute(ts_table_create)
 
+    @instrument.timed("_update_net_values")
     def _update_net_values(self, con):
         """Update net_entires/net_exists as difference between observations using window function"""
         with sqlite3.connect(self.gpkg) as con:
@@ -381,7 +521,9 @@ class MtaTurnstiles(util.Source):
         """Convert raw text files to geopackage with daily summaries"""
         with sqlite3.connect(self.gpkg) as con:
             for rawfile in sorted(self.raw_dir.glob("turnstile_*.txt")):
-                ts = pd.read_csv(rawfile)
+                with instrument.span("parse") as s:
+                    ts = pd.read_csv(rawfile)
+                    s.rows = len(ts)
 
                 # column renames
                 ts.rename(columns={k: k.strip() for k in ts.columns}, inplace=True)
@@ -419,7 +561,8 @@ class MtaTurnstiles(util.Source):
                 ts.sort_values(["unit_id", "observed_at"], inplace=True)
 
                 temp_table = f"ts_{rawfile.stem}"
-                ts.to_sql(temp_table, con, if_exists="replace", index=False)
+                with instrument.span("to_sql", rows=len(ts)):
+                    ts.to_sql(temp_table, con, if_exists="replace", index=False)
 
                 con.execute(
                     f"""
@@ -442,11 +585,130 @@ class MtaTurnstiles(util.Source):
                 con.commit()
 
             self._update_net_values(con)
-            self._update_daily_subunit(con)
-            self._update_daily_complex(con)
-            self._update_monthly_yearly_complex(con)
-
-            for period in ("morning_peak", "evening_peak", "peak", "offpeak"):
-                self._update_daily_period_subunit(con, period)
-                self._update_daily_period_complex(con, period)
-                self._update_monthly_yearly_complex(con, period)
+
+            with instrument.span("summaries"):
+                self._update_daily_subunit(con)
+                self._update_daily_complex(con)
+                self._update_monthly_yearly_complex(con)
+
+                for period in ("morning_peak", "evening_peak", "peak", "offpeak"):
+                    self._update_daily_period_subunit(con, period)
+                    self._update_daily_period_complex(con, period)
+                    self._update_monthly_yearly_complex(con, period)
+
+
+ANNUAL_TABLES = (
+    "annual_complex",
+    "annual_morning_peak_complex",
+    "annual_evening_peak_complex",
+    "annual_peak_complex",
+    "annual_offpeak_complex",
+)
+ANNUAL_METRICS = ("mean_daily_entries", "mean_daily_exits", "total_entries", "total_exits")
+
+
+def find_year_gpkgs(prepared_dir):
+    """Return {year: path} for every mta_<year>.gpkg in prepared_dir"""
+    year_re = re.compile(r"^mta_(\d{4})\.gpkg$")
+    found = {}
+    for gpkg in Path(prepared_dir).glob("mta_*.gpkg"):
+        match = year_re.match(gpkg.name)
+        if match:
+            found[int(match.group(1))] = gpkg
+    return dict(sorted(found.items()))
+
+
+def _read_annual_tables(gpkg, year):
+    """Read every annual complex table of one yearly geopackage in one query"""
+    union = " UNION ALL ".join(
+        f"SELECT '{table}' AS tbl, complex_id, {', '.join(ANNUAL_METRICS)} FROM {table}"
+        for table in ANNUAL_TABLES
+    )
+    with sqlite3.connect(gpkg) as con:
+        df = pd.read_sql(union, con)
+    df["year"] = year
+    return df
+
+
+def complex_centroids(stations):
+    """Centroid of the station entrances of each complex"""
+    xy = pd.DataFrame(
+        {
+            "complex_id": stations.complex_id,
+            "x": stations.geometry.x,
+            "y": stations.geometry.y,
+        }
+    )
+    xy = xy.groupby("complex_id")[["x", "y"]].mean()
+    return gpd.GeoDataFrame(
+        index=xy.index,
+        geometry=gpd.points_from_xy(xy.x, xy.y),
+        crs=stations.crs,
+    )
+
+
+def aggregate_years(year_gpkgs, output_file):
+    """Combine the annual complex tables of several yearly MTA geopackages.
+
+    Every annual table is pivoted into one <metric>_<year> column per year,
+    plus <metric>_all: the mean of the yearly values for mean_daily_* and
+    their sum for total_*. As with the yearly layers, a complex missing from
+    any year gets a null _all value. Rows are the complexes present in the
+    latest year, located at the centroid of their stations.
+
+    Arguments:
+    year_gpkgs - dict of the form {year: path to mta_<year>.gpkg}
+    output_file - path of the combined geopackage (replaced if it exists)
+
+    Returns:
+    output_file
+    """
+    years = sorted(year_gpkgs)
+    assert len(years) > 0, "no yearly geopackages to aggregate"
+    output_file = Path(output_file)
+
+    stations = gpd.read_file(year_gpkgs[years[-1]], layer="stations")
+    centroids = complex_centroids(stations)
+
+    long = pd.concat(
+        [_read_annual_tables(year_gpkgs[year], year) for year in years],
+        ignore_index=True,
+    )
+    long = long[long.complex_id.isin(centroids.index)]
+
+    # annual tables can hold spillover rows from the adjacent calendar year
+    per_year = long.groupby(["tbl", "complex_id", "year"]).agg(
+        mean_daily_entries=("mean_daily_entries", "mean"),
+        mean_daily_exits=("mean_daily_exits", "mean"),
+        total_entries=("total_entries", "sum"),
+        total_exits=("total_exits", "sum"),
+    )
+    wide = per_year.unstack("year").reindex(columns=years, level="year")
+
+    columns = {}
+    for metric in ANNUAL_METRICS:
+        values = wide[metric]
+        for year in years:
+            columns[f"{metric}_{year}"] = values[year]
+        if metric.startswith("mean"):
+            columns[f"{metric}_all"] = values.mean(axis=1, skipna=False)
+        else:
+            columns[f"{metric}_all"] = values.sum(axis=1, skipna=False, min_count=1)
+    wide = pd.DataFrame(columns)
+
+    layers = {"stations": stations}
+    in_latest = long.loc[long.year == years[-1], ["tbl", "complex_id"]]
+    for table in ANNUAL_TABLES:
+        if table not in wide.index.get_level_values("tbl"):
+            continue
+        layer = wide.loc[table]
+        layer = layer[layer.index.isin(in_latest.complex_id[in_latest.tbl == table])]
+        layers[table] = gpd.GeoDataFrame(
+            layer.join(centroids, how="inner").reset_index(names="complex_id"),
+            geometry="geometry",
+            crs=stations.crs,
+        )
+
+    util.write_gpkg(layers, output_file, replace=True)
+
+    return output_file
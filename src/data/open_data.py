@@ -1,7 +1,14 @@
+import warnings
+
+import clip_mask
 import geopandas as gpd
 import pandas as pd
+import requests
 import util
 
+# operators allowed in OpenDataSource filters
+SOQL_OPERATORS = ("=", "!=", "<", "<=", ">", ">=")
+
 
 class OpenDataSource(util.Source):
 
@@ -10,12 +17,20 @@ class OpenDataSource(util.Source):
     FeatureCollections.
 
     Attributes:
-    data_url: the URL from which the data will be downloaded
+    data_url: the URL from which the data will be downloaded, on base_url if set
     info_url: the URL to a page providing information about the dataset
     size: the expected maximum size of the dataset (in rows); sets the limit of the API request
     to_clip: marks a source as in need of clipping
+    select: columns to request; the geometry column must be included
+    filters: row filters evaluated by the server; a list of clauses that are
+        ANDed together, where each clause is a (column, operator, value)
+        tuple or a list of such tuples that are ORed together
+    base_url: server replacing the host of data_url, e.g. a fixture server;
+        set on the class to redirect every source
     """
 
+    base_url = None
+
     def __init__(
         self,
         name: str,
@@ -25,16 +40,109 @@ class OpenDataSource(util.Source):
         epsg: int,
         size=1000000,
         to_clip=False,
+        select=None,
+        filters=None,
+        base_url=None,
     ):
-        self.data_url = data_url
+        self._data_url = data_url
+        if base_url is not None:
+            self.base_url = base_url
         self.info_url = info_url
         self.size = size
+        self.select = select
+        self.filters = filters
         super().__init__(name=name, description=description, epsg=epsg)
 
+    @property
+    def data_url(self):
+        return util.rebase_url(self._data_url, self.base_url)
+
+    def soql_params(self):
+        """Compile select and filters into SODA $select/$where parameters."""
+        params = {}
+        if self.select is not None:
+            params["$select"] = ", ".join(self.select)
+        if self.filters is not None:
+            params["$where"] = soql_where(self.filters)
+        return params
+
     def get(self):
-        gdf = util.gdf_from_url(url=self.data_url, limit=self.size)
+        params = self.soql_params()
+        try:
+            gdf = util.gdf_from_url(url=self.data_url, limit=self.size, params=params)
+        except requests.HTTPError as e:
+            if len(params) == 0:
+                raise
+            # server rejected the query; fetch everything and filter locally
+            warnings.warn(f"query pushdown failed for {self.name} ({e}), filtering locally")
+            gdf = util.gdf_from_url(url=self.data_url, limit=self.size)
+        if self.filters is not None:
+            gdf = apply_filters(gdf, self.filters)
+        if len(gdf) == 0 and self.select is not None:
+            # no rows matched; keep the selected columns for the cleaners
+            gdf = gpd.GeoDataFrame(
+                {c: pd.Series(dtype=object) for c in self.select if c != "geometry"},
+                geometry=gpd.GeoSeries([], crs=f"EPSG:{self.epsg}"),
+            )
+        return gdf
+
+
+def _soql_value(value):
+    if isinstance(value, str):
+        escaped = value.replace("'", "''")
+        return f"'{escaped}'"
+    return str(value)
+
+
+def _clauses(filters):
+    """Normalize filters into a list of OR-groups of (column, op, value) tuples"""
+    groups = []
+    for clause in filters:
+        group = [clause] if isinstance(clause, tuple) else list(clause)
+        for column, op, value in group:
+            assert op in SOQL_OPERATORS, f"unsupported operator {op}"
+        groups.append(group)
+    return groups
+
+
+def soql_where(filters):
+    """Compile declarative filters into a SoQL $where expression."""
+    ands = []
+    for group in _clauses(filters):
+        ors = [f"{column} {op} {_soql_value(value)}" for column, op, value in group]
+        ands.append(ors[0] if len(ors) == 1 else "(" + " OR ".join(ors) + ")")
+    return " AND ".join(ands)
+
+
+def apply_filters(gdf, filters):
+    """Apply declarative filters to a GeoDataFrame locally.
+
+    Server-side filtering makes this a no-op, but it keeps results correct
+    when the query could not be pushed down.
+    """
+    if len(gdf) == 0:
         return gdf
 
+    ops = {
+        "=": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<": lambda a, b: a < b,
+        "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b,
+        ">=": lambda a, b: a >= b,
+    }
+
+    keep = pd.Series(True, index=gdf.index)
+    for group in _clauses(filters):
+        any_true = pd.Series(False, index=gdf.index)
+        for column, op, value in group:
+            col = gdf[column]
+            if not isinstance(value, str):
+                col = pd.to_numeric(col, errors="coerce")
+            any_true |= ops[op](col, value).fillna(False)
+        keep &= any_true
+    return gdf[keep]
+
 
 # Define sources (doing so separately from open_data_sources() allows
 # flexibility in which sources to include)
@@ -123,6 +231,23 @@ def motor_vehicle_crashes():
         description="Motor vehicle crashes in NYC from 2012 to the present.",
         size=2000000,
         epsg=4326,
+        select=[
+            "location",
+            "zip_code",
+            "crash_date",
+            "number_of_cyclist_killed",
+            "number_of_cyclist_injured",
+            "latitude",
+            "longitude",
+            "borough",
+        ],
+        filters=[
+            ("crash_date", ">=", "2019-01-01T00:00:00.000"),
+            [
+                ("number_of_cyclist_killed", ">", 0),
+                ("number_of_cyclist_injured", ">", 0),
+            ],
+        ],
     )
     return src
 
@@ -157,19 +282,23 @@ def get_open_data(sources, limit=1000000):
     return gdf_dict
 
 
-def clean_open_data(data_dict):
+def clean_open_data(data_dict, mask=None):
     """Cleans open data for Citi Bike SDSS.
 
     Arguments:
-    gdf_dict: A DataDict of GeoDataFrames to be cleaned; data is cleaned in place."""
+    gdf_dict: A DataDict of GeoDataFrames to be cleaned; data is cleaned in place.
+    mask: ClipMask of the boroughs; built from the boroughs layer if not given."""
 
     gdf_dict = data_dict.data
 
     print("Cleaning open data...")
 
+    if mask is None:
+        mask = clip_mask.ClipMask.from_gdf(gdf_dict["boroughs"])
+
     # Filter and clip motor vehicles layer
     gdf_dict["motor_vehicle_crashes"] = clean_motor_vehicles(
-        gdf=gdf_dict["motor_vehicle_crashes"], mask=gdf_dict["boroughs"]
+        gdf=gdf_dict["motor_vehicle_crashes"], mask=mask
     )
 
     print("Open data cleaning complete.\n")
@@ -179,7 +308,8 @@ def clean_motor_vehicles(gdf, mask):
     # Motor vehicle layer processing
     print("Filtering motor vehicles layer...")
 
-    # Keep only useful columns
+    # Keep only useful columns (already selected by the server when the
+    # query was pushed down; kept here as the local fallback)
     keep = [
         "geometry",
         "zip_code",
@@ -191,7 +321,7 @@ def clean_motor_vehicles(gdf, mask):
         "borough",
     ]
 
-    gdf = gdf[keep]
+    gdf = gdf[keep].copy()
 
     # Change numeric columns to numeric types
     to_num = [
@@ -211,6 +341,6 @@ def clean_motor_vehicles(gdf, mask):
     gdf = gdf[(gdf.number_of_cyclist_killed > 0) | (gdf.number_of_cyclist_injured > 0)]
 
     # Clip filtered motor vehicles GeoDataFrame by the borough boundaries
-    gdf = gpd.clip(gdf, mask)
+    gdf = clip_mask.clip(gdf, mask)
 
     return gdf
@@ -0,0 +1,214 @@
+"""Dependency-aware runner for the data preparation stages"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+
+class Stage:
+    """A step of the pipeline with the files it reads and writes.
+
+    Inputs and outputs are (path, layer) pairs; layer is None for plain
+    files and directories. A stage depends on every stage that outputs one
+    of its input paths.
+
+    Attributes:
+    name: unique name of the stage, used by --only
+    func: callable run with no arguments
+    inputs: list of (path, layer) read by the stage
+    outputs: list of (path, layer) written by the stage
+    always: run the stage even if its inputs are unchanged, for stages that
+        download remote data and only read their inputs
+    """
+
+    def __init__(self, name, func, inputs=None, outputs=None, always=False):
+        self.name = name
+        self.func = func
+        self.inputs = [(Path(p), layer) for p, layer in inputs or []]
+        self.outputs = [(Path(p), layer) for p, layer in outputs or []]
+        self.always = always
+
+
+def _layer_exists(path, layer):
+    with sqlite3.connect(path) as con:
+        found = con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?",
+            (layer,),
+        ).fetchone()
+    return found is not None
+
+
+def _exists(path, layer):
+    if not path.exists():
+        return False
+    return layer is None or _layer_exists(path, layer)
+
+
+def fingerprint(path, layer=None):
+    """Content hash of a GeoPackage layer, a file, or a directory listing.
+
+    Layers are hashed row by row so that unrelated layers written to the
+    same GeoPackage do not change the fingerprint. Directories are hashed
+    by their file names, sizes and modification times.
+    """
+    path = Path(path)
+    digest = hashlib.sha256()
+    if not path.exists():
+        return None
+    if layer is not None:
+        with sqlite3.connect(path) as con:
+            for row in con.execute(f'SELECT * FROM "{layer}" ORDER BY rowid'):
+                digest.update(repr(row).encode("utf-8"))
+    elif path.is_dir():
+        for f in sorted(path.rglob("*")):
+            if f.is_file():
+                st = f.stat()
+                digest.update(f"{f.relative_to(path)}:{st.st_size}:{st.st_mtime_ns}".encode())
+    else:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Pipeline:
+    """Runs stages concurrently in dependency order, skipping those up to date.
+
+    A stage with inputs is skipped when all its outputs exist and are newer
+    than its inputs, or when its inputs hash identically to the last
+    successful run (kept in state_file). Stages without inputs or marked
+    always, i.e. downloads, always run.
+
+    Attributes:
+    stages: dict of the form {name: Stage}
+    state_file: JSON file with the input fingerprints of the last runs
+    """
+
+    def __init__(self, state_file, logger=None):
+        self.stages = {}
+        self.state_file = Path(state_file)
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+    def add(self, stage):
+        assert stage.name not in self.stages, f"duplicate stage {stage.name}"
+        self.stages[stage.name] = stage
+        return stage
+
+    def dependencies(self, stage):
+        """Names of the stages that output one of stage's input paths."""
+        inputs = {path for path, _ in stage.inputs}
+        return {
+            other.name
+            for other in self.stages.values()
+            if other is not stage and inputs & {path for path, _ in other.outputs}
+        }
+
+    def _read_state(self):
+        if not self.state_file.exists():
+            return {}
+        with open(self.state_file, "r") as f:
+            return json.load(f)
+
+    def _record(self, stage, inputs_hash):
+        with self._lock:
+            state = self._read_state()
+            state[stage.name] = {"inputs": inputs_hash, "finished_at": time.time()}
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.state_file.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(state, f, indent=2)
+            tmp.replace(self.state_file)
+
+    def _inputs_hash(self, stage):
+        return {f"{path}:{layer}": fingerprint(path, layer) for path, layer in stage.inputs}
+
+    def is_up_to_date(self, stage):
+        """True if stage can be skipped; returns (skip, inputs_hash)."""
+        if stage.always or len(stage.inputs) == 0:
+            return False, self._inputs_hash(stage)
+        if not all(_exists(path, layer) for path, layer in stage.outputs):
+            return False, self._inputs_hash(stage)
+
+        input_paths = {path for path, _ in stage.inputs}
+        output_paths = {path for path, _ in stage.outputs}
+        if (
+            len(input_paths & output_paths) == 0
+            and all(path.exists() for path in input_paths)
+            and max(p.stat().st_mtime for p in input_paths)
+            < min(p.stat().st_mtime for p in output_paths)
+        ):
+            return True, None
+
+        inputs_hash = self._inputs_hash(stage)
+        previous = self._read_state().get(stage.name, {}).get("inputs")
+        return inputs_hash == previous, inputs_hash
+
+    def _run_stage(self, stage, force):
+        if not force:
+            skip, inputs_hash = self.is_up_to_date(stage)
+            if skip:
+                self.logger.info(f"[{stage.name}] up to date, skipping")
+                return False
+        else:
+            inputs_hash = self._inputs_hash(stage)
+
+        start = time.monotonic()
+        self.logger.info(f"[{stage.name}] starting")
+        stage.func()
+        self.logger.info(f"[{stage.name}] finished in {time.monotonic() - start:.1f}s")
+        self._record(stage, inputs_hash)
+        return True
+
+    def run(self, only=None, force=False, max_workers=None):
+        """Run the pipeline.
+
+        Arguments:
+        only - names of the stages to run; their dependencies are assumed
+            to be up to date
+        force - run stages even if they are up to date
+        max_workers - the number of stages run at once; defaults to all
+
+        Returns:
+        dict of the form {name: "ran" | "skipped" | "failed" | "blocked"}
+        """
+        selected = set(self.stages) if only is None else set(only)
+        unknown = selected - set(self.stages)
+        if unknown:
+            raise KeyError(f"unknown stages: {', '.join(sorted(unknown))}")
+
+        deps = {name: self.dependencies(self.stages[name]) & selected for name in selected}
+        status = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers or len(selected) or 1) as executor:
+            while len(status) < len(selected):
+                progressed = False
+                for name in sorted(selected):
+                    if name in status or name in running.values():
+                        continue
+                    if any(status.get(d) in ("failed", "blocked") for d in deps[name]):
+                        status[name] = "blocked"
+                        progressed = True
+                        self.logger.error(f"[{name}] blocked by a failed dependency")
+                    elif all(d in status for d in deps[name]):
+                        future = executor.submit(self._run_stage, self.stages[name], force)
+                        running[future] = name
+
+                if not running:
+                    if not progressed and len(status) < len(selected):
+                        raise RuntimeError("dependency cycle between pipeline stages")
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        status[name] = "ran" if future.result() else "skipped"
+                    except Exception:
+                        status[name] = "failed"
+                        self.logger.exception(f"[{name}] failed")
+        return status
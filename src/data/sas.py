@@ -1,25 +1,75 @@
 "Suggest a station"
 
 
+import math
 import random
+import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import geopandas as gpd
+import http_cache
 import pandas as pd
-import requests
+import util
 from bs4 import BeautifulSoup
 
 
-class SuggestAStation:
-    def __init__(self):
-        self.url = (
-            "https://nycdotprojects.info/project-feedback-map/suggest-station-infill"
-        )
-        self.ajax = "https://nycdotprojects.info/views/ajax?_wrapper_format=drupal_ajax"
+class RateLimiter:
+    """Spaces request starts at least interval seconds apart across threads.
+
+    A random jitter of up to half the interval is added to each wait.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval * (1 + random.random() / 2)
+        time.sleep(max(start - now, 0))
 
-        # get initial page state
-        base_page = requests.get(self.url)
-        base_page.raise_for_status()
+
+class SuggestAStation:
+    """Scraper of the Suggest-A-Station infill comments.
+
+    Comments are listed newest first: the base page holds the first page and
+    the Drupal AJAX view returns the following ones. Nothing is fetched
+    until load() or process() is called.
+
+    Attributes:
+    comments: comments scraped so far, newest first
+    max_comments: comment count shown on the base page
+    page_size: comments per page, taken from the base page
+    max_workers: AJAX pages fetched at once
+    request_interval: minimum seconds between the starts of two requests
+    """
+
+    base_url = "https://nycdotprojects.info"
+
+    def __init__(self, base_url=None, max_workers=4, request_interval=0.5):
+        if base_url is not None:
+            self.base_url = base_url
+        self.url = self.base_url + "/project-feedback-map/suggest-station-infill"
+        self.ajax = self.base_url + "/views/ajax?_wrapper_format=drupal_ajax"
+        self.max_workers = max_workers
+        self.request_interval = request_interval
+
+        self.comments = []
+        self.max_comments = None
+        self.page_size = None
+
+    def load(self):
+        """Fetch the base page for the comment count and the first page."""
+        # always revalidated, the listing changes as comments are added
+        base_page = http_cache.get_cache().get(self.url, ttl=0)
         soup = BeautifulSoup(base_page.text, "html.parser")
         self.max_comments = int(soup.find_all("span", "comments-count")[0].text)
         # comments intially loaded on page
@@ -27,7 +77,18 @@ class SuggestAStation:
             self._extract_comment(c)
             for c in soup.find_all("article", "approved-comment")
         ]
-        self.remaining_comments = self.max_comments - len(self.comments)
+        self.page_size = len(self.comments)
+
+    @property
+    def page_count(self):
+        """Number of pages including the base page."""
+        if self.page_size == 0:
+            return 1
+        return math.ceil(self.max_comments / self.page_size)
+
+    @property
+    def remaining_comments(self):
+        return self.max_comments - len(self.comments)
 
     def _extract_comment(self, comment):
         resp = dict(
@@ -55,18 +116,21 @@ class SuggestAStation:
 
         return resp
 
-    def get_comments(self, page):
+    def get_comments(self, page, limiter=None):
         payload = f"view_name=mapcomments&view_display_id=block_1&view_args=1076&view_path=%2Fnode%2F1076&field_map_comment_category_target_id=All&page={page}"
         headers = {
             "authority": "nycdotprojects.info",
             "accept": "application/json, text/javascript, */*; q=0.01",
             "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
-            "origin": "https://nycdotprojects.info",
+            "origin": self.base_url,
             "referer": self.url,
         }
 
-        response = requests.request("POST", self.ajax, headers=headers, data=payload)
-        response.raise_for_status()
+        if limiter is not None:
+            limiter.wait()
+        response = http_cache.get_cache().post(
+            self.ajax, data=payload, headers=headers, ttl=0
+        )
         data = list(
             filter(
                 lambda x: x["command"] == "insert"
@@ -80,18 +144,42 @@ class SuggestAStation:
 
         return comments
 
-    def add_remaining_comments(self, delay_requests=True):
-        remaining = True
-        page = 1
-        while remaining:
-            if delay_requests:
-                time.sleep(1 + random.random())
-            new_comments = self.get_comments(page)
-            if len(new_comments) == 0:
-                remaining = False
-            else:
-                self.comments += new_comments
-            page += 1
+    def add_remaining_comments(self, delay_requests=True, known_ids=None):
+        """Fetch the pages after the first, newest first.
+
+        Pages are fetched max_workers at a time. Fetching stops at the first
+        page containing a comment id in known_ids, as every later page only
+        holds older comments; known comments are not added.
+
+        Returns:
+        number of comments added
+        """
+        known_ids = set(known_ids or ())
+        if self.max_comments is None:
+            self.load()
+
+        limiter = RateLimiter(self.request_interval if delay_requests else 0)
+        added = 0
+        reached_known = any(c["id"] in known_ids for c in self.comments)
+        self.comments = [c for c in self.comments if c["id"] not in known_ids]
+
+        pages = range(1, self.page_count)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for start in range(0, len(pages), self.max_workers):
+                if reached_known:
+                    break
+                window = pages[start : start + self.max_workers]
+                results = executor.map(lambda p: self.get_comments(p, limiter), window)
+                for new_comments in results:
+                    if len(new_comments) == 0 or reached_known:
+                        # past the last page, or older than what is stored
+                        reached_known = True
+                        continue
+                    reached_known = any(c["id"] in known_ids for c in new_comments)
+                    new_comments = [c for c in new_comments if c["id"] not in known_ids]
+                    self.comments += new_comments
+                    added += len(new_comments)
+        return added
 
     def gdf(self, to_crs="EPSG:2263"):
         df = pd.DataFrame.from_records(self.comments)
@@ -101,7 +189,42 @@ class SuggestAStation:
         gdf.to_crs(to_crs, inplace=True)
         return gdf
 
-    def process(self, output_file, to_crs="EPSG:2263", delay_requests=True):
-        self.add_remaining_comments(delay_requests=delay_requests)
-        gdf = self.gdf(to_crs=to_crs)
-        gdf.to_file(output_file, crs=to_crs)
+    @staticmethod
+    def _stored_ids(output_file, layer):
+        """Comment ids already in the layer of output_file."""
+        if not Path(output_file).exists():
+            return set()
+        with sqlite3.connect(output_file) as con:
+            exists = con.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (layer,),
+            ).fetchone()
+            if exists is None:
+                return set()
+            return {row[0] for row in con.execute(f'SELECT id FROM "{layer}"')}
+
+    def process(
+        self, output_file, to_crs="EPSG:2263", delay_requests=True, refresh=False
+    ):
+        """Scrape new comments into output_file.
+
+        Only pages newer than the comments already stored are fetched, and
+        comments whose id is not stored yet are appended; stored comments
+        are not edited on the site, so they are kept as is. With refresh,
+        every page is fetched and the layer is rewritten, which also drops
+        comments removed from the site.
+
+        Returns:
+        number of comments written
+        """
+        layer = Path(output_file).stem
+        known_ids = set() if refresh else self._stored_ids(output_file, layer)
+
+        self.load()
+        self.add_remaining_comments(delay_requests=delay_requests, known_ids=known_ids)
+        if len(known_ids) == 0:
+            util.write_gpkg({layer: self.gdf(to_crs=to_crs)}, output_file)
+        elif len(self.comments) > 0:
+            gdf = self.gdf(to_crs=to_crs)
+            gdf.to_file(output_file, layer=layer, mode="a")
+        return len(self.comments)
@@ -1,9 +1,32 @@
 import gzip
+import sqlite3
+import threading
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+from urllib.parse import urlsplit
 
+import geojson_stream
 import geopandas as gpd
+import http_cache
+import instrument
+import pandas as pd
 import requests
 
+try:
+    import pyogrio
+except ImportError:
+    pyogrio = None
+
+try:
+    import pyarrow  # noqa: F401
+
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
 
 # Classes for handling sources
 class Source:
@@ -76,8 +99,18 @@ class SourceDict:
         """Returns a dict of the form {name : data_url} for the SourceDict."""
         return {source: self[source].data_url for source in self.sources}
 
-    def get(self):
-        data_dict = DataDict(self)
+    def get(self, max_workers=None, timeout=None, retries=1):
+        """Fetch every source concurrently into a DataDict.
+
+        Arguments:
+        max_workers - the number of sources fetched at once; defaults to all
+        timeout - seconds allowed for each source, including retries, from
+            when a worker starts fetching it
+        retries - the number of additional attempts for a failing source
+        """
+        data_dict = DataDict(
+            self, max_workers=max_workers, timeout=timeout, retries=retries
+        )
         return data_dict
 
     def __getitem__(self, name):
@@ -93,12 +126,61 @@ class DataDict:
     source_dict: associated SourceDict object
     """
 
-    def __init__(self, source_dict):
-        """Downloads data and creates dataframe for each Source in self.sources"""
+    def __init__(self, source_dict, max_workers=None, timeout=None, retries=1):
+        """Downloads data and creates dataframe for each Source in self.sources
+
+        Sources are fetched concurrently in a thread pool; self.timings holds
+        the seconds each source took. The timeout of a source runs from when
+        a worker picks it up, and also bounds its HTTP requests so that a
+        stuck fetch ends.
+        """
         self.data = {}
+        self.timings = {}
         self.source_dict = source_dict
-        for name in self.source_dict.sources:
-            self.data[name] = self.source_dict[name].get()
+
+        names = list(self.source_dict.sources)
+        if len(names) == 0:
+            return
+
+        # start time of each source, set by the worker fetching it
+        self._started = {}
+        self._running = {name: threading.Event() for name in names}
+        executor = ThreadPoolExecutor(max_workers=max_workers or len(names))
+        futures = {
+            name: executor.submit(self._get_source, name, retries, timeout)
+            for name in names
+        }
+        try:
+            for name, future in futures.items():
+                remaining = None
+                if timeout is not None:
+                    self._running[name].wait()
+                    remaining = max(0, self._started[name] + timeout - time.monotonic())
+                try:
+                    self.data[name], self.timings[name] = future.result(remaining)
+                except FutureTimeoutError:
+                    raise TimeoutError(
+                        f"{name} source not fetched within {timeout} seconds"
+                    )
+                print(f"{name} fetched in {self.timings[name]:.1f}s")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_source(self, name, retries, timeout):
+        """Fetch a single source, retrying on failure; returns (gdf, seconds)"""
+        start = self._started[name] = time.monotonic()
+        self._running[name].set()
+        source = self.source_dict[name]
+        with http_cache.deadline(timeout):
+            for attempt in range(retries + 1):
+                try:
+                    gdf = source.get()
+                    return gdf, time.monotonic() - start
+                except Exception:
+                    if attempt == retries:
+                        raise
+                    warnings.warn(f"fetching {source.name} failed, retrying")
+                    time.sleep(2**attempt)
 
     def __getitem__(self, name):
         """Returns the GeoDataFrame in self.data corresponding to name."""
@@ -128,11 +210,105 @@ class DataDict:
 
 
 # Get GeoJSON from URL
-def json_response(url, limit=500000):
+def cached_response(url, limit=500000, offset=0, order=None, params=None, retries=3):
+    """Returns the cached response for the url with the specified limit parameter.
+
+    Arguments:
+    url - SODA resource url
+    limit - $limit parameter, the number of records requested
+    offset - $offset parameter, the index of the first record requested
+    order - $order parameter; paging requires a stable order such as ":id"
+    params - additional query parameters
+    retries - number of attempts before the request error is raised
+    """
+    my_params = {"$limit": limit, "$offset": offset}
+    if order is not None:
+        my_params["$order"] = order
+    if params is not None:
+        my_params.update(params)
+
+    for attempt in range(retries):
+        try:
+            return http_cache.get_cache().get(url, params=my_params)
+        except (requests.ConnectionError, requests.HTTPError, requests.Timeout):
+            if attempt == retries - 1:
+                raise
+            time.sleep(2**attempt)
+
+
+def json_response(url, limit=500000, offset=0, order=None, params=None, retries=3):
     """Returns JSON response for the url with the specified limit parameter."""
-    my_params = {"$limit": limit}
-    with requests.get(url, params=my_params) as response:
-        return response.json()
+    return cached_response(url, limit, offset, order, params, retries).json()
+
+
+def _page_gdf(url, limit, offset, params=None):
+    """Request a single page of a SODA resource as a GeoDataFrame"""
+    response = cached_response(url, limit, offset, order=":id", params=params)
+    with response.stream() as stream:
+        gdf = geojson_stream.read_geojson(stream)
+    if len(gdf) == 0:
+        return None
+    return gdf
+
+
+def iter_pages(url, limit=500000, page_size=50000, max_workers=4, params=None):
+    """Yield GeoDataFrames for consecutive pages of a SODA resource.
+
+    Up to max_workers pages are requested concurrently and yielded in
+    offset order as they arrive, so at most max_workers pages are held in
+    memory. Paging stops at the first short page or after limit records.
+    A page that fails is retried on its own by json_response.
+
+    Arguments:
+    url - SODA resource url returning GeoJSON
+    limit - the maximum number of records to request overall
+    page_size - the number of records per request
+    max_workers - the maximum number of requests in flight
+    params - additional query parameters for every page
+    """
+    offsets = iter(range(0, limit, page_size))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = []
+        for offset in offsets:
+            in_flight.append(
+                executor.submit(
+                    _page_gdf, url, min(page_size, limit - offset), offset, params
+                )
+            )
+            if len(in_flight) == max_workers:
+                break
+
+        while in_flight:
+            page = in_flight.pop(0).result()
+            if page is None or len(page) < page_size:
+                # last page reached; discard any requests past the end
+                for future in in_flight:
+                    future.cancel()
+                if page is not None:
+                    yield page
+                return
+            yield page
+
+            offset = next(offsets, None)
+            if offset is not None:
+                in_flight.append(
+                    executor.submit(
+                        _page_gdf, url, min(page_size, limit - offset), offset, params
+                    )
+                )
+
+
+def rebase_url(url, base_url=None):
+    """Point url at another server, e.g. a local fixture server.
+
+    The scheme and host of url are replaced by base_url, whose path is
+    prepended to the path of url. Returns url unchanged if base_url is None.
+    """
+    if base_url is None:
+        return url
+    parts = urlsplit(url)
+    query = f"?{parts.query}" if parts.query else ""
+    return base_url.rstrip("/") + parts.path + query
 
 
 def download_file(url, local_filename=None, chunk_size=8192, compress=False):
@@ -154,31 +330,73 @@ def download_file(url, local_filename=None, chunk_size=8192, compress=False):
             ".gz"
         ), "compressed file must have .gz extension"
 
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        f = gzip.open(local_filename, "wb") if compress else open(local_filename, "wb")
+    def write(r, path):
+        f = gzip.open(path, "wb") if compress else open(path, "wb")
         for chunk in r.iter_content(chunk_size=chunk_size):
             f.write(chunk)
         f.close()
-        return local_filename
+
+    # skipped when the local file is still current with the server
+    with instrument.span("download"):
+        http_cache.get_cache().download(url, local_filename, write)
+    return local_filename
 
 
 # Create GeoDataFrame from URL
-def gdf_from_url(url, limit=500000):
+def gdf_from_url(
+    url,
+    limit=500000,
+    page_size=50000,
+    max_workers=4,
+    params=None,
+    gpkg=None,
+    layer=None,
+    crs=None,
+):
     """Requests the data from url and returns a GeoDataFrame.
 
     Arguments:
     url - The URL to which the request will be made. Should return a GeoJSON of type FeatureCollection.
     limit - The limit parameter for the request, indicating how many records will be requested.
+    page_size - The number of records requested per page.
+    max_workers - The number of pages requested concurrently.
+    params - Additional query parameters for the request.
+    gpkg - If given, pages are appended to this GeoPackage as they arrive instead of being kept in memory.
+    layer - The GeoPackage layer name, required with gpkg.
+    crs - CRS set on each page before it is written to gpkg.
 
     Returns:
-    gdf - A GeoDataFrame with the data from url.
+    gdf - A GeoDataFrame with the data from url, or the number of records
+    written when gpkg is given.
     """
 
     print(f"Downloading data from {url}...")
-    response = json_response(url, limit)
+    pages = iter_pages(url, limit, page_size, max_workers, params)
+    with instrument.span("download") as s:
+        result = _collect_pages(pages, gpkg, layer, crs)
+        s.rows = result if gpkg is not None else len(result)
+    return result
+
+
+def _collect_pages(pages, gpkg=None, layer=None, crs=None):
+    """Concatenate pages into a GeoDataFrame, or append them to a GeoPackage"""
+    if gpkg is not None:
+        assert layer is not None, "layer name required to write to GeoPackage"
+        count = 0
+        for page in pages:
+            if crs is not None:
+                page.set_crs(crs, inplace=True)
+            page.to_file(gpkg, layer=layer, driver="GPKG", mode="w" if count == 0 else "a")
+            count += len(page)
+        print(f"{count} records written to {layer} layer of {gpkg}.\n")
+        return count
+
+    pages = list(pages)
     print("Creating GeoDataFrame...")
-    gdf = gpd.GeoDataFrame.from_features(response)
+    if len(pages) == 0:
+        gdf = gpd.GeoDataFrame(geometry=gpd.GeoSeries([]))
+    else:
+        gdf = gpd.GeoDataFrame(pd.concat(pages, ignore_index=True))
     print("GeoDataFrame complete.\n")
     return gdf
 
@@ -211,6 +429,159 @@ def gdf_dict(url_dict, limit=500000):
     return ans
 
 
+# GeoPackage R-tree spatial index, per the GeoPackage spec (gpkg_rtree_index)
+RTREE_TRIGGERS = """
+CREATE TRIGGER "rtree_{t}_{c}_insert" AFTER INSERT ON "{t}"
+WHEN (new."{c}" NOT NULL AND NOT ST_IsEmpty(NEW."{c}"))
+BEGIN
+  INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (
+    NEW."{i}", ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}"));
+END;
+CREATE TRIGGER "rtree_{t}_{c}_update1" AFTER UPDATE OF "{c}" ON "{t}"
+WHEN OLD."{i}" = NEW."{i}" AND (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+BEGIN
+  INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (
+    NEW."{i}", ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}"));
+END;
+CREATE TRIGGER "rtree_{t}_{c}_update2" AFTER UPDATE OF "{c}" ON "{t}"
+WHEN OLD."{i}" = NEW."{i}" AND (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}"))
+BEGIN
+  DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}";
+END;
+CREATE TRIGGER "rtree_{t}_{c}_update3" AFTER UPDATE ON "{t}"
+WHEN OLD."{i}" != NEW."{i}" AND (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+BEGIN
+  DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}";
+  INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (
+    NEW."{i}", ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}"));
+END;
+CREATE TRIGGER "rtree_{t}_{c}_update4" AFTER UPDATE ON "{t}"
+WHEN OLD."{i}" != NEW."{i}" AND (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}"))
+BEGIN
+  DELETE FROM "rtree_{t}_{c}" WHERE id IN (OLD."{i}", NEW."{i}");
+END;
+CREATE TRIGGER "rtree_{t}_{c}_delete" AFTER DELETE ON "{t}"
+WHEN old."{c}" NOT NULL
+BEGIN
+  DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}";
+END;
+"""
+
+
+def _write_layer(gdf, path, layer):
+    """Write a single layer without a spatial index, using Arrow if available"""
+    if pyogrio is not None:
+        pyogrio.write_dataframe(
+            gdf,
+            path,
+            layer=layer,
+            driver="GPKG",
+            use_arrow=HAS_ARROW,
+            layer_options={"SPATIAL_INDEX": "NO"},
+        )
+    else:
+        gdf.to_file(path, layer=layer, driver="GPKG", SPATIAL_INDEX="NO")
+
+
+def _create_spatial_index(con, gdf, layer):
+    """Bulk load the GeoPackage R-tree of a freshly written layer.
+
+    Feature ids of a new layer follow row order, so the envelopes are taken
+    from the in-memory geometries instead of being recomputed by SQLite.
+    """
+    geometry_column = con.execute(
+        "SELECT table_name, column_name FROM gpkg_geometry_columns WHERE table_name = ?",
+        (layer,),
+    ).fetchone()
+    if geometry_column is None:
+        # attribute-only table
+        return
+    table, column = geometry_column
+    fid = [r[1] for r in con.execute(f'PRAGMA table_info("{table}")') if r[5] == 1][0]
+    rtree = f"rtree_{table}_{column}"
+
+    con.execute(f'DROP TABLE IF EXISTS "{rtree}"')
+    con.execute(
+        f'CREATE VIRTUAL TABLE "{rtree}" USING rtree(id, minx, maxx, miny, maxy)'
+    )
+
+    bounds = gdf.geometry.bounds.to_numpy()
+    ids = con.execute(f'SELECT "{fid}" FROM "{table}" ORDER BY "{fid}"').fetchall()
+    rows = (
+        (i[0], b[0], b[2], b[1], b[3])
+        for i, b in zip(ids, bounds)
+        if b[0] == b[0]  # NaN bounds for null / empty geometries
+    )
+    con.executemany(f'INSERT INTO "{rtree}" VALUES (?, ?, ?, ?, ?)', rows)
+
+    con.executescript(RTREE_TRIGGERS.format(t=table, c=column, i=fid))
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS gpkg_extensions ("
+        "table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, "
+        "definition TEXT NOT NULL, scope TEXT NOT NULL, "
+        "CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))"
+    )
+    con.execute(
+        "INSERT OR REPLACE INTO gpkg_extensions VALUES "
+        "(?, ?, 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')",
+        (table, column),
+    )
+
+
+@instrument.timed("write_gpkg")
+def write_gpkg(gdf_dict, path, replace=False):
+    """Writes a dict of GeoDataFrames as the layers of a GeoPackage.
+
+    All layers are bulk inserted first, through pyogrio and Arrow when
+    available, and the spatial indexes of every layer are then built in one
+    SQLite transaction. Existing layers of the same name are replaced.
+
+    Arguments:
+    gdf_dict - a dict of the form {layer name: GeoDataFrame}
+    path - the path to which the GeoPackage will be written
+    replace - delete any existing file at path first
+
+    Returns:
+    stats - a dict of the form {layer name: {"rows", "seconds", "rows_per_s"}},
+    plus "total" with the bytes written and bytes per second
+    """
+    path = Path(path)
+    if replace and path.exists():
+        path.unlink()
+
+    stats = {}
+    start_size = path.stat().st_size if path.exists() else 0
+    start = time.monotonic()
+    for layer, gdf in gdf_dict.items():
+        layer_start = time.monotonic()
+        _write_layer(gdf, path, layer)
+        seconds = time.monotonic() - layer_start
+        stats[layer] = {
+            "rows": len(gdf),
+            "seconds": seconds,
+            "rows_per_s": len(gdf) / seconds if seconds > 0 else None,
+        }
+
+    with sqlite3.connect(path) as con:
+        for layer, gdf in gdf_dict.items():
+            _create_spatial_index(con, gdf, layer)
+        con.commit()
+
+    seconds = time.monotonic() - start
+    nbytes = path.stat().st_size - start_size
+    stats["total"] = {
+        "rows": sum(len(gdf) for gdf in gdf_dict.values()),
+        "bytes": nbytes,
+        "seconds": seconds,
+        "bytes_per_s": nbytes / seconds if seconds > 0 else None,
+    }
+    for layer, layer_stats in stats.items():
+        if layer != "total":
+            print(f"{layer}: {layer_stats['rows']} rows in {layer_stats['seconds']:.1f}s")
+    print(f"{nbytes / 1e6:.1f} MB written to {path} in {seconds:.1f}s.")
+    return stats
+
+
 # Export dict of GeoDataFrames to a GeoPackage
 def gdf_dict_to_gpkg(gdf_dict, path):
     """Writes a dict of GeoDataFrames as the layers of a GeoPackage.
@@ -219,9 +590,7 @@ def gdf_dict_to_gpkg(gdf_dict, path):
     gdf_dict - a dict of GDFs in the format returned by gdf_dict().
     path - the path to which the GeoPackage will be written."""
     print("Creating GeoPackage...")
-    for key in gdf_dict:
-        print(f"Writing {key} layer...")
-        gdf_dict[key].to_file(path, layer=key, driver="GPKG")
+    write_gpkg(gdf_dict, path)
     print(f"GeoPackage written to {path}.")
 
 
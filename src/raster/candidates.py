@@ -0,0 +1,145 @@
+"""Ranked candidate station sites from a constrained suitability scenario
+
+Candidates are the local maxima of the fine _cons_norm layer of a scenario
+among cells where R_constraint is 1. They are selected greedily, best
+first, keeping every site at least MIN_DIST_CB_TO_CB from existing stations
+and from the sites already selected.
+
+Tiles of the fine raster are visited in decreasing order of the best
+score they can hold, which is known from the medium _norm layer, and
+candidates are only settled once no unvisited tile can beat them, so the
+search usually stops after a few tiles.
+"""
+
+import heapq
+import math
+
+import numpy as np
+import tiles
+from scenarios import WEIGHTS
+
+# rows and columns of the fine tiles searched for local maxima; small tiles
+# keep the bound of each tile tight
+TILE_SIZE = 256
+
+
+def local_maxima(array):
+    """Cells at least as high as their 8 neighbours, plateaus included.
+
+    NaN cells are never maxima.
+    """
+    values = np.where(np.isnan(array), -np.inf, array)
+    padded = np.pad(values, 1, constant_values=-np.inf)
+    rows, cols = array.shape
+    neighbours = np.full(array.shape, -np.inf)
+    for dr in range(3):
+        for dc in range(3):
+            if dr == 1 and dc == 1:
+                continue
+            np.maximum(neighbours, padded[dr : dr + rows, dc : dc + cols], out=neighbours)
+    return (values >= neighbours) & ~np.isnan(array)
+
+
+class SpacingIndex:
+    """Points kept at least min_dist apart, hashed into square buckets of min_dist.
+
+    A point can only conflict with points in its own bucket or the 8
+    around it, so checks and inserts take constant time.
+    """
+
+    def __init__(self, min_dist):
+        self.min_dist = min_dist
+        self._buckets = {}
+
+    def _key(self, x, y):
+        return math.floor(x / self.min_dist), math.floor(y / self.min_dist)
+
+    def add(self, x, y):
+        self._buckets.setdefault(self._key(x, y), []).append((x, y))
+
+    def is_clear(self, x, y):
+        """True if (x, y) is at least min_dist from every point"""
+        kx, ky = self._key(x, y)
+        for i in (kx - 1, kx, kx + 1):
+            for j in (ky - 1, ky, ky + 1):
+                for px, py in self._buckets.get((i, j), ()):
+                    if (px - x) ** 2 + (py - y) ** 2 < self.min_dist**2:
+                        return False
+        return True
+
+
+def select(engine, scenario, k, min_dist, existing=None, tile_size=TILE_SIZE):
+    """Greedy top k local maxima of the scenario's fine _cons_norm layer.
+
+    Arguments:
+    engine - ScenarioEngine
+    scenario - Scenario from engine.scenario
+    k - sites to select
+    min_dist - minimum spacing between sites and to existing stations
+    existing - (x, y) arrays of existing stations
+
+    Returns:
+    dict of arrays: x, y, score, row and col of the fine cell, and the value
+    of each index at the site, best first
+    """
+    fine = engine.fine
+    spacing = SpacingIndex(min_dist)
+    if existing is not None:
+        for x, y in zip(*existing):
+            spacing.add(x, y)
+
+    # best possible score of each tile, from the rescaled medium values
+    one, _ = engine.cons_values(scenario.norm, scenario.cons_bounds)
+    queue = []
+    for rows, cols in tiles.windows(fine.shape, tile_size):
+        block = one[engine.medium_window(rows, cols)]
+        if block.size > 0 and not np.isnan(block).all():
+            queue.append((-float(np.nanmax(block)), rows.start, cols.start))
+    heapq.heapify(queue)
+
+    # candidates of the visited tiles not yet settled, best first
+    pending = np.empty((3, 0))
+    selected = []
+    while len(selected) < k:
+        bound = -queue[0][0] if queue else -np.inf
+        # settle the candidates that no unvisited tile can beat
+        n = 0
+        for score, row, col in pending.T:
+            if score <= bound or len(selected) == k:
+                break
+            n += 1
+            x, y = float(fine.x(col)), float(fine.y(row))
+            if spacing.is_clear(x, y):
+                spacing.add(x, y)
+                selected.append((x, y, score, int(row), int(col)))
+        pending = pending[:, n:]
+        if len(selected) == k or not queue:
+            break
+
+        _, r0, c0 = heapq.heappop(queue)
+        found = _tile_candidates(engine, scenario, r0, c0, tile_size)
+        pending = np.concatenate([pending, found], axis=1)
+        pending = pending[:, np.lexsort((pending[2], pending[1], -pending[0]))]
+
+    columns = ("x", "y", "score", "row", "col")
+    result = {c: np.array([s[i] for s in selected]) for i, c in enumerate(columns)}
+    m_rows, m_cols, _ = engine.medium.rowcol(result["x"], result["y"])
+    for name in WEIGHTS.values():
+        result[name] = np.asarray(engine.indices[name])[m_rows, m_cols]
+    return result
+
+
+def _tile_candidates(engine, scenario, r0, c0, tile_size):
+    """(score, row, col) of the local maxima of a tile where R_constraint is 1"""
+    fine = engine.fine
+    rows = slice(max(r0 - 1, 0), min(r0 + tile_size + 1, fine.rows))
+    cols = slice(max(c0 - 1, 0), min(c0 + tile_size + 1, fine.cols))
+    values = engine.fine_window(scenario, "cons_norm", rows, cols)
+    peaks = local_maxima(values) & (np.asarray(engine.constraint[rows, cols]) == 1)
+
+    # drop the halo
+    core_r = slice(r0 - rows.start, min(r0 + tile_size, fine.rows) - rows.start)
+    core_c = slice(c0 - cols.start, min(c0 + tile_size, fine.cols) - cols.start)
+    pr, pc = np.nonzero(peaks[core_r, core_c])
+    scores = values[core_r, core_c][pr, pc]
+    return np.array([scores, pr + r0, pc + c0], dtype=np.float64)
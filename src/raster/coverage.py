@@ -0,0 +1,109 @@
+"""Maximal covering placement of new stations
+
+Chooses n candidate cells that together cover the most demand, e.g. the
+unserved population R_acs * R_service_area_inverse, within WALK_RADIUS of a
+chosen site, counting every demand cell once.
+
+Coverage is submodular: the gain of a candidate only shrinks as sites are
+chosen. Candidates are therefore kept in a priority queue keyed by a
+possibly stale gain and only the one on top is re-evaluated (lazy greedy).
+Initial gains are the walk radius sums of the demand over the whole grid;
+the catchment of a candidate, the flat indices of the demand cells it
+covers, is only listed once the candidate reaches the top of the queue.
+"""
+
+import heapq
+
+import numpy as np
+import ops
+from model import WALK_RADIUS
+
+# relative margin keeping the float32 walk radius sums upper bounds of the
+# exact initial gains
+GAIN_MARGIN = 1e-6
+
+
+class Coverage:
+    """Greedy maximal coverage of a demand raster.
+
+    Attributes:
+    grid: Grid of the demand
+    demand: demand per flat cell, 0 where NULL
+    remaining: demand per flat cell not covered by the chosen sites
+    kernel: circular window of the walk radius, as sum_rast_in_walk_radius
+    """
+
+    def __init__(self, demand, grid, walk_radius=WALK_RADIUS):
+        self.grid = grid
+        self.demand = np.nan_to_num(np.asarray(demand, dtype=np.float64), nan=0.0).ravel()
+        self.remaining = self.demand.copy()
+        self.kernel = ops.circular_kernel(ops.walk_radius_size(walk_radius, grid.res))
+        radius = self.kernel.shape[0] // 2
+        dr, dc = np.nonzero(self.kernel)
+        self._offsets = dr - radius, dc - radius
+
+    def catchment(self, cell):
+        """Flat indices of the cells with demand within the walk radius of cell"""
+        row, col = divmod(int(cell), self.grid.cols)
+        rows, cols = row + self._offsets[0], col + self._offsets[1]
+        inside = (rows >= 0) & (rows < self.grid.rows) & (cols >= 0) & (cols < self.grid.cols)
+        idx = rows[inside] * self.grid.cols + cols[inside]
+        return idx[self.demand[idx] > 0]
+
+    def gains(self):
+        """Remaining demand within the walk radius of every flat cell"""
+        remaining = self.remaining.reshape(self.grid.shape)
+        return ops.neighborhood_sum(remaining, self.kernel, method="spans").ravel()
+
+    def select(self, cells, n):
+        """Greedily choose up to n sites among the flat candidate cells.
+
+        Sites already chosen by earlier calls stay covered, so existing or
+        committed sites can be placed first.
+
+        Arguments:
+        cells - flat indices of the candidate cells
+        n - sites to choose
+
+        Returns:
+        dict of arrays, in order of choice: cell, row, col, x and y of the
+        sites, gain, the demand each newly covers, and covered, the demand
+        covered by the sites of this call up to and including it
+        """
+        cells = np.unique(np.asarray(cells, dtype=np.int64))
+        bounds = self.gains()[cells] * (1 + GAIN_MARGIN)
+        queue = [(-float(b), int(c)) for b, c in zip(bounds, cells) if b > 0]
+        heapq.heapify(queue)
+
+        chosen, gains = [], []
+        while queue and len(chosen) < n:
+            _, cell = heapq.heappop(queue)
+            idx = self.catchment(cell)
+            gain = float(self.remaining[idx].sum())
+            if gain <= 0:
+                continue
+            if queue and gain < -queue[0][0]:
+                # stale, another candidate may gain more
+                heapq.heappush(queue, (-gain, cell))
+                continue
+            chosen.append(cell)
+            gains.append(gain)
+            self.remaining[idx] = 0
+
+        cells = np.array(chosen, dtype=np.int64)
+        rows, cols = np.divmod(cells, self.grid.cols)
+        gains = np.array(gains)
+        return {
+            "cell": cells,
+            "row": rows,
+            "col": cols,
+            "x": self.grid.x(cols),
+            "y": self.grid.y(rows),
+            "gain": gains,
+            "covered": np.cumsum(gains),
+        }
+
+    @property
+    def total(self):
+        """Demand covered so far"""
+        return float(self.demand.sum() - self.remaining.sum())
@@ -0,0 +1,142 @@
+"""Exact Euclidean distance transform
+
+Squared distances are computed in two separable passes, as in Felzenszwalb
+and Huttenlocher, "Distance Transforms of Sampled Functions" (2012): a 1D
+distance along each column, then the lower envelope of the parabolas
+(x - q)**2 + f(q) along each row. Both passes are linear in the number of
+cells. The envelope is built for all rows in lockstep, one column at a
+time, so the Python loop runs over columns while NumPy works across rows.
+
+Large rasters are processed in tiles with a halo: distances up to the halo
+width are exact, anything farther is reported as inf.
+"""
+
+import math
+
+import numpy as np
+
+# rows and columns of the core of a tile, without its halo
+TILE_SIZE = 2048
+
+
+def _column_sq(features):
+    """Squared distance along each column to the nearest feature, inf if none"""
+    idx = np.arange(features.shape[0], dtype=np.float64)[:, None]
+    above = np.maximum.accumulate(np.where(features, idx, -np.inf), axis=0)
+    below = np.minimum.accumulate(np.where(features, idx, np.inf)[::-1], axis=0)[::-1]
+    return np.minimum(idx - above, below - idx) ** 2
+
+
+def _envelope_sq(f):
+    """min over q of (x - q)**2 + f[:, q] for every row and column x of f"""
+    n_rows, n = f.shape
+    v = np.zeros((n_rows, n), dtype=np.int64)  # parabola vertices
+    z = np.full((n_rows, n + 1), np.inf)  # boundaries between parabolas
+    k = np.full(n_rows, -1)  # index of the rightmost parabola, -1 if none
+
+    for q in range(n):
+        fq = f[:, q] + q * q
+        todo = np.flatnonzero(np.isfinite(fq))
+        while len(todo) > 0:
+            kt = k[todo]
+            empty = kt < 0
+            kt0 = np.maximum(kt, 0)
+            vk = v[todo, kt0]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                s = (fq[todo] - (f[todo, vk] + vk * vk)) / (2.0 * (q - vk))
+            s[empty] = -np.inf
+            pop = ~empty & (s <= z[todo, kt0])
+
+            push, kp = todo[~pop], kt[~pop] + 1
+            v[push, kp] = q
+            z[push, kp] = s[~pop]
+            z[push, kp + 1] = np.inf
+            k[push] = kp
+
+            todo = todo[pop]
+            k[todo] -= 1
+
+    # The parabola covering x is the number of interior boundaries below x.
+    # Offsetting each row by n + 2 keeps the flattened boundaries sorted, so
+    # every row is searched at once.
+    rows = np.arange(n_rows)
+    stride = n + 2
+    interior = np.arange(1, n + 1)[None, :] <= k[:, None]
+    offset = (rows * stride)[:, None]
+    bounds = np.where(interior, np.clip(z[:, 1:], -1, n), n + 1) + offset
+    x = np.arange(n)
+    keys = x[None, :] + offset
+    j = np.searchsorted(bounds.ravel(), keys.ravel()).reshape(n_rows, n)
+    j -= (rows * n)[:, None]
+    vj = v[rows[:, None], j]
+    out = (x[None, :] - vj) ** 2 + f[rows[:, None], vj]
+    out[k < 0] = np.inf
+    return out
+
+
+def squared_distance(features):
+    """Squared distance in cells from each cell to the nearest True cell.
+
+    Returns:
+    float64 array, 0 on features and inf everywhere if there are none
+    """
+    features = np.asarray(features, dtype=bool)
+    if features.shape[0] < features.shape[1]:
+        return _envelope_sq(_column_sq(features.T)).T
+    return _envelope_sq(_column_sq(features))
+
+
+def halo_cells(max_dist, res):
+    """Halo width in cells that keeps distances up to max_dist exact"""
+    return math.ceil(max_dist / res) + 1
+
+
+def window_distance(features, res, halo=0):
+    """Distances over a window read with a halo around its core.
+
+    Arguments:
+    features - boolean window
+    res - cell size
+    halo - halo width in cells; distances beyond it are set to inf, as
+        features outside the window may be nearer. 0 for an exact window.
+
+    Returns:
+    float32 distances over the whole window
+    """
+    sq = squared_distance(features)
+    dist = (np.sqrt(sq) * res).astype(np.float32)
+    if halo:
+        dist[sq > halo * halo] = np.inf
+    return dist
+
+
+def distance_tiles(features, res, max_dist=None, tile_size=TILE_SIZE):
+    """Distances to the non-NaN cells of features, one tile at a time.
+
+    Arguments:
+    features - 2D raster, an ndarray or a np.memmap larger than RAM
+    res - cell size
+    max_dist - distances beyond this may be reported as inf; if None the
+        raster is processed as a single exact tile
+    tile_size - rows and columns of each tile core
+
+    Yields:
+    (row_slice, col_slice), distance - float32 distances of a tile core
+    """
+    n_rows, n_cols = features.shape
+    if max_dist is None:
+        tile_size = max(n_rows, n_cols)
+        halo = 0
+    else:
+        halo = halo_cells(max_dist, res)
+
+    for r0 in range(0, n_rows, tile_size):
+        for c0 in range(0, n_cols, tile_size):
+            r1, c1 = min(r0 + tile_size, n_rows), min(c0 + tile_size, n_cols)
+            wr0, wc0 = max(r0 - halo, 0), max(c0 - halo, 0)
+            wr1, wc1 = min(r1 + halo, n_rows), min(c1 + halo, n_cols)
+            window = ~np.isnan(np.asarray(features[wr0:wr1, wc0:wc1]))
+            dist = window_distance(window, res, halo)
+            yield (slice(r0, r1), slice(c0, c1)), dist[
+                r0 - wr0 : r1 - wr0, c0 - wc0 : c1 - wc0
+            ]
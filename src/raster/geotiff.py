@@ -0,0 +1,89 @@
+"""GeoTIFF reading and writing through GDAL"""
+
+from pathlib import Path
+
+import numpy as np
+from grid import Grid
+
+try:
+    from osgeo import gdal, osr
+
+    gdal.UseExceptions()
+except ImportError:
+    gdal = None
+
+CREATION_OPTIONS = ["COMPRESS=DEFLATE", "TILED=YES", "BIGTIFF=IF_SAFER"]
+
+# rows written at a time, so that memory-mapped layers are not read whole
+WRITE_ROWS = 1024
+
+
+def _require_gdal():
+    if gdal is None:
+        raise ImportError("GDAL python bindings (osgeo) are required for GeoTIFF I/O")
+
+
+def _srs_wkt(epsg):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    return srs.ExportToWkt()
+
+
+def write(path, array, grid):
+    """Write a single band GeoTIFF; NaN cells of float arrays are nodata.
+
+    array may be a memory map, it is written WRITE_ROWS rows at a time.
+
+    Returns:
+    path
+    """
+    _require_gdal()
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    gdal_type = gdal.GDT_Float32 if array.dtype.kind == "f" else gdal.GDT_Int32
+    ds = gdal.GetDriverByName("GTiff").Create(
+        str(path), grid.cols, grid.rows, 1, gdal_type, options=CREATION_OPTIONS
+    )
+    ds.SetGeoTransform(grid.transform)
+    ds.SetProjection(_srs_wkt(grid.crs))
+    band = ds.GetRasterBand(1)
+    if array.dtype.kind == "f":
+        band.SetNoDataValue(float("nan"))
+    for r0 in range(0, grid.rows, WRITE_ROWS):
+        band.WriteArray(np.asarray(array[r0 : r0 + WRITE_ROWS]), 0, r0)
+    ds = None
+    return path
+
+
+def read_grid(path):
+    """Grid of a raster file"""
+    _require_gdal()
+    ds = gdal.Open(str(path))
+    xmin, res, _, ymax, _, _ = ds.GetGeoTransform()
+    srs = osr.SpatialReference(wkt=ds.GetProjection())
+    epsg = srs.GetAuthorityCode(None)
+    return Grid(xmin, ymax, res, ds.RasterYSize, ds.RasterXSize, int(epsg or 0))
+
+
+def read(path, window=None):
+    """Read band 1 of a raster as float32, with nodata as NaN.
+
+    Arguments:
+    path - raster file
+    window - optional (row_off, col_off, rows, cols) to read
+
+    Returns:
+    array, grid
+    """
+    _require_gdal()
+    grid = read_grid(path)
+    ds = gdal.Open(str(path))
+    band = ds.GetRasterBand(1)
+    if window is None:
+        window = (0, 0, grid.rows, grid.cols)
+    row_off, col_off, rows, cols = window
+    array = band.ReadAsArray(col_off, row_off, cols, rows).astype(np.float32)
+    nodata = band.GetNoDataValue()
+    if nodata is not None and not np.isnan(nodata):
+        array[array == nodata] = np.nan
+    return array, grid.window(row_off, col_off, rows, cols)
@@ -0,0 +1,134 @@
+"""Raster grid shared by the layers of the suitability model"""
+
+import math
+
+import numpy as np
+
+
+class Grid:
+    """North-up raster grid, the equivalent of a GRASS region.
+
+    Attributes:
+    xmin, ymax: coordinates of the upper left corner
+    res: cell size in CRS units (feet for EPSG:2263)
+    rows, cols: number of cells
+    crs: EPSG code of the grid
+    """
+
+    def __init__(self, xmin, ymax, res, rows, cols, crs=2263):
+        self.xmin = xmin
+        self.ymax = ymax
+        self.res = res
+        self.rows = rows
+        self.cols = cols
+        self.crs = crs
+
+    @classmethod
+    def from_bounds(cls, bounds, res, crs=2263):
+        """Grid covering bounds (xmin, ymin, xmax, ymax), aligned to res.
+
+        As `g.region -a`, the extent is grown to multiples of res so that
+        grids of different resolutions over the same bounds line up.
+        """
+        xmin, ymin, xmax, ymax = bounds
+        xmin = math.floor(xmin / res) * res
+        ymin = math.floor(ymin / res) * res
+        xmax = math.ceil(xmax / res) * res
+        ymax = math.ceil(ymax / res) * res
+        return cls(
+            xmin,
+            ymax,
+            res,
+            round((ymax - ymin) / res),
+            round((xmax - xmin) / res),
+            crs,
+        )
+
+    @classmethod
+    def from_gdf(cls, gdf, res):
+        """Grid over the extent of a GeoDataFrame, as `g.region vector=`."""
+        return cls.from_bounds(gdf.total_bounds, res, crs=gdf.crs.to_epsg())
+
+    def __eq__(self, other):
+        return isinstance(other, Grid) and (
+            (self.xmin, self.ymax, self.res, self.rows, self.cols, self.crs)
+            == (other.xmin, other.ymax, other.res, other.rows, other.cols, other.crs)
+        )
+
+    def __repr__(self):
+        return (
+            f"Grid(xmin={self.xmin}, ymax={self.ymax}, res={self.res}, "
+            f"rows={self.rows}, cols={self.cols}, crs={self.crs})"
+        )
+
+    @property
+    def shape(self):
+        return (self.rows, self.cols)
+
+    @property
+    def size(self):
+        return self.rows * self.cols
+
+    @property
+    def cell_area(self):
+        return self.res**2
+
+    @property
+    def bounds(self):
+        return (
+            self.xmin,
+            self.ymax - self.rows * self.res,
+            self.xmin + self.cols * self.res,
+            self.ymax,
+        )
+
+    @property
+    def transform(self):
+        """GDAL geotransform of the grid"""
+        return (self.xmin, self.res, 0.0, self.ymax, 0.0, -self.res)
+
+    def x(self, cols=None):
+        """x coordinates of the centres of cols, by default of every column"""
+        cols = np.arange(self.cols) if cols is None else np.asarray(cols)
+        return self.xmin + (cols + 0.5) * self.res
+
+    def y(self, rows=None):
+        """y coordinates of the centres of rows, by default of every row"""
+        rows = np.arange(self.rows) if rows is None else np.asarray(rows)
+        return self.ymax - (rows + 0.5) * self.res
+
+    def rowcol(self, x, y):
+        """Row and column of the cells containing points (x, y).
+
+        Returns:
+        rows, cols, inside - integer index arrays and a boolean array of the
+        points that fall within the grid
+        """
+        cols = np.floor((np.asarray(x) - self.xmin) / self.res).astype(np.int64)
+        rows = np.floor((self.ymax - np.asarray(y)) / self.res).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+        return rows, cols, inside
+
+    def window(self, row_off, col_off, rows, cols):
+        """Sub-grid of rows x cols cells starting at (row_off, col_off)"""
+        return Grid(
+            self.xmin + col_off * self.res,
+            self.ymax - row_off * self.res,
+            self.res,
+            rows,
+            cols,
+            self.crs,
+        )
+
+
+def resample(array, src, dst):
+    """Nearest neighbour resampling of array from grid src to grid dst.
+
+    As r.resample, each dst cell takes the value of the src cell containing
+    its centre; cells outside src are NaN.
+    """
+    rows, _, row_in = src.rowcol(np.full(dst.rows, src.xmin), dst.y())
+    _, cols, col_in = src.rowcol(dst.x(), np.full(dst.cols, src.ymax))
+    out = np.full(dst.shape, np.nan, dtype=np.float32)
+    out[np.ix_(row_in, col_in)] = array[np.ix_(rows[row_in], cols[col_in])]
+    return out
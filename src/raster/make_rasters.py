@@ -0,0 +1,312 @@
+"""Suitability model driver script
+
+Computes the layers of src/grass/rasterize_vectors.sh in process with NumPy
+and writes them as GeoTIFFs, without a GRASS location. Run with
+LOG_LEVEL=DEBUG for more detail.
+"""
+import logging
+import os
+import time
+from pathlib import Path
+
+import click
+from model import (
+    MAX_DIST_CB_TO_STREET,
+    MIN_DIST_CB_TO_CB,
+    WALK_RADIUS,
+    SuitabilityModel,
+)
+from tiles import TILE_SIZE
+
+PREPARED_DIR = "data/prepared"
+
+
+@click.group()
+@click.pass_context
+def cli(ctx):
+    """Computes suitability model rasters from the prepared GeoPackages"""
+    ctx.ensure_object(dict)
+    ctx.obj["project_dir"] = Path(__file__).resolve().parents[2]
+    ctx.obj["logger"] = logging.getLogger(__name__)
+
+
+@cli.command()
+@click.argument("output_dir", type=click.Path(file_okay=False))
+@click.option("-w", "--walkradi", type=int, default=WALK_RADIUS, show_default=True)
+@click.option(
+    "-m", "--streetmax", type=int, default=MAX_DIST_CB_TO_STREET, show_default=True
+)
+@click.option("-c", "--cbmin", type=int, default=MIN_DIST_CB_TO_CB, show_default=True)
+@click.option(
+    "--prepared-dir",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help=f"Directory of the prepared GeoPackages, default {PREPARED_DIR}",
+)
+@click.option(
+    "--work-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory of the fine resolution tiles, default OUTPUT_DIR/tiles",
+)
+@click.option("--tile-size", type=int, default=TILE_SIZE, show_default=True)
+@click.option(
+    "--workers", type=int, default=None, help="Processes to use, default one per CPU"
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Recompute every layer, not only those whose inputs changed",
+)
+@click.pass_context
+def build(
+    ctx,
+    output_dir,
+    walkradi,
+    streetmax,
+    cbmin,
+    prepared_dir,
+    work_dir,
+    tile_size,
+    workers,
+    force,
+):
+    """Compute the model layers into OUTPUT_DIR, as rasterize_vectors.sh.
+
+    Layers whose inputs and parameters are unchanged since the last build
+    into OUTPUT_DIR are kept.
+    """
+    logger = ctx.obj["logger"]
+    prepared_dir = prepared_dir or ctx.obj["project_dir"].joinpath(PREPARED_DIR)
+    model = SuitabilityModel(
+        prepared_dir,
+        output_dir,
+        walk_radius=walkradi,
+        max_dist_cb_to_street=streetmax,
+        min_dist_cb_to_cb=cbmin,
+        work_dir=work_dir,
+        tile_size=tile_size,
+        workers=workers,
+        logger=logger,
+    )
+    timings = model.run(force)
+    for section, seconds in timings.items():
+        logger.info(f"{section} took {seconds:.1f}s")
+
+
+@cli.command()
+@click.argument("raster_dir", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--step",
+    type=int,
+    default=None,
+    help="Evaluate every weight vector of multiples of STEP summing to 100",
+)
+@click.option(
+    "--samples", type=int, default=1000, show_default=True, help="Random weight vectors"
+)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("-k", "--top-k", type=int, default=500, show_default=True)
+@click.option(
+    "--unconstrained",
+    is_flag=True,
+    help="Rank every cell, not only those with R_constraint cells",
+)
+@click.pass_context
+def sweep(ctx, raster_dir, step, samples, seed, top_k, unconstrained):
+    """Statistics of many weight scenarios over the indices in RASTER_DIR.
+
+    Writes sweep_mean.tif, sweep_var.tif and sweep_top_freq.tif, and the
+    weights with the overlap of each scenario's top k with the consensus top
+    k to sweep_weights.csv.
+    """
+    import geotiff
+    import numpy as np
+    import sweep as batch
+    from scenarios import WEIGHTS, ScenarioEngine
+
+    logger = ctx.obj["logger"]
+    raster_dir = Path(raster_dir)
+    if step is not None:
+        try:
+            weights = batch.weight_grid(step)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--step")
+    else:
+        weights = batch.weight_samples(samples, seed)
+
+    start = time.perf_counter()
+    engine = ScenarioEngine(raster_dir)
+    result = batch.Sweep(engine, weights, k=top_k, constrained=not unconstrained).run()
+    logger.info(
+        f"{len(weights)} scenarios over {len(result.cells)} cells "
+        f"took {time.perf_counter() - start:.1f}s"
+    )
+
+    for name, values in (
+        ("mean", result.mean),
+        ("var", result.var),
+        ("top_freq", result.top_freq),
+    ):
+        geotiff.write(
+            raster_dir.joinpath(f"sweep_{name}.tif"), result.raster(values), engine.medium
+        )
+    table = np.column_stack([weights, result.overlap()])
+    np.savetxt(
+        raster_dir.joinpath("sweep_weights.csv"),
+        table,
+        delimiter=",",
+        header=",".join(list(WEIGHTS) + ["top_k_overlap"]),
+        comments="",
+        fmt="%.4f",
+    )
+
+
+@cli.command()
+@click.argument("raster_dir", type=click.Path(exists=True, file_okay=False))
+@click.option("--transit", type=int, default=20, show_default=True)
+@click.option("--safety", type=int, default=20, show_default=True)
+@click.option("--service", type=int, default=20, show_default=True)
+@click.option("--expansion", type=int, default=20, show_default=True)
+@click.option("--profit", type=int, default=20, show_default=True)
+@click.option("-k", "--sites", type=int, default=100, show_default=True)
+@click.option(
+    "--min-dist",
+    type=float,
+    default=MIN_DIST_CB_TO_CB,
+    show_default=True,
+    help="Minimum distance between sites and to existing stations",
+)
+@click.option(
+    "--prepared-dir",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="Directory of gbfs_summary.gpkg with the existing stations",
+)
+@click.option("--tile-size", type=int, default=None, help="Fine tile searched at a time")
+@click.pass_context
+def candidates(
+    ctx,
+    raster_dir,
+    transit,
+    safety,
+    service,
+    expansion,
+    profit,
+    sites,
+    min_dist,
+    prepared_dir,
+    tile_size,
+):
+    """Best spaced station sites of a scenario of the layers in RASTER_DIR.
+
+    Writes the sites, ranked, with their _cons_norm score and index values
+    to the candidates layer of <scenario name>_candidates.gpkg.
+    """
+    import candidates as search
+    import geopandas as gpd
+    from scenarios import ScenarioEngine
+
+    logger = ctx.obj["logger"]
+    raster_dir = Path(raster_dir)
+    prepared_dir = prepared_dir or ctx.obj["project_dir"].joinpath(PREPARED_DIR)
+    stations = gpd.read_file(prepared_dir.joinpath("gbfs_summary.gpkg"), layer="station")
+
+    engine = ScenarioEngine(raster_dir)
+    scenario = engine.scenario(transit, safety, service, expansion, profit)
+    start = time.perf_counter()
+    result = search.select(
+        engine,
+        scenario,
+        sites,
+        min_dist,
+        existing=(stations.geometry.x.to_numpy(), stations.geometry.y.to_numpy()),
+        tile_size=tile_size or search.TILE_SIZE,
+    )
+    logger.info(
+        f"selected {len(result['x'])} sites in {time.perf_counter() - start:.1f}s"
+    )
+
+    x, y = result.pop("x"), result.pop("y")
+    gdf = gpd.GeoDataFrame(
+        {"rank": range(1, len(x) + 1), **result},
+        geometry=gpd.points_from_xy(x, y),
+        crs=f"EPSG:{engine.fine.crs}",
+    )
+    gdf.to_file(
+        raster_dir.joinpath(f"{scenario.name}_candidates.gpkg"),
+        layer="candidates",
+        driver="GPKG",
+    )
+
+
+@cli.command()
+@click.argument("raster_dir", type=click.Path(exists=True, file_okay=False))
+@click.option("-n", "--sites", type=int, default=100, show_default=True)
+@click.option("-w", "--walkradi", type=int, default=WALK_RADIUS, show_default=True)
+@click.option(
+    "--candidates",
+    "candidates_file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="GeoPackage of candidate points, e.g. from the candidates command; "
+    "by default every medium cell holding R_constraint cells equal to 1",
+)
+@click.option("--layer", default="candidates", show_default=True)
+@click.pass_context
+def coverage(ctx, raster_dir, sites, walkradi, candidates_file, layer):
+    """Sites covering the most unserved population in RASTER_DIR.
+
+    Demand is R_acs * R_service_area_inverse and a site covers the cells
+    within the walk radius. Writes the sites, in order of choice, with their
+    marginal gain and the cumulative coverage to coverage.gpkg.
+    """
+    import geopandas as gpd
+    import geotiff
+    import numpy as np
+    from coverage import Coverage
+
+    logger = ctx.obj["logger"]
+    raster_dir = Path(raster_dir)
+    acs, medium = geotiff.read(raster_dir.joinpath("R_acs.tif"))
+    inverse, _ = geotiff.read(raster_dir.joinpath("R_service_area_inverse.tif"))
+
+    if candidates_file is not None:
+        points = gpd.read_file(candidates_file, layer=layer).to_crs(f"EPSG:{medium.crs}")
+        rows, cols, inside = medium.rowcol(points.geometry.x, points.geometry.y)
+        cells = rows[inside] * medium.cols + cols[inside]
+    else:
+        from scenarios import ScenarioEngine
+
+        cells = np.flatnonzero(ScenarioEngine(raster_dir).n_one > 0)
+
+    start = time.perf_counter()
+    model = Coverage(acs * inverse, medium, walkradi)
+    result = model.select(cells, sites)
+    total = model.demand.sum()
+    logger.info(
+        f"chose {len(result['cell'])} of {len(np.unique(cells))} candidates in "
+        f"{time.perf_counter() - start:.1f}s, covering {model.total:.0f} of "
+        f"{total:.0f} ({model.total / max(total, 1):.1%})"
+    )
+
+    gdf = gpd.GeoDataFrame(
+        {
+            "rank": range(1, len(result["cell"]) + 1),
+            "gain": result["gain"],
+            "covered": result["covered"],
+            "covered_share": result["covered"] / max(total, 1),
+        },
+        geometry=gpd.points_from_xy(result["x"], result["y"]),
+        crs=f"EPSG:{medium.crs}",
+    )
+    gdf.to_file(raster_dir.joinpath("coverage.gpkg"), layer="sites", driver="GPKG")
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO").upper(), format=log_fmt
+    )
+
+    cli()
@@ -0,0 +1,513 @@
+"""Suitability model layers, as computed by src/grass/rasterize_vectors.sh
+
+Layers are named as in the GRASS script and those it saves with
+save_raster are written as <output_dir>/<name>.tif.
+"""
+
+import logging
+from pathlib import Path
+
+import geopandas as gpd
+import geotiff
+import numpy as np
+import ops
+import pandas as pd
+import shapely
+import tiles
+from grid import Grid, resample
+from rebuild import Build, node
+
+# All values are in feet, as set_grass_constants.sh
+COARSE_RES = 1000
+MEDIUM_RES = 100
+FINE_RES = 10
+
+WALK_RADIUS = 2640
+MAX_DIST_CB_TO_STREET = 60
+MIN_DIST_CB_TO_CB = 100
+
+# rw_type codes of streets that can hold a station; see the streets
+# metadata doc in references for all codes
+BIKEABLE_RW_TYPES = (1, 3, 5, 6, 7, 10, 11, 13)
+
+# the five indices combined by a suitability scenario
+INDICES = (
+    "transit_index_norm",
+    "safety_index_norm",
+    "service_improvement_index_norm",
+    "expansion_index_norm",
+    "profitability_index_norm",
+)
+
+
+def _clip(gdf, grid):
+    """Features of gdf that intersect grid"""
+    return gdf.iloc[gdf.sindex.query(shapely.box(*grid.bounds))]
+
+
+def _constraint_inputs_tile(grid, arrays, boroughs, streets, stations):
+    r_boroughs = ops.rasterize(grid, _clip(boroughs, grid), "boro_code")
+    r_streets = ops.rasterize(grid, _clip(streets, grid), "rw_type")
+    r_streets = ops.mask(r_streets, r_boroughs)
+    cb_stations = ops.bin_points(grid, *stations, method="n")
+    return {
+        "R_boroughs_fine": r_boroughs,
+        "R_streets": r_streets,
+        "bikeable": ops.reclass(r_streets, {t: 1 for t in BIKEABLE_RW_TYPES}),
+        "cb_stations": ops.mask(cb_stations, r_boroughs),
+    }
+
+
+def _constraint_tile(grid, arrays):
+    return {"R_constraint": arrays["cb"] * arrays["street"]}
+
+
+class SuitabilityModel:
+    """Computes the suitability layers from the prepared GeoPackages.
+
+    Attributes:
+    prepared_dir: directory of the prepared GeoPackages
+    output_dir: directory the saved layers are written to
+    work_dir: directory of the fine resolution TileStore, by default
+        <output_dir>/tiles
+    tile_size, workers: tiling of the fine resolution layers, see
+        tiles.map_tiles
+    walk_radius, max_dist_cb_to_street, min_dist_cb_to_cb: model parameters
+        in feet, as the options of rasterize_vectors.sh
+    layers: computed layers that are still needed, {name: array}
+    saved: names of the layers saved by the running node
+    """
+
+    def __init__(
+        self,
+        prepared_dir,
+        output_dir,
+        walk_radius=WALK_RADIUS,
+        max_dist_cb_to_street=MAX_DIST_CB_TO_STREET,
+        min_dist_cb_to_cb=MIN_DIST_CB_TO_CB,
+        medium_res=MEDIUM_RES,
+        fine_res=FINE_RES,
+        work_dir=None,
+        tile_size=tiles.TILE_SIZE,
+        workers=None,
+        logger=None,
+    ):
+        self.prepared_dir = Path(prepared_dir)
+        self.output_dir = Path(output_dir)
+        self.walk_radius = walk_radius
+        self.max_dist_cb_to_street = max_dist_cb_to_street
+        self.min_dist_cb_to_cb = min_dist_cb_to_cb
+        self.work_dir = Path(work_dir or self.output_dir.joinpath("tiles"))
+        self.tile_size = tile_size
+        self.workers = workers
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.boroughs = self.read("open_data.gpkg", "boroughs")
+        self.boroughs["boro_code"] = pd.to_numeric(self.boroughs.boro_code)
+        self.fine = Grid.from_gdf(self.boroughs, fine_res)
+        self.medium = Grid.from_gdf(self.boroughs, medium_res)
+        self.layers = {}
+        self.saved = []
+
+    def read(self, filename, layer):
+        return gpd.read_file(self.prepared_dir.joinpath(filename), layer=layer)
+
+    def save(self, name, array, grid):
+        geotiff.write(self.output_dir.joinpath(f"{name}.tif"), array, grid)
+        self.saved.append(name)
+
+    def _points(self, gdf):
+        return gdf.geometry.x.to_numpy(), gdf.geometry.y.to_numpy()
+
+    def walk_radius_sums(self, arrays, mask_array):
+        """sum_rast_in_walk_radius of define_sdss_util.sh for several layers.
+
+        The layers are summed in one batch and masked by mask_array.
+        """
+        size = ops.walk_radius_size(self.walk_radius, self.medium.res)
+        sums = ops.neighborhood_sums(arrays, ops.circular_kernel(size))
+        return [ops.mask(s, mask_array) for s in sums]
+
+    def norm(self, name):
+        """Rescaled layer, within the service area"""
+        return ops.rescale(ops.mask(self.layers[name], self.layers["R_service_area_mask"]))
+
+    @node(
+        sources=[
+            ("open_data.gpkg", "boroughs"),
+            ("open_data.gpkg", "streets"),
+            ("gbfs_summary.gpkg", "station"),
+        ],
+        outputs=["R_boroughs_medium", "R_service_area_medium"],
+        params=["walk_radius", "max_dist_cb_to_street", "min_dist_cb_to_cb"],
+    )
+    def constraint(self):
+        """Fine resolution constraint layer of possible station locations.
+
+        Fine layers live in a TileStore under work_dir and are computed tile
+        by tile in a process pool, so they need not fit in memory.
+        """
+        fine = self.fine
+        store = tiles.TileStore.create(self.work_dir, fine)
+        run = {"tile_size": self.tile_size, "workers": self.workers}
+
+        # Boroughs, streets excluding highways, bridges, tunnels, etc. and
+        # Citi Bike stations
+        streets = self.read("open_data.gpkg", "streets")
+        streets["rw_type"] = pd.to_numeric(streets.rw_type, errors="coerce")
+        stations = self.read("gbfs_summary.gpkg", "station")
+        tiles.map_tiles(
+            _constraint_inputs_tile,
+            store,
+            [],
+            ["R_boroughs_fine", "R_streets", "bikeable", "cb_stations"],
+            boroughs=self.boroughs[["boro_code", "geometry"]],
+            streets=streets[["rw_type", "geometry"]],
+            stations=self._points(stations),
+            **run,
+        )
+        del streets
+        self.save("R_streets", store.layer("R_streets"), fine)
+
+        tiles.distance_constraints(
+            store,
+            "bikeable",
+            {"street": (0, self.max_dist_cb_to_street)},
+            cells="R_boroughs_fine",
+            **run,
+        )
+
+        # Distance to Citi Bike stations, and the WALK_RADIUS buffer around
+        # all existing stations clipped by boroughs, in the same pass
+        tiles.distance_constraints(
+            store,
+            "cb_stations",
+            {
+                "cb": (self.min_dist_cb_to_cb, self.walk_radius),
+                "service_area": (0, self.walk_radius),
+            },
+            cells="R_boroughs_fine",
+            **run,
+        )
+
+        tiles.map_tiles(
+            _constraint_tile, store, ["cb", "street"], ["R_constraint"], **run
+        )
+        self.save("R_constraint", store.layer("R_constraint"), fine)
+
+        boroughs = store.layer("R_boroughs_fine")
+        service_area = store.layer("service_area")
+        self.layers["R_boroughs_medium"] = resample(boroughs, fine, self.medium)
+        self.layers["R_service_area_medium"] = resample(service_area, fine, self.medium)
+        for name in ("bikeable", "cb_stations", "street", "cb", "service_area"):
+            store.remove(name)
+
+    @node(
+        inputs=["R_boroughs_medium", "R_service_area_medium"],
+        outputs=["R_service_area", "R_service_area_mask"],
+    )
+    def service_area(self):
+        """Medium resolution service area of the current system"""
+        boroughs = self.layers["R_boroughs_medium"]
+        self.save("R_boroughs_medium", boroughs, self.medium)
+        service_area = ops.mask(self.layers["R_service_area_medium"], boroughs)
+        self.layers["R_service_area"] = service_area
+        self.layers["R_service_area_mask"] = ops.mask(service_area, service_area)
+        self.save("R_service_area_mask", self.layers["R_service_area_mask"], self.medium)
+
+    @node(
+        sources=[
+            ("open_data.gpkg", "bike_routes"),
+            ("acs.gpkg", "acs"),
+            ("open_data.gpkg", "motor_vehicle_crashes"),
+            ("gbfs_summary.gpkg", "station"),
+            ("mta_allyears.gpkg", "annual_complex"),
+        ],
+        inputs=["R_boroughs_medium"],
+        outputs=[
+            "R_acs",
+            "R_acs_sum",
+            "R_crashes_sum",
+            "R_docks_per_person_capped",
+            "R_bike_route_dist",
+            "R_mta_mean_daily_entries_sum_capped",
+            "R_mta_mean_daily_exits_sum_capped",
+            "R_mta_complex_dist",
+        ],
+        params=["walk_radius"],
+    )
+    def exploratory_layers(self):
+        """Medium resolution layers covering all boroughs"""
+        medium = self.medium
+        boroughs = self.layers["R_boroughs_medium"]
+        in_boroughs = ~np.isnan(boroughs)
+        layers = self.layers
+
+        # Bike routes
+        bike_routes = self.read("open_data.gpkg", "bike_routes")
+        bike_routes["lanecount"] = pd.to_numeric(bike_routes.lanecount, errors="coerce")
+        r_bike_routes = ops.mask(ops.rasterize(medium, bike_routes, "lanecount"), boroughs)
+        self.save("R_bike_routes", r_bike_routes, medium)
+
+        # ACS population, as population per cell
+        acs = self.read("acs.gpkg", "acs")
+        acs["pop_per_area"] = acs.population * medium.cell_area / acs.area
+        layers["R_acs"] = ops.mask(ops.rasterize(medium, acs, "pop_per_area"), boroughs)
+        self.save("R_acs", layers["R_acs"], medium)
+
+        # Crashes
+        crashes = self.read("open_data.gpkg", "motor_vehicle_crashes")
+        r_crashes = ops.mask(
+            ops.bin_points(
+                medium,
+                *self._points(crashes),
+                pd.to_numeric(crashes.number_of_cyclist_injured),
+            ),
+            boroughs,
+        )
+
+        # Docks
+        stations = self.read("gbfs_summary.gpkg", "station")
+        r_capacity = ops.mask(
+            ops.bin_points(medium, *self._points(stations), stations.capacity),
+            boroughs,
+        )
+
+        # MTA ridership
+        mta = self.read("mta_allyears.gpkg", "annual_complex")
+        daily = {
+            metric: ops.mask(
+                ops.bin_points(
+                    medium, *self._points(mta), mta[f"mean_daily_{metric}_2023"]
+                ),
+                boroughs,
+            )
+            for metric in ("entries", "exits")
+        }
+
+        # Sums within the walk radius
+        inputs = [layers["R_acs"], r_crashes, r_capacity, daily["entries"], daily["exits"]]
+        acs_sum, crashes_sum, capacity_sum, entries_sum, exits_sum = (
+            self.walk_radius_sums(inputs, boroughs)
+        )
+        del inputs, r_crashes, r_capacity, daily
+        layers["R_acs_sum"] = acs_sum
+        self.save("R_acs_sum", acs_sum, medium)
+        layers["R_crashes_sum"] = crashes_sum
+        self.save("R_crashes_sum", crashes_sum, medium)
+        self.save("R_cb_capacity_sum", capacity_sum, medium)
+
+        # Docks / population within radius
+        docks_per_person = ops.divide(capacity_sum, layers["R_acs_sum"])
+        # Real values of docks/person should range 0--.1, but data issues
+        # introduce some values > 10
+        self.save("R_docks_per_person", docks_per_person, medium)
+        layers["R_docks_per_person_capped"] = np.minimum(docks_per_person * 1000, 100)
+        self.save(
+            "R_docks_per_person_capped", layers["R_docks_per_person_capped"], medium
+        )
+
+        # Distance to bike routes
+        layers["R_bike_route_dist"] = ops.distance(medium, r_bike_routes, in_boroughs)
+        self.save("R_bike_route_dist", layers["R_bike_route_dist"], medium)
+
+        # MTA connectivity
+        for metric, total in (("entries", entries_sum), ("exits", exits_sum)):
+            self.save(f"R_mta_mean_daily_{metric}_sum", total, medium)
+            # Impose a ceiling value to preserve meaingful variation in the index
+            cap = 300000 if metric == "entries" else 500000
+            layers[f"R_mta_mean_daily_{metric}_sum_capped"] = np.minimum(total, cap)
+
+        # Distance to complex
+        complexes = mta[mta.total_exits_all.fillna(0) != 0]
+        r_complexes = ops.mask(
+            ops.bin_points(medium, *self._points(complexes), method="n"), boroughs
+        )
+        self.save("R_mta_complexes", r_complexes, medium)
+        layers["R_mta_complex_dist"] = ops.distance(medium, r_complexes, in_boroughs)
+        self.save("R_mta_complex_dist", layers["R_mta_complex_dist"], medium)
+
+    @node(
+        sources=[
+            ("gbfs_summary.gpkg", "status_peak_summary"),
+            ("gbfs_summary.gpkg", "status_offpeak_summary"),
+        ],
+        inputs=["R_service_area_mask"],
+        outputs=[
+            f"R_gbfs_{period}_{column}"
+            for period in ("peak", "offpeak")
+            for column in ("bikes_available_eq0", "docks_available_eq0")
+        ],
+    )
+    def gbfs_layers(self):
+        """GBFS station status, as the v.voronoi polygons of the stations"""
+        medium = self.medium
+        in_service_area = ~np.isnan(self.layers["R_service_area_mask"])
+        for period in ("peak", "offpeak"):
+            summary = self.read("gbfs_summary.gpkg", f"status_{period}_summary")
+            x, y = self._points(summary)
+            for column in ("bikes_available_eq0", "docks_available_eq0"):
+                name = f"R_gbfs_{period}_{column}"
+                self.layers[name] = ops.nearest_value(
+                    medium, x, y, pd.to_numeric(summary[column]), in_service_area
+                )
+                self.save(name, self.layers[name], medium)
+
+    @node(
+        sources=[("citibike_trips_summary.gpkg", "trips_summary_2023")],
+        inputs=["R_service_area_mask"],
+        outputs=["R_trips_per_day_per_dock"],
+    )
+    def trips_layers(self):
+        """Profitability, as trips per dock of the nearest station"""
+        medium = self.medium
+        in_service_area = ~np.isnan(self.layers["R_service_area_mask"])
+        trips = self.read("citibike_trips_summary.gpkg", "trips_summary_2023")
+        # Approximately five stations have a data entry issue where their
+        # capacity is missing a zero (20 trips per day per dock is
+        # implausibly high and only occurs with those stations)
+        per_dock = trips.trips_per_day_per_dock.copy()
+        per_dock[per_dock > 20] = per_dock[per_dock > 20] / 10
+        self.layers["R_trips_per_day_per_dock"] = ops.nearest_value(
+            medium, *self._points(trips), per_dock, in_service_area
+        )
+        self.save(
+            "R_trips_per_day_per_dock", self.layers["R_trips_per_day_per_dock"], medium
+        )
+
+    @node(
+        inputs=["R_service_area", "R_service_area_mask", "R_acs"],
+        outputs=[
+            "R_service_area_inverse",
+            "R_potential_pop_service_area",
+            "R_potential_area_service_area",
+        ],
+        params=["walk_radius"],
+    )
+    def potential_layers(self):
+        """Potential users outside the service area, within the walk radius"""
+        medium = self.medium
+        layers = self.layers
+
+        # summed without a mask
+        inverse = ops.reclass(layers["R_service_area"], {0: 1, 1: 0})
+        layers["R_service_area_inverse"] = inverse
+        self.save("R_service_area_inverse", inverse, medium)
+        potential_pop = layers["R_acs"] * inverse
+        potential_area = medium.cell_area * inverse
+        self.save("R_potential_area", potential_area, medium)
+
+        sums = self.walk_radius_sums(
+            [potential_pop, potential_area], layers["R_service_area_mask"]
+        )
+        for name, layer in zip(("pop", "area"), sums):
+            layers[f"R_potential_{name}_service_area"] = layer
+            self.save(f"R_potential_{name}_service_area", layer, medium)
+
+    @node(
+        inputs=[
+            "R_service_area_mask",
+            "R_mta_complex_dist",
+            "R_mta_mean_daily_entries_sum_capped",
+        ],
+        outputs=["transit_index_norm"],
+    )
+    def transit_index(self):
+        """Transit index, from MTA ridership and distance to complexes"""
+        medium = self.medium
+        dist_floor = np.maximum(self.layers["R_mta_complex_dist"], medium.res)
+        self.save("R_mta_complex_dist_floor", dist_floor, medium)
+        self.layers["R_mta_complex_inv_dist"] = (dist_floor**-0.5) * 10000
+        self.save("R_mta_complex_inv_dist", self.layers["R_mta_complex_inv_dist"], medium)
+        inv_dist_norm = self.norm("R_mta_complex_inv_dist")
+        self.save("R_mta_complex_inv_dist_norm", inv_dist_norm, medium)
+        entries_norm = self.norm("R_mta_mean_daily_entries_sum_capped")
+        # the GRASS script weights the entries layer twice and not the exits
+        transit = entries_norm * 0.25 + entries_norm * 0.25 + inv_dist_norm * 0.5
+        self.layers["transit_index_norm"] = ops.rescale(transit)
+        self.save("transit_index_norm", self.layers["transit_index_norm"], medium)
+
+    @node(
+        inputs=["R_service_area_mask", "R_trips_per_day_per_dock", "R_acs_sum"],
+        outputs=["profitability_index_norm"],
+    )
+    def profitability_index(self):
+        """Profitability index, from trips per dock and population"""
+        profitability = (
+            self.norm("R_trips_per_day_per_dock") * 0.75 + self.norm("R_acs_sum") * 0.25
+        )
+        self.layers["profitability_index_norm"] = ops.rescale(profitability)
+        self.save(
+            "profitability_index_norm", self.layers["profitability_index_norm"], self.medium
+        )
+
+    @node(
+        inputs=[
+            "R_service_area_mask",
+            "R_potential_pop_service_area",
+            "R_potential_area_service_area",
+        ],
+        outputs=["expansion_index_norm"],
+    )
+    def expansion_index(self):
+        """Service expansion index, from potential users outside the service area"""
+        expansion = (
+            self.norm("R_potential_pop_service_area") * 0.5
+            + self.norm("R_potential_area_service_area") * 0.5
+        )
+        self.layers["expansion_index_norm"] = ops.rescale(expansion)
+        self.save("expansion_index_norm", self.layers["expansion_index_norm"], self.medium)
+
+    @node(
+        inputs=["R_service_area_mask", "R_bike_route_dist", "R_crashes_sum"],
+        outputs=["safety_index_norm"],
+    )
+    def safety_index(self):
+        """Safety index, from distance to bike routes and cyclist injuries"""
+        # inverse of danger so that high values = high suitability
+        danger = self.norm("R_bike_route_dist") * 0.5 + self.norm("R_crashes_sum") * 0.5
+        self.layers["safety_index_norm"] = 101 - ops.rescale(danger)
+        self.save("safety_index_norm", self.layers["safety_index_norm"], self.medium)
+
+    @node(
+        inputs=[
+            "R_service_area_mask",
+            "R_docks_per_person_capped",
+            "R_acs_sum",
+            "R_gbfs_peak_bikes_available_eq0",
+            "R_gbfs_peak_docks_available_eq0",
+            "R_gbfs_offpeak_bikes_available_eq0",
+            "R_gbfs_offpeak_docks_available_eq0",
+        ],
+        outputs=["service_improvement_index_norm"],
+    )
+    def service_improvement_index(self):
+        """Service improvement index, from docks per person and GBFS status"""
+        medium = self.medium
+        # the GRASS script scales the GBFS layers by 100 first as r.rescale
+        # fails on very small values, which is not needed here
+        gbfs = {}
+        for period in ("peak", "offpeak"):
+            for column in ("bikes_available_eq0", "docks_available_eq0"):
+                name = f"R_gbfs_{period}_{column}"
+                gbfs[name] = self.norm(name)
+                self.save(f"{name}_norm", gbfs[name], medium)
+        docks_norm = self.norm("R_docks_per_person_capped")
+        self.save("R_docks_per_person_capped_norm", docks_norm, medium)
+        service = (101 - docks_norm) * 0.4 + self.norm("R_acs_sum") * 0.1
+        for layer in gbfs.values():
+            service = service + layer * 0.125
+        self.layers["service_improvement_index_norm"] = ops.rescale(service)
+        self.save(
+            "service_improvement_index_norm",
+            self.layers["service_improvement_index_norm"],
+            medium,
+        )
+
+    def run(self, force=False):
+        """Compute and save the layers whose inputs changed since the last
+        run, every layer if force; returns seconds per recomputed node.
+
+        See rebuild.py for how changes are detected.
+        """
+        return Build(self, self.logger).run(force)
@@ -0,0 +1,392 @@
+"""Raster operators of the suitability model
+
+Rasters are float32 NumPy arrays on a Grid with NaN as NULL, so the
+r.mapcalc expressions of the GRASS scripts are plain NumPy expressions:
+arithmetic propagates NaN like NULL, and np.minimum/np.maximum behave as
+the min()/max() of r.mapcalc.
+"""
+
+import edt
+import numpy as np
+import shapely
+
+try:
+    from osgeo import gdal, ogr
+
+    gdal.UseExceptions()
+except ImportError:
+    gdal = None
+
+# cells per block of the nearest feature searches
+BLOCK_CELLS = 1 << 20
+
+
+def rasterize(grid, gdf, column=None, value=1.0, all_touched=False):
+    """Burn polygons or lines into a new raster, as v.to.rast.
+
+    Arguments:
+    grid - Grid of the output
+    gdf - GeoDataFrame in the CRS of grid
+    column - attribute burnt into the cells; value is burnt if None
+    value - constant burnt into the cells when column is None
+    all_touched - burn every cell touched rather than those whose centre
+        is covered
+
+    Returns:
+    float32 array, NaN where no feature was burnt
+    """
+    if gdal is None:
+        raise ImportError("GDAL python bindings (osgeo) are required to rasterize")
+
+    ds = gdal.GetDriverByName("MEM").Create("", grid.cols, grid.rows, 1, gdal.GDT_Float32)
+    ds.SetGeoTransform(grid.transform)
+    band = ds.GetRasterBand(1)
+    band.Fill(np.nan)
+
+    vector = ogr.GetDriverByName("Memory").CreateDataSource("")
+    layer = vector.CreateLayer("features")
+    layer.CreateField(ogr.FieldDefn("value", ogr.OFTReal))
+    values = np.full(len(gdf), value, dtype=np.float64) if column is None else gdf[column]
+    for wkb, v in zip(shapely.to_wkb(gdf.geometry.to_numpy()), values):
+        if wkb is None or v is None or np.isnan(v):
+            continue
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+        feature.SetField("value", float(v))
+        layer.CreateFeature(feature)
+
+    options = ["ATTRIBUTE=value"] + (["ALL_TOUCHED=TRUE"] if all_touched else [])
+    gdal.RasterizeLayer(ds, [1], layer, options=options)
+    return band.ReadAsArray().astype(np.float32)
+
+
+def bin_points(grid, x, y, values=None, method="sum"):
+    """Aggregate point values into the cells containing them, as r.in.xyz.
+
+    Arguments:
+    grid - Grid of the output
+    x, y - point coordinates
+    values - point values; counts points if None
+    method - "sum", "n", "mean" or "max"
+
+    Returns:
+    float32 array, NaN in cells without points
+    """
+    rows, cols, inside = grid.rowcol(x, y)
+    values = np.ones(len(rows)) if values is None else np.asarray(values, dtype=np.float64)
+    inside &= ~np.isnan(values)
+    idx = rows[inside] * grid.cols + cols[inside]
+    values = values[inside]
+
+    n = np.bincount(idx, minlength=grid.size)
+    match method:
+        case "sum":
+            out = np.bincount(idx, weights=values, minlength=grid.size)
+        case "n":
+            out = n.astype(np.float64)
+        case "mean":
+            out = np.bincount(idx, weights=values, minlength=grid.size) / np.maximum(n, 1)
+        case "max":
+            out = np.full(grid.size, -np.inf)
+            np.maximum.at(out, idx, values)
+        case _:
+            raise ValueError(f"unsupported method {method}")
+    out[n == 0] = np.nan
+    return out.reshape(grid.shape).astype(np.float32)
+
+
+def reclass(array, rules, default=np.nan):
+    """Map cell values to new values, as r.reclass.
+
+    Arguments:
+    array - input raster
+    rules - dict of the form {old value: new value}
+    default - value of cells not matched by rules; NULL stays NULL
+
+    Returns:
+    float32 array
+    """
+    out = np.full(array.shape, default, dtype=np.float32)
+    for old, new in rules.items():
+        out[array == old] = new
+    out[np.isnan(array)] = np.nan
+    return out
+
+
+def dist_constraint(dist, min_dist, max_dist):
+    """1 where min_dist <= dist is within max_dist, else 0, as reclass_dist_constraint.
+
+    r.reclass works on integer categories, so distances are truncated:
+    with min_dist 0 cells closer than max_dist are kept, otherwise those
+    with min_dist <= dist < max_dist + 1. NULL stays NULL.
+    """
+    cats = np.floor(dist)
+    if min_dist == 0:
+        keep = cats <= max_dist - 1
+    else:
+        keep = (cats >= min_dist) & (cats <= max_dist)
+    out = keep.astype(np.float32)
+    out[np.isnan(dist)] = np.nan
+    return out
+
+
+def rescale(array, lo=1, hi=100, bounds=None):
+    """Linearly rescale the range of array to lo..hi, as r.rescale.
+
+    r.rescale writes integer (CELL) output, so rescaled values are
+    truncated; NULL stays NULL. bounds=(vmin, vmax) gives the input range
+    when array is only part of the raster being rescaled.
+    """
+    vmin, vmax = bounds or (np.nanmin(array), np.nanmax(array))
+    if vmax == vmin:
+        out = np.full(array.shape, lo, dtype=np.float32)
+    else:
+        out = lo + (array - vmin) * ((hi - lo) / (vmax - vmin))
+        out = np.trunc(out).astype(np.float32)
+    out[np.isnan(array)] = np.nan
+    return out
+
+
+def divide(a, b):
+    """a / b with NULL where b is 0, as division in r.mapcalc"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = np.asarray(a, dtype=np.float32) / b
+    out[np.asarray(b) == 0] = np.nan
+    return out
+
+
+def mask(array, mask_array):
+    """Set cells outside mask_array (NaN or 0) to NULL, as r.mask."""
+    keep = ~np.isnan(mask_array) & (mask_array != 0)
+    return np.where(keep, array, np.nan).astype(np.float32)
+
+
+def _nearest(grid, sites, cells=None):
+    """Index of and distance to the nearest site from the cell centres.
+
+    Used where sites are points rather than cells, as the Voronoi layers.
+
+    Arguments:
+    grid - Grid of the cells
+    sites - array of shapely geometries
+    cells - boolean array of the cells to compute; all cells if None
+
+    Returns:
+    index, distance - float arrays over grid, NaN for cells not computed
+    """
+    tree = shapely.STRtree(sites)
+    index = np.full(grid.size, np.nan)
+    distance = np.full(grid.size, np.nan)
+    todo = np.flatnonzero(np.ones(grid.size, bool) if cells is None else cells.ravel())
+    for start in range(0, len(todo), BLOCK_CELLS):
+        block = todo[start : start + BLOCK_CELLS]
+        rows, cols = np.divmod(block, grid.cols)
+        points = shapely.points(grid.x(cols), grid.y(rows))
+        (cell_idx, site_idx), dist = tree.query_nearest(
+            points, return_distance=True, all_matches=False
+        )
+        index[block[cell_idx]] = site_idx
+        distance[block[cell_idx]] = dist
+    return index.reshape(grid.shape), distance.reshape(grid.shape)
+
+
+def distance(grid, features, cells=None, max_dist=None):
+    """Euclidean distance from cell centres to the nearest feature cell centre.
+
+    As r.grow.distance, features are the non-NULL cells of a raster; the
+    result is 0 on the feature cells themselves. Computed with the exact
+    distance transform of edt.
+
+    Arguments:
+    grid - Grid of features
+    features - raster whose non-NaN cells are features
+    cells - boolean array of the cells to compute, e.g. a mask; NaN elsewhere
+    max_dist - if set, work in tiles and report distances beyond it as inf
+    """
+    out = np.empty(grid.shape, dtype=np.float32)
+    for window, dist in edt.distance_tiles(features, grid.res, max_dist):
+        out[window] = dist
+    if cells is not None:
+        out[~cells] = np.nan
+    return out
+
+
+def distance_constraints(grid, features, constraints, cells=None, out=None):
+    """dist_constraint layers of the distance to features, in one pass.
+
+    The distance is computed in tiles whose halo covers the largest
+    max_dist of constraints, and each tile is reclassed straight away, so
+    the full distance raster is never held.
+
+    Arguments:
+    grid - Grid of features
+    features - raster whose non-NaN cells are features
+    constraints - dict of the form {name: (min_dist, max_dist)}
+    cells - boolean array of the cells to compute, e.g. a mask; NaN elsewhere
+    out - optional dict of preallocated arrays by name, e.g. memmaps
+
+    Returns:
+    dict of float32 arrays by name, 1 where the constraint holds else 0
+    """
+    out = dict(out or {})
+    for name in constraints:
+        if name not in out:
+            out[name] = np.empty(grid.shape, dtype=np.float32)
+    max_dist = max(hi for _, hi in constraints.values())
+    for window, dist in edt.distance_tiles(features, grid.res, max_dist):
+        if cells is not None:
+            dist[~cells[window]] = np.nan
+        for name, (lo, hi) in constraints.items():
+            out[name][window] = dist_constraint(dist, lo, hi)
+    return out
+
+
+def nearest_value(grid, x, y, values, cells=None):
+    """Value of the nearest point for each cell.
+
+    Equivalent to rasterizing the v.voronoi polygons of the points: a cell
+    centre lies in the Voronoi polygon of its nearest point.
+    """
+    keep = ~np.isnan(np.asarray(values, dtype=np.float64))
+    values = np.asarray(values, dtype=np.float64)[keep]
+    index, _ = _nearest(grid, shapely.points(x[keep], y[keep]), cells)
+    out = np.full(grid.shape, np.nan, dtype=np.float32)
+    found = ~np.isnan(index)
+    out[found] = values[index[found].astype(np.int64)]
+    return out
+
+
+def circular_kernel(size):
+    """Boolean size x size circular window, as the -c flag of r.neighbors."""
+    radius = size // 2
+    offsets = np.arange(size) - radius
+    return offsets[:, None] ** 2 + offsets[None, :] ** 2 <= radius**2
+
+
+def walk_radius_size(walk_radius, res):
+    """Window size of sum_rast_in_walk_radius: 2 * walk_radius / res, made odd"""
+    size = int(walk_radius * 2 // res)
+    return size + 1 if size % 2 == 0 else size
+
+
+def _fft_len(n):
+    """Smallest 2**a * 3**b * 5**c >= n, a fast FFT length"""
+    best = 1 << (n - 1).bit_length()
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < n:
+                p *= 2
+            best = min(best, p)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def _sat_sums(values, size):
+    """Square window sums from a summed-area table, O(cells)"""
+    radius = size // 2
+    _, rows, cols = values.shape
+    sat = np.zeros((len(values), rows + size, cols + size))
+    padded = np.pad(values, ((0, 0), (radius, radius), (radius, radius)))
+    np.cumsum(padded, axis=1, out=sat[:, 1:, 1:])
+    np.cumsum(sat[:, 1:, 1:], axis=2, out=sat[:, 1:, 1:])
+    return (
+        sat[:, size:, size:]
+        - sat[:, :rows, size:]
+        - sat[:, size:, :cols]
+        + sat[:, :rows, :cols]
+    )
+
+
+def _span_sums(values, kernel):
+    """Window sums of a kernel whose rows are centred spans, O(cells x size).
+
+    Each kernel row is summed from a prefix sum along the columns, so only
+    one pass per kernel row is needed instead of one per kernel cell.
+    """
+    radius = kernel.shape[0] // 2
+    _, rows, cols = values.shape
+    padded = np.pad(values, ((0, 0), (radius, radius), (radius, radius)))
+    prefix = np.zeros(padded.shape[:2] + (padded.shape[2] + 1,))
+    np.cumsum(padded, axis=2, out=prefix[:, :, 1:])
+    out = np.zeros(values.shape)
+    for dr, row in enumerate(kernel):
+        if not row.any():
+            continue
+        width = int(row.sum()) // 2
+        start = radius - width
+        end = radius + width + 1
+        out += (
+            prefix[:, dr : dr + rows, end : end + cols]
+            - prefix[:, dr : dr + rows, start : start + cols]
+        )
+    return out
+
+
+def _fft_sums(values, kernel):
+    """Window sums by FFT convolution, O(cells log cells) whatever the kernel.
+
+    The kernel transform is computed once for all layers. Rounding leaves
+    noise around 1e-12 of the layer totals, which is cleared so that empty
+    windows sum to exactly 0.
+    """
+    size = kernel.shape[0]
+    radius = size // 2
+    _, rows, cols = values.shape
+    shape = (_fft_len(rows + size - 1), _fft_len(cols + size - 1))
+    kernel_f = np.fft.rfft2(kernel.astype(np.float64), shape)
+    out = np.fft.irfft2(np.fft.rfft2(values, shape) * kernel_f, shape)
+    out = out[:, radius : radius + rows, radius : radius + cols]
+    tol = np.abs(values).sum(axis=(1, 2), keepdims=True) * 1e-12
+    out[np.abs(out) <= tol] = 0
+    return out
+
+
+# kernel size from which FFT convolution is used over row spans
+FFT_MIN_SIZE = 9
+
+
+def neighborhood_sums(arrays, kernel, method="auto"):
+    """Sum of the non-NULL cells in the kernel window around each cell.
+
+    As `r.neighbors method=sum`, NULL cells do not contribute. All arrays
+    are summed against the same kernel in one batch.
+
+    Arguments:
+    arrays - list of rasters of the same shape
+    kernel - odd sized boolean window, e.g. circular_kernel(size)
+    method - "sat" (summed-area table, square kernels only), "spans"
+        (per kernel row prefix sums, exact for convex symmetric kernels),
+        "fft" (any kernel) or "auto" to pick the fastest applicable
+
+    Returns:
+    list of float32 arrays
+    """
+    values = np.nan_to_num(np.stack(arrays).astype(np.float64), nan=0.0)
+    if method == "auto":
+        if kernel.all():
+            method = "sat"
+        elif kernel.shape[0] < FFT_MIN_SIZE:
+            method = "spans"
+        else:
+            method = "fft"
+    match method:
+        case "sat":
+            if not kernel.all():
+                raise ValueError("summed-area tables need a square kernel")
+            out = _sat_sums(values, kernel.shape[0])
+        case "spans":
+            out = _span_sums(values, kernel)
+        case "fft":
+            out = _fft_sums(values, kernel)
+        case _:
+            raise ValueError(f"unsupported method {method}")
+    return list(out.astype(np.float32))
+
+
+def neighborhood_sum(array, kernel, method="auto"):
+    """neighborhood_sums of a single raster"""
+    return neighborhood_sums([array], kernel, method)[0]
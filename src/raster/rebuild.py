@@ -0,0 +1,186 @@
+"""Incremental rebuild of the suitability model layers
+
+The model is a graph of nodes: the methods of SuitabilityModel decorated
+with @node, each reading layers of the prepared GeoPackages (sources) and
+layers produced by earlier nodes (inputs). The key of a node hashes the
+code of the model and of the raster engine, the model parameters it uses,
+the grids, the content of its sources and the keys of the nodes producing
+its inputs, so it changes whenever the node's result may.
+
+Keys are recorded in <output_dir>/build.json with the GeoTIFFs each node
+saved, and the layers a node produces for later nodes are cached as .npy
+under <output_dir>/cache. A rerun skips the nodes whose key is unchanged
+and whose files exist, and reads their layers from the cache only when a
+node downstream of them is recomputed.
+"""
+
+import hashlib
+import importlib
+import inspect
+import json
+import logging
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import dataclass
+
+import numpy as np
+
+MANIFEST = "build.json"
+CACHE_DIR = "cache"
+
+# raster engine modules the layers depend on, besides the model's own
+ENGINE_MODULES = ("edt", "geotiff", "grid", "ops", "tiles")
+
+
+@dataclass(frozen=True)
+class Node:
+    """Dependencies and products of a model method.
+
+    Attributes:
+    sources: (GeoPackage filename, layer) read from the prepared directory
+    inputs: layers of earlier nodes used
+    outputs: layers produced for later nodes
+    params: model attributes the result depends on
+    """
+
+    sources: tuple = ()
+    inputs: tuple = ()
+    outputs: tuple = ()
+    params: tuple = ()
+
+
+def node(sources=(), inputs=(), outputs=(), params=()):
+    """Declare a SuitabilityModel method as a node of the rebuild graph"""
+
+    def decorate(method):
+        method.node = Node(tuple(sources), tuple(inputs), tuple(outputs), tuple(params))
+        return method
+
+    return decorate
+
+
+def code_digest(model):
+    """sha256 of the source of the model's module and of ENGINE_MODULES.
+
+    Helpers and constants used by a node live outside its method, so any
+    change to the code invalidates every node.
+    """
+    digest = hashlib.sha256()
+    modules = [inspect.getmodule(type(model))]
+    modules += [importlib.import_module(name) for name in ENGINE_MODULES]
+    for module in modules:
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+
+def layer_digest(path, layer):
+    """sha256 of the rows of a GeoPackage layer, in row order"""
+    digest = hashlib.sha256()
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as db:
+        for row in db.execute(f'SELECT * FROM "{layer}" ORDER BY rowid'):
+            digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+
+class Build:
+    """Runs the nodes of a SuitabilityModel whose keys changed.
+
+    Attributes:
+    model: SuitabilityModel
+    nodes: {name: method} of the model's nodes, in definition order
+    manifest: {node name: {"key", "saved"}} of the previous runs
+    """
+
+    def __init__(self, model, logger=None):
+        self.model = model
+        self.logger = logger or logging.getLogger(__name__)
+        self.nodes = {
+            name: method
+            for name, method in vars(type(model)).items()
+            if hasattr(method, "node")
+        }
+        self._producer = {}
+        for name, method in self.nodes.items():
+            for layer in method.node.inputs:
+                if layer not in self._producer:
+                    raise ValueError(f"{name} uses {layer} before a node produces it")
+            for layer in method.node.outputs:
+                self._producer[layer] = name
+
+        self._manifest_path = model.output_dir.joinpath(MANIFEST)
+        self._cache_dir = model.output_dir.joinpath(CACHE_DIR)
+        self.manifest = {}
+        if self._manifest_path.exists():
+            with open(self._manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def keys(self):
+        """Key of every node, in order"""
+        model = self.model
+        code = code_digest(model)
+        digests = {}
+        keys = {}
+        for name, method in self.nodes.items():
+            spec = method.node
+            for source in spec.sources:
+                if source not in digests:
+                    digests[source] = layer_digest(
+                        model.prepared_dir.joinpath(source[0]), source[1]
+                    )
+            payload = {
+                "node": name,
+                "code": code,
+                "params": {p: getattr(model, p) for p in spec.params},
+                "grids": [repr(model.medium), repr(model.fine)],
+                "sources": {":".join(s): digests[s] for s in spec.sources},
+                "inputs": {layer: keys[self._producer[layer]] for layer in spec.inputs},
+            }
+            keys[name] = hashlib.sha256(
+                json.dumps(payload, sort_keys=True, default=str).encode()
+            ).hexdigest()
+        return keys
+
+    def _cache_path(self, layer):
+        return self._cache_dir.joinpath(f"{layer}.npy")
+
+    def _fresh(self, name, key):
+        entry = self.manifest.get(name)
+        if entry is None or entry["key"] != key:
+            return False
+        files = [self.model.output_dir.joinpath(f"{s}.tif") for s in entry["saved"]]
+        files += [self._cache_path(layer) for layer in self.nodes[name].node.outputs]
+        return all(f.exists() for f in files)
+
+    def run(self, force=False):
+        """Recompute the stale nodes, all of them if force.
+
+        Returns:
+        seconds per recomputed node
+        """
+        model = self.model
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        timings = {}
+        for name, key in self.keys().items():
+            if not force and self._fresh(name, key):
+                self.logger.info(f"{name} is up to date")
+                continue
+
+            spec = self.nodes[name].node
+            for layer in spec.inputs:
+                if layer not in model.layers:
+                    model.layers[layer] = np.load(self._cache_path(layer))
+
+            start = time.perf_counter()
+            self.logger.info(f"computing {name}")
+            model.saved = []
+            getattr(model, name)()
+            for layer in spec.outputs:
+                np.save(self._cache_path(layer), model.layers[layer])
+            timings[name] = time.perf_counter() - start
+
+            # recorded after every node so that an interrupted run resumes
+            self.manifest[name] = {"key": key, "saved": model.saved}
+            with open(self._manifest_path, "w") as f:
+                json.dump(self.manifest, f, indent=2)
+        return timings
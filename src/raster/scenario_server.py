@@ -0,0 +1,165 @@
+"""Local HTTP service computing suitability scenarios on demand
+
+Loads the layers of a make_rasters output directory once and answers:
+
+    /layers                          grids, layers and user preferences
+    /summary?<weights>&top=10        statistics and best cells of a scenario
+    /window?<weights>&layer=cons_norm&bbox=xmin,ymin,xmax,ymax&format=npy
+                                     a scenario layer over a bounding box
+    /cache                           hits and misses of the scenario cache
+
+<weights> are transit, safety, service, expansion and profit in percent,
+as the options of calculate_suitability.sh, plus optionally pref and
+pref_weight for a user preference raster given with --pref. Windows are
+returned as .npy bytes, or as JSON with format=json.
+"""
+import io
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import click
+import numpy as np
+from scenarios import FINE_LAYERS, MEDIUM_LAYERS, WEIGHTS, ScenarioEngine
+
+
+def _scenario_args(params):
+    try:
+        args = [float(params[k]) for k in WEIGHTS]
+    except KeyError as e:
+        raise ValueError(f"missing weight {e.args[0]}")
+    if "pref" in params:
+        args += [params["pref"], float(params.get("pref_weight", 100))]
+    # integral weights are named as the GRASS script names them
+    return [w if isinstance(w, str) or not w.is_integer() else int(w) for w in args]
+
+
+class ScenarioHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        start = time.perf_counter()
+        parts = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        engine = self.server.engine
+        try:
+            match parts.path.rstrip("/"):
+                case "/layers":
+                    body = {
+                        "medium": repr(engine.medium),
+                        "fine": repr(engine.fine),
+                        "medium_layers": MEDIUM_LAYERS,
+                        "fine_layers": FINE_LAYERS,
+                        "prefs": sorted(engine.prefs),
+                    }
+                case "/cache":
+                    body = engine.scenario.cache_info()._asdict()
+                case "/summary":
+                    scenario = engine.scenario(*_scenario_args(params))
+                    body = engine.summary(scenario, top=int(params.get("top", 10)))
+                case "/window":
+                    scenario = engine.scenario(*_scenario_args(params))
+                    bbox = params.get("bbox")
+                    bbox = tuple(map(float, bbox.split(","))) if bbox else None
+                    array, grid = engine.window(
+                        scenario, params.get("layer", "cons_norm"), bbox
+                    )
+                    if params.get("format", "npy") == "json":
+                        body = {
+                            "name": scenario.name,
+                            "grid": vars(grid),
+                            "values": np.where(np.isnan(array), None, array).tolist(),
+                        }
+                    else:
+                        buffer = io.BytesIO()
+                        np.save(buffer, array)
+                        return self._send(
+                            200,
+                            buffer.getvalue(),
+                            "application/octet-stream",
+                            {"X-Grid": json.dumps(vars(grid))},
+                        )
+                case _:
+                    return self._send(404, {"error": f"unknown path {parts.path}"})
+        except (KeyError, ValueError) as e:
+            return self._send(400, {"error": str(e)})
+        body["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        return self._send(200, body)
+
+
+class ScenarioServer(ThreadingHTTPServer):
+    """Threaded scenario server; use as a context manager to run it in the background.
+
+    Attributes:
+    url: root url of the server
+    engine: ScenarioEngine answering the requests
+    """
+
+    def __init__(self, engine, host="127.0.0.1", port=0):
+        super().__init__((host, port), ScenarioHandler)
+        self.engine = engine
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self._thread.join()
+        self.server_close()
+
+
+@click.command()
+@click.argument("raster_dir", type=click.Path(exists=True, file_okay=False))
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", type=int, default=8766)
+@click.option(
+    "--pref",
+    multiple=True,
+    help="User preference raster as name=path.tif, may be repeated",
+)
+@click.option("--cache-size", type=int, default=32, help="Scenarios kept in memory")
+def main(raster_dir, host, port, pref, cache_size):
+    """Serve scenarios of the layers in RASTER_DIR, the output of make_rasters build"""
+    prefs = dict(p.split("=", 1) for p in pref)
+    start = time.perf_counter()
+    engine = ScenarioEngine(raster_dir, prefs=prefs, cache_size=cache_size)
+    logging.getLogger(__name__).info(
+        f"loaded {raster_dir} in {time.perf_counter() - start:.1f}s"
+    )
+    with ScenarioServer(engine, host, port) as server:
+        click.echo(f"serving scenarios at {server.url}")
+        try:
+            server._thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+    main()
@@ -0,0 +1,376 @@
+"""Suitability scenarios, as computed by src/grass/calculate_suitability.sh
+
+A scenario weights the five normalized indices (medium resolution) and
+constrains the result with R_constraint (fine resolution). The indices
+and R_constraint are memory-mapped once by a ScenarioEngine, which then
+computes scenarios on demand:
+
+- the weighted index and its rescaled _norm are medium resolution arrays
+- the fine _cons layers are only computed for requested windows. Within a
+  medium cell a fine cell of _cons is either the _norm value or 0, so the
+  range used to rescale _cons, and its summaries, follow from counts of
+  R_constraint values per medium cell computed once at start-up.
+- as in the script, which switches to the R_constraint region first, a
+  user preference is added at fine resolution. The ranges used to rescale
+  the preference layers follow from the range of the preference within
+  each medium cell, also computed once at start-up.
+"""
+
+import functools
+from dataclasses import dataclass
+from pathlib import Path
+
+import geotiff
+import numpy as np
+import ops
+import tiles
+from grid import resample
+from model import INDICES
+
+# scenario weight options and the index each one weights, in the order of
+# the scenario name
+WEIGHTS = {
+    "transit": "transit_index_norm",
+    "safety": "safety_index_norm",
+    "service": "service_improvement_index_norm",
+    "expansion": "expansion_index_norm",
+    "profit": "profitability_index_norm",
+}
+
+# medium resolution layers of a scenario, the rest are fine resolution
+MEDIUM_LAYERS = ("index", "norm")
+FINE_LAYERS = ("cons", "cons_norm", "norm_pref_norm", "cons_norm_pref_norm")
+
+# fine rows read at a time when computing statistics per medium cell
+STAT_ROWS = 1024
+
+
+def scenario_name(weights):
+    """Name of a scenario as calculate_suitability.sh, e.g. index_tra20_saf20_..."""
+    w = weights
+    return (
+        f"index_tra{w['transit']}_saf{w['safety']}_ser{w['service']}"
+        f"_exp{w['expansion']}_pro{w['profit']}"
+    )
+
+
+def weighted_sum(layers, factors):
+    """Sum of each layer times its factor, accumulated in float32 in order.
+
+    Scenarios and sweeps both weight the indices this way, so that their
+    rescaled values, truncated as r.rescale, agree cell for cell.
+    """
+    total = None
+    for layer, factor in zip(layers, factors):
+        term = np.asarray(layer, dtype=np.float32) * np.asarray(factor, dtype=np.float32)
+        if total is None:
+            total = term
+        else:
+            total += term
+    return total
+
+
+def _bounds(*arrays):
+    """(min, max) over the non-NaN values of arrays, None if there are none"""
+    values = np.concatenate([np.ravel(a) for a in arrays])
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return None
+    return float(values.min()), float(values.max())
+
+
+@dataclass
+class Scenario:
+    """A computed scenario.
+
+    Attributes:
+    name: scenario name, with the user preference appended if any
+    weights: weight by option name, in percent
+    index, norm: weighted index and its rescaled values, medium resolution
+    cons_bounds: range of norm * R_constraint, used to rescale it
+    pref: name of the user preference, or None
+    pref_factor: factor of the user preference, pref_weight / 100
+    pref_bounds: range of norm + weighted pref floored at 0, or None
+    pref_cons_bounds: range of cons_norm + weighted pref floored at 0, or None
+    """
+
+    name: str
+    weights: dict
+    index: np.ndarray
+    norm: np.ndarray
+    cons_bounds: tuple
+    pref: str = None
+    pref_factor: float = None
+    pref_bounds: tuple = None
+    pref_cons_bounds: tuple = None
+
+
+class ScenarioEngine:
+    """Computes scenarios from the layers written by make_rasters.
+
+    Attributes:
+    raster_dir: output directory of make_rasters build
+    medium, fine: Grids of the indices and of R_constraint
+    indices: memory maps of the five *_index_norm layers by name
+    constraint: memory map of R_constraint
+    prefs: memory maps of the user preference rasters resampled to the fine
+        grid, by name
+    pref_ranges: {name: {cells: (min, max)}} of each user preference per
+        medium cell, over all its fine cells and those where R_constraint
+        is 1 ("one") and 0 ("zero")
+    n_one, n_zero: fine cells of R_constraint equal to 1 and 0 per medium cell
+    """
+
+    def __init__(self, raster_dir, prefs=None, cache_size=32):
+        self.raster_dir = Path(raster_dir)
+
+        medium = self._store("tiles_medium", INDICES)
+        fine = self._store("tiles", ["R_constraint"])
+        self.medium, self.fine = medium.grid, fine.grid
+        self.indices = {name: medium.layer(name) for name in INDICES}
+        self.constraint = fine.layer("R_constraint")
+
+        # medium row and column of every fine row and column
+        self._rows, _, self._rows_in = self.medium.rowcol(
+            np.full(self.fine.rows, self.medium.xmin), self.fine.y()
+        )
+        _, self._cols, self._cols_in = self.medium.rowcol(
+            self.fine.x(), np.full(self.fine.cols, self.medium.ymax)
+        )
+        self.n_one, self.n_zero = self._count_constraint()
+
+        self.prefs = {}
+        self.pref_ranges = {}
+        for name, path in (prefs or {}).items():
+            self.prefs[name] = self._import_pref(fine, name, path)
+            self.pref_ranges[name] = self._pref_ranges(self.prefs[name])
+
+        # scenario(transit, safety, service, expansion, profit, pref=None,
+        # pref_weight=100) keeps the cache_size most recent scenarios
+        self.scenario = functools.lru_cache(maxsize=cache_size)(self._scenario)
+
+    def _store(self, dirname, names):
+        """TileStore under raster_dir holding names, imported from their GeoTIFFs"""
+        path = self.raster_dir.joinpath(dirname)
+        if path.joinpath("grid.json").exists():
+            store = tiles.TileStore.open(path)
+        else:
+            grid = geotiff.read_grid(self.raster_dir.joinpath(f"{names[0]}.tif"))
+            store = tiles.TileStore.create(path, grid)
+        for name in names:
+            # layers rebuilt since they were imported are imported again
+            tif = self.raster_dir.joinpath(f"{name}.tif")
+            if name not in store or (
+                tif.exists() and store.layer_path(name).stat().st_mtime < tif.stat().st_mtime
+            ):
+                store.import_geotiff(name, tif)
+        return store
+
+    def _import_pref(self, store, name, path):
+        """Resample a user preference raster into the fine store, in strips"""
+        array, grid = geotiff.read(path)
+        layer = store.create_layer(f"pref_{name}")
+        for r0 in range(0, self.fine.rows, STAT_ROWS):
+            rows = min(STAT_ROWS, self.fine.rows - r0)
+            layer[r0 : r0 + rows] = resample(
+                array, grid, self.fine.window(r0, 0, rows, self.fine.cols)
+            )
+        layer.flush()
+        return layer
+
+    def _pref_ranges(self, pref):
+        # float32 as the layers, so that the bounds match the window values
+        lo = {c: np.full(self.medium.size, np.nan, np.float32) for c in ("all", "one", "zero")}
+        hi = {c: np.full(self.medium.size, np.nan, np.float32) for c in lo}
+        cols = self._cols[self._cols_in]
+        for r0 in range(0, self.fine.rows, STAT_ROWS):
+            rows = slice(r0, min(r0 + STAT_ROWS, self.fine.rows))
+            keep = self._rows_in[rows]
+            values = np.asarray(pref[rows])[keep][:, self._cols_in]
+            constraint = np.asarray(self.constraint[rows])[keep][:, self._cols_in]
+            idx = self._rows[rows][keep][:, None] * self.medium.cols + cols[None, :]
+            valid = ~np.isnan(values)
+            for cells, select in (
+                ("all", valid),
+                ("one", valid & (constraint == 1)),
+                ("zero", valid & (constraint == 0)),
+            ):
+                np.fmin.at(lo[cells], idx[select], values[select])
+                np.fmax.at(hi[cells], idx[select], values[select])
+        return {
+            cells: (lo[cells].reshape(self.medium.shape), hi[cells].reshape(self.medium.shape))
+            for cells in lo
+        }
+
+    def _count_constraint(self):
+        n_one = np.zeros(self.medium.size, dtype=np.int64)
+        n_zero = np.zeros(self.medium.size, dtype=np.int64)
+        cols = self._cols[self._cols_in]
+        for r0 in range(0, self.fine.rows, STAT_ROWS):
+            rows = slice(r0, min(r0 + STAT_ROWS, self.fine.rows))
+            keep = self._rows_in[rows]
+            values = np.asarray(self.constraint[rows])[keep][:, self._cols_in]
+            idx = self._rows[rows][keep][:, None] * self.medium.cols + cols[None, :]
+            n_one += np.bincount(idx[values == 1], minlength=self.medium.size)
+            n_zero += np.bincount(idx[values == 0], minlength=self.medium.size)
+        return n_one.reshape(self.medium.shape), n_zero.reshape(self.medium.shape)
+
+    def cons_values(self, norm, bounds=None):
+        """Values of norm * R_constraint, rescaled if bounds is given.
+
+        Returns:
+        one, zero - medium arrays of the value of the fine cells where
+        R_constraint is 1 and 0, NaN where there are none
+        """
+        one = np.where(self.n_one > 0, norm, np.nan)
+        zero = np.where((self.n_zero > 0) & ~np.isnan(norm), 0, np.nan)
+        if bounds is not None:
+            one, zero = ops.rescale(one, bounds=bounds), ops.rescale(zero, bounds=bounds)
+        return one, zero
+
+    def _scenario(
+        self, transit, safety, service, expansion, profit, pref=None, pref_weight=100
+    ):
+        weights = {
+            "transit": transit,
+            "safety": safety,
+            "service": service,
+            "expansion": expansion,
+            "profit": profit,
+        }
+        # calculate_suitability.sh builds each factor as 0.<weight>, which is
+        # weight / 100 for the two digit weights it is meant for
+        index = weighted_sum(
+            [self.indices[WEIGHTS[k]] for k in weights], [w / 100 for w in weights.values()]
+        )
+        norm = ops.rescale(index)
+        cons_bounds = _bounds(*self.cons_values(norm))
+        scenario = Scenario(scenario_name(weights), weights, index, norm, cons_bounds)
+
+        if pref is not None:
+            if pref not in self.prefs:
+                raise KeyError(f"unknown user preference {pref}")
+            scenario.name += f"_{pref}{pref_weight}"
+            scenario.pref = pref
+            # The script divides the weight with integer arithmetic for the
+            # _cons layer; both layers use pref_weight / 100 here
+            factor = scenario.pref_factor = pref_weight / 100
+            ranges = self.pref_ranges[pref]
+
+            def floored(values, cells):
+                # lowest and highest values + factor * pref in each medium cell
+                lo, hi = ranges[cells] if factor >= 0 else ranges[cells][::-1]
+                return np.maximum(values + factor * lo, 0), np.maximum(values + factor * hi, 0)
+
+            one, zero = self.cons_values(norm, cons_bounds)
+            scenario.pref_bounds = _bounds(*floored(norm, "all"))
+            scenario.pref_cons_bounds = _bounds(*floored(one, "one"), *floored(zero, "zero"))
+        return scenario
+
+    def grid(self, layer):
+        if layer in MEDIUM_LAYERS:
+            return self.medium
+        if layer in FINE_LAYERS:
+            return self.fine
+        raise KeyError(f"unknown layer {layer}")
+
+    def medium_window(self, rows, cols):
+        """Medium (row slice, col slice) covering the fine rows and cols slices"""
+        r = self._rows[rows][self._rows_in[rows]]
+        c = self._cols[cols][self._cols_in[cols]]
+        if len(r) == 0 or len(c) == 0:
+            return slice(0, 0), slice(0, 0)
+        return slice(int(r.min()), int(r.max()) + 1), slice(int(c.min()), int(c.max()) + 1)
+
+    def fine_window(self, scenario, layer, rows, cols):
+        """A fine layer of scenario over the fine rows and cols slices"""
+        norm = np.full((rows.stop - rows.start, cols.stop - cols.start), np.nan, np.float32)
+        r_in, c_in = self._rows_in[rows], self._cols_in[cols]
+        norm[np.ix_(r_in, c_in)] = scenario.norm[
+            np.ix_(self._rows[rows][r_in], self._cols[cols][c_in])
+        ]
+        if layer in ("norm_pref_norm", "cons_norm_pref_norm"):
+            if scenario.pref is None:
+                raise KeyError(f"{layer} needs a user preference")
+            pref = np.asarray(self.prefs[scenario.pref][rows, cols]) * scenario.pref_factor
+        if layer == "norm_pref_norm":
+            return ops.rescale(np.maximum(norm + pref, 0), bounds=scenario.pref_bounds)
+
+        cons = norm * np.asarray(self.constraint[rows, cols])
+        if layer == "cons":
+            return cons
+        cons_norm = ops.rescale(cons, bounds=scenario.cons_bounds)
+        if layer == "cons_norm":
+            return cons_norm
+        return ops.rescale(np.maximum(cons_norm + pref, 0), bounds=scenario.pref_cons_bounds)
+
+    def window(self, scenario, layer, bbox=None):
+        """A layer of scenario over bbox (xmin, ymin, xmax, ymax), all if None.
+
+        Returns:
+        array, grid
+        """
+        grid = self.grid(layer)
+        if bbox is None:
+            rows, cols = slice(0, grid.rows), slice(0, grid.cols)
+        else:
+            xmin, ymin, xmax, ymax = bbox
+            (r0, r1), (c0, c1), _ = grid.rowcol([xmin, xmax], [ymax, ymin])
+            r0, r1, c0, c1 = int(r0), int(r1), int(c0), int(c1)
+            rows = slice(max(r0, 0), min(r1 + 1, grid.rows))
+            cols = slice(max(c0, 0), min(c1 + 1, grid.cols))
+            if rows.start >= rows.stop or cols.start >= cols.stop:
+                raise ValueError(f"bbox {bbox} does not intersect {layer}")
+        window = grid.window(rows.start, cols.start, rows.stop - rows.start, cols.stop - cols.start)
+
+        if layer in MEDIUM_LAYERS:
+            return getattr(scenario, layer)[rows, cols], window
+        return self.fine_window(scenario, layer, rows, cols), window
+
+    def summary(self, scenario, top=10):
+        """Statistics of the medium and fine layers and the top medium cells.
+
+        Fine statistics are weighted by the number of fine cells of each
+        value, so they describe the whole _cons_norm raster.
+        """
+
+        def stats(values, weights=None):
+            keep = ~np.isnan(values)
+            values = values[keep]
+            weights = None if weights is None else weights[keep]
+            if len(values) == 0:
+                return {"cells": 0}
+            hist, edges = np.histogram(values, bins=10, range=(1, 101), weights=weights)
+            return {
+                "cells": int(len(values) if weights is None else weights.sum()),
+                "min": float(values.min()),
+                "max": float(values.max()),
+                "mean": float(np.average(values, weights=weights)),
+                "histogram": {"edges": edges.tolist(), "counts": hist.astype(int).tolist()},
+            }
+
+        one, zero = self.cons_values(scenario.norm, scenario.cons_bounds)
+        result = {
+            "name": scenario.name,
+            "weights": scenario.weights,
+            "norm": stats(scenario.norm.ravel()),
+            "cons_norm": stats(
+                np.concatenate([one.ravel(), zero.ravel()]),
+                np.concatenate([self.n_one.ravel(), self.n_zero.ravel()]),
+            ),
+        }
+
+        # medium cells with the best constrained suitability
+        order = np.argsort(np.where(np.isnan(one), -np.inf, one), axis=None)[::-1][:top]
+        order = order[~np.isnan(one.ravel()[order])]
+        rows, cols = np.divmod(order, self.medium.cols)
+        result["top"] = [
+            {"x": float(x), "y": float(y), "cons_norm": float(v), "cells": int(n)}
+            for x, y, v, n in zip(
+                self.medium.x(cols),
+                self.medium.y(rows),
+                one.ravel()[order],
+                self.n_one.ravel()[order],
+            )
+        ]
+        return result
@@ -0,0 +1,124 @@
+"""Batch sensitivity analysis of the scenario weights
+
+Many weight vectors are evaluated at once: the five *_index_norm layers
+are stacked into a 5 x cells matrix, so a chunk of scenarios is a single
+(scenarios x cells) weighted sum, rescaled row by row as r.rescale.
+Per cell statistics are accumulated across all scenarios: the mean and
+variance of the rescaled index and how often the cell ranks in the top k.
+"""
+
+import itertools
+
+import numpy as np
+from scenarios import WEIGHTS, weighted_sum
+
+# scenario x cell values held at once
+CHUNK_VALUES = 1 << 24
+
+
+def weight_grid(step=10, total=100):
+    """Every weight vector of multiples of step summing to total.
+
+    Returns:
+    (scenarios, 5) array of weights in percent, columns ordered as WEIGHTS
+
+    Raises:
+    ValueError if step is not a positive divisor of total
+    """
+    if step <= 0 or total % step != 0:
+        raise ValueError(f"step must be a positive divisor of {total}, not {step}")
+    n = total // step
+    vectors = [
+        np.diff((-1,) + bars + (n + len(WEIGHTS) - 1,)) - 1
+        for bars in itertools.combinations(range(n + len(WEIGHTS) - 1), len(WEIGHTS) - 1)
+    ]
+    return np.array(vectors, dtype=np.float64) * step
+
+
+def weight_samples(n, seed=0, concentration=1.0):
+    """Weight vectors sampled uniformly (concentration 1) from the simplex.
+
+    Returns:
+    (n, 5) array of weights in percent summing to 100
+    """
+    rng = np.random.default_rng(seed)
+    return rng.dirichlet(np.full(len(WEIGHTS), concentration), size=n) * 100
+
+
+class Sweep:
+    """Statistics of many scenarios over the cells of a ScenarioEngine.
+
+    Attributes:
+    cells: flat indices of the medium cells ranked: those with all five
+        indices and, if constrained, with R_constraint cells equal to 1
+    mean, var: mean and variance of the rescaled index per cell
+    top_freq: fraction of scenarios ranking each cell in their top k
+    top: (scenarios, k) cells of the top k of each scenario, best first
+    """
+
+    def __init__(self, engine, weights, k=500, constrained=True):
+        self.engine = engine
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+        stack = np.stack([np.asarray(engine.indices[WEIGHTS[w]]).ravel() for w in WEIGHTS])
+        valid = ~np.isnan(stack).any(axis=0)
+        # every valid cell is rescaled, as r.rescale over the whole layer,
+        # but only the cells in self.cells are ranked and summarised
+        self._values = stack[:, valid]
+        ranked = engine.n_one.ravel()[valid] > 0 if constrained else np.ones(valid.sum(), bool)
+        self._ranked = np.flatnonzero(ranked)
+        self.cells = np.flatnonzero(valid)[self._ranked]
+        self.k = min(k, len(self.cells))
+
+    def run(self):
+        n_scenarios, n_cells = len(self.weights), len(self.cells)
+        total = np.zeros(n_cells)
+        total_sq = np.zeros(n_cells)
+        top_count = np.zeros(n_cells, dtype=np.int64)
+        self.top = np.empty((n_scenarios, self.k), dtype=np.int64)
+
+        chunk = max(1, CHUNK_VALUES // max(self._values.shape[1], 1))
+        for start in range(0, n_scenarios, chunk):
+            w = self.weights[start : start + chunk] / 100
+            # summed as ScenarioEngine.scenario, so that the truncated values match
+            index = weighted_sum(self._values[:, None, :], w.T[:, :, None])
+            # rescale to 1..100 and truncate as r.rescale, with the range of
+            # every valid cell but only for the ranked ones
+            vmin = index.min(axis=1, keepdims=True)
+            vmax = index.max(axis=1, keepdims=True)
+            scale = 99 / np.where(vmax > vmin, vmax - vmin, 1)
+            index = index[:, self._ranked]
+            norm = index - vmin
+            norm *= scale
+            norm += 1
+            np.trunc(norm, out=norm)
+            total += norm.sum(axis=0, dtype=np.float64)
+            norm *= norm
+            total_sq += norm.sum(axis=0, dtype=np.float64)
+
+            # rank on the index itself, as truncation to 1..100 makes ties
+            top = np.argpartition(-index, self.k - 1, axis=1)[:, : self.k]
+            order = np.argsort(-np.take_along_axis(index, top, axis=1), axis=1)
+            self.top[start : start + len(w)] = np.take_along_axis(top, order, axis=1)
+            top_count += np.bincount(top.ravel(), minlength=n_cells)
+
+        self.mean = total / n_scenarios
+        self.var = np.maximum(total_sq / n_scenarios - self.mean**2, 0)
+        self.top_freq = top_count / n_scenarios
+        return self
+
+    def consensus(self):
+        """The k cells most often in the top k, most frequent first"""
+        return np.argsort(-self.top_freq, kind="stable")[: self.k]
+
+    def overlap(self):
+        """Fraction of each scenario's top k that is in the consensus top k"""
+        consensus = np.zeros(len(self.cells), dtype=bool)
+        consensus[self.consensus()] = True
+        return consensus[self.top].mean(axis=1)
+
+    def raster(self, values):
+        """Values over the evaluated cells as a medium raster, NaN elsewhere"""
+        out = np.full(self.engine.medium.size, np.nan, dtype=np.float32)
+        out[self.cells] = values
+        return out.reshape(self.engine.medium.shape)
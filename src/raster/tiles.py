@@ -0,0 +1,259 @@
+"""Tiled, memory-mapped execution of raster operators
+
+Fine resolution layers are kept as .npy files in a TileStore and opened
+as memory maps, so only the tiles being worked on are in RAM. map_tiles
+runs a function over the tiles in a process pool: each task reads its
+tile plus a halo from the input layers and writes the tile core to the
+output layers, so neighbourhood and distance operators see the cells
+they need around each tile. Tiles never overlap on output, so workers
+write to the shared memory maps without locking.
+"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import edt
+import geotiff
+import numpy as np
+import ops
+from grid import Grid
+
+# rows and columns of the core of a tile, without its halo
+TILE_SIZE = 2048
+
+# rows written per chunk when filling a new layer
+FILL_ROWS = 1024
+
+
+def windows(shape, tile_size=TILE_SIZE):
+    """(row_slice, col_slice) of every tile of a raster of shape"""
+    rows, cols = shape
+    return [
+        (slice(r0, min(r0 + tile_size, rows)), slice(c0, min(c0 + tile_size, cols)))
+        for r0 in range(0, rows, tile_size)
+        for c0 in range(0, cols, tile_size)
+    ]
+
+
+class TileStore:
+    """Directory of memory-mapped layers sharing a Grid.
+
+    Each layer is a <name>.npy file and the grid is stored in grid.json, so
+    a store can be reopened by path, e.g. in a worker process.
+
+    Attributes:
+    path: directory of the store
+    grid: Grid of every layer
+    """
+
+    def __init__(self, path, grid):
+        self.path = Path(path)
+        self.grid = grid
+        self._layers = {}
+
+    @classmethod
+    def create(cls, path, grid):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path.joinpath("grid.json"), "w") as f:
+            json.dump(vars(grid), f)
+        return cls(path, grid)
+
+    @classmethod
+    def open(cls, path):
+        with open(Path(path).joinpath("grid.json")) as f:
+            return cls(path, Grid(**json.load(f)))
+
+    def __getstate__(self):
+        # memory maps are reopened rather than pickled
+        return {"path": self.path, "grid": self.grid}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["grid"])
+
+    def __contains__(self, name):
+        return self.layer_path(name).exists()
+
+    def layer_path(self, name):
+        return self.path.joinpath(f"{name}.npy")
+
+    def create_layer(self, name, dtype=np.float32, fill=np.nan):
+        """Create an empty layer filled with fill; returns its memory map"""
+        layer = np.lib.format.open_memmap(
+            self.layer_path(name), mode="w+", dtype=dtype, shape=self.grid.shape
+        )
+        for r0 in range(0, self.grid.rows, FILL_ROWS):
+            layer[r0 : r0 + FILL_ROWS] = fill
+        layer.flush()
+        self._layers[name] = layer
+        return layer
+
+    def layer(self, name):
+        """Memory map of a layer, opened for reading and writing"""
+        if name not in self._layers:
+            self._layers[name] = np.load(self.layer_path(name), mmap_mode="r+")
+        return self._layers[name]
+
+    def import_geotiff(self, name, path):
+        """Copy a GeoTIFF on the grid of the store into a layer, in strips"""
+        grid = geotiff.read_grid(path)
+        if grid != self.grid:
+            raise ValueError(f"{path} is on {grid}, not on {self.grid}")
+        layer = self.create_layer(name)
+        for r0 in range(0, grid.rows, FILL_ROWS):
+            rows = min(FILL_ROWS, grid.rows - r0)
+            layer[r0 : r0 + rows], _ = geotiff.read(path, (r0, 0, rows, grid.cols))
+        layer.flush()
+        return layer
+
+    def remove(self, name):
+        self._layers.pop(name, None)
+        self.layer_path(name).unlink(missing_ok=True)
+
+    def windows(self, tile_size=TILE_SIZE):
+        """(row_slice, col_slice) of every tile core"""
+        return windows(self.grid.shape, tile_size)
+
+
+# state of a map_tiles call in each worker process, set by _init_worker so
+# that large arguments such as GeoDataFrames are pickled once per worker
+_task = {}
+
+
+def _init_worker(func, store, inputs, outputs, halo, kwargs):
+    _task.update(
+        func=func, store=store, inputs=inputs, outputs=outputs, halo=halo, kwargs=kwargs
+    )
+
+
+def _run_tile(window):
+    store, halo = _task["store"], _task["halo"]
+    rows, cols = window
+    r0, c0 = max(rows.start - halo, 0), max(cols.start - halo, 0)
+    r1 = min(rows.stop + halo, store.grid.rows)
+    c1 = min(cols.stop + halo, store.grid.cols)
+
+    arrays = {
+        name: np.array(store.layer(name)[r0:r1, c0:c1]) for name in _task["inputs"]
+    }
+    grid = store.grid.window(r0, c0, r1 - r0, c1 - c0)
+    results = _task["func"](grid, arrays, **_task["kwargs"])
+
+    core = (
+        slice(rows.start - r0, rows.stop - r0),
+        slice(cols.start - c0, cols.stop - c0),
+    )
+    for name in _task["outputs"]:
+        layer = store.layer(name)
+        layer[rows, cols] = results[name][core]
+        layer.flush()
+
+
+def map_tiles(
+    func,
+    store,
+    inputs,
+    outputs,
+    halo=0,
+    tile_size=TILE_SIZE,
+    workers=None,
+    **kwargs,
+):
+    """Run func over every tile of store, in a process pool.
+
+    Arguments:
+    func - module level function func(grid, arrays, **kwargs), where grid is
+        the Grid of the tile with its halo and arrays the input windows by
+        name; returns a dict of arrays over the same window by output name
+    store - TileStore of the inputs and outputs
+    inputs - names of the layers read, with a halo
+    outputs - names of the layers written; created if missing
+    halo - cells read around each tile
+    tile_size - rows and columns of each tile core
+    workers - processes to use, by default one per CPU; 1 runs in process
+    kwargs - passed to func, pickled once per worker
+    """
+    for name in outputs:
+        if name not in store:
+            store.create_layer(name)
+    windows = store.windows(tile_size)
+    workers = min(workers or os.cpu_count() or 1, len(windows))
+    initargs = (func, store, list(inputs), list(outputs), halo, kwargs)
+
+    if workers <= 1:
+        _init_worker(*initargs)
+        for window in windows:
+            _run_tile(window)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=initargs
+    ) as pool:
+        # consume the results so that exceptions in workers are raised here
+        list(pool.map(_run_tile, windows))
+    store._layers.clear()
+
+
+def _distance_constraints_tile(grid, arrays, features, constraints, cells, dist_halo):
+    dist = edt.window_distance(~np.isnan(arrays[features]), grid.res, dist_halo)
+    if cells is not None:
+        dist[np.isnan(arrays[cells]) | (arrays[cells] == 0)] = np.nan
+    return {
+        name: ops.dist_constraint(dist, lo, hi)
+        for name, (lo, hi) in constraints.items()
+    }
+
+
+def distance_constraints(
+    store, features, constraints, cells=None, tile_size=TILE_SIZE, workers=None
+):
+    """ops.distance_constraints over the layers of a TileStore.
+
+    Arguments:
+    store - TileStore holding features and cells
+    features - name of the layer whose non-NaN cells are features
+    constraints - dict of the form {output name: (min_dist, max_dist)}
+    cells - name of a mask layer, NaN or 0 outside the cells to compute
+    """
+    halo = edt.halo_cells(max(hi for _, hi in constraints.values()), store.grid.res)
+    map_tiles(
+        _distance_constraints_tile,
+        store,
+        [features] + ([cells] if cells else []),
+        list(constraints),
+        halo=halo,
+        tile_size=tile_size,
+        workers=workers,
+        features=features,
+        constraints=constraints,
+        cells=cells,
+        dist_halo=halo,
+    )
+
+
+def _neighborhood_tile(grid, arrays, names, kernel):
+    sums = ops.neighborhood_sums([arrays[name] for name in names], kernel)
+    return dict(zip(names.values(), sums))
+
+
+def neighborhood_sums(store, names, kernel, tile_size=TILE_SIZE, workers=None):
+    """ops.neighborhood_sums over the layers of a TileStore.
+
+    Arguments:
+    store - TileStore holding the inputs
+    names - dict of the form {input name: output name}
+    kernel - odd sized boolean window
+    """
+    map_tiles(
+        _neighborhood_tile,
+        store,
+        list(names),
+        list(names.values()),
+        halo=kernel.shape[0] // 2,
+        tile_size=tile_size,
+        workers=workers,
+        names=names,
+        kernel=kernel,
+    )